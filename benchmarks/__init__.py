@@ -0,0 +1,4 @@
+"""
+Client-side benchmarks for ESMA Chat
+Run individual modules with `python -m benchmarks.<name>`
+"""
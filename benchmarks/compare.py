@@ -0,0 +1,52 @@
+"""
+Compare two benchmark result files written by benchmarks.suite
+
+Usage:
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+"""
+
+import argparse
+import json
+from typing import Dict
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves keyed by dotted path, skipping run metadata"""
+    flat = {}
+    for key, value in results.items():
+        if not prefix and key == "meta":
+            continue
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = float(value)
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change to flag")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline  {baseline['meta'].get('revision')}  {baseline['meta'].get('timestamp')}")
+    print(f"candidate {candidate['meta'].get('revision')}  {candidate['meta'].get('timestamp')}")
+
+    old = flatten(baseline)
+    new = flatten(candidate)
+    for path in sorted(old.keys() & new.keys()):
+        before, after = old[path], new[path]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = "  <--" if abs(change) >= args.threshold else ""
+        print(f"{path:55s} {before:14.6g} {after:14.6g} {change:+8.1f}%{flag}")
+
+
+if __name__ == "__main__":
+    main()
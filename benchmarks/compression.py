@@ -0,0 +1,103 @@
+"""
+Compressed answer streams: bytes on the wire vs decoded
+
+Streams the same answer (text, SQL and a table event) from a mock backend
+that compresses with each Content-Encoding in turn, and reports bytes on the
+wire against decoded bytes, time to first render and answer duration. The
+mock flushes its compressor after every event, so time to first render must
+stay close to the uncompressed one; a large gap means events are held back
+by buffering. Every answer is checked against what the mock sent.
+
+br and zstd are skipped when the `brotli` or `zstandard` package is missing.
+
+Usage:
+    python -m benchmarks.compression --requests 20 --chunks 300 --table-rows 500
+"""
+
+import argparse
+import json
+import sys
+import time
+from dataclasses import replace
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer, table_payload
+from benchmarks.suite import percentiles
+from src.client import get_api_response_streaming
+from src.compression import decoder_available
+from src.metrics import registry
+from src.tables import table_from_json
+
+ENCODINGS = ["identity", "gzip", "br", "zstd"]
+
+
+def run(encoding: str, base: MockConfig, requests: int) -> dict:
+    config = replace(base, compression="" if encoding == "identity" else encoding)
+    expected = expected_answer(config)
+    table = table_from_json(table_payload(config)) if config.table_rows else None
+    first_renders, durations, correct = [], [], 0
+
+    with MockBackend(config) as backend:
+        for i in range(requests):
+            placeholder = FakePlaceholder()
+            start = time.perf_counter()
+            answer = get_api_response_streaming("pregunta", f"compression-{encoding}-{i}", placeholder, backend.url)
+            durations.append(time.perf_counter() - start)
+            if placeholder.first_render is not None:
+                first_renders.append(placeholder.first_render - start)
+            tables = getattr(answer, "tables", ())
+            text_ok = answer.startswith(expected) if table is not None else answer == expected
+            tables_ok = len(tables) == 1 and tables[0].equals(table) if table is not None else not tables
+            correct += text_ok and tables_ok
+        url = backend.url
+
+    snapshot = registry.snapshot()
+    wire = snapshot["histograms"]["esma_response_bytes"][url]["sum"]
+    decoded = snapshot["histograms"]["esma_response_decoded_bytes"][url]["sum"]
+    return {
+        "encoding": encoding,
+        "negotiated": snapshot["counters"]["esma_response_encodings_total"][url],
+        "requests": requests,
+        "correct": correct,
+        "wire_bytes": wire / requests,
+        "decoded_bytes": decoded / requests,
+        "ratio": decoded / wire if wire else None,
+        "first_render": percentiles(first_renders),
+        "seconds": percentiles(durations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--interval", type=float, default=0.002, help="Seconds between mock events")
+    parser.add_argument("--table-rows", type=int, default=500)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    config = replace(MockConfig(), chunks=args.chunks, interval=args.interval, table_rows=args.table_rows)
+    results = []
+    for encoding in ENCODINGS:
+        if encoding != "identity" and not decoder_available(encoding):
+            print(f"{encoding}: skipped, decoder package not installed")
+            continue
+        results.append(run(encoding, config, args.requests))
+
+    print(f"{'encoding':<9} {'wire B':>9} {'decoded B':>10} {'ratio':>6} {'1st render p50 ms':>18}"
+          f" {'p95':>7} {'answer p50 ms':>14}  check")
+    for r in results:
+        ok = r["correct"] == r["requests"]
+        print(f"{r['encoding']:<9} {r['wire_bytes']:>9.0f} {r['decoded_bytes']:>10.0f} {r['ratio']:>6.2f}"
+              f" {r['first_render']['p50'] * 1000:>18.2f} {r['first_render']['p95'] * 1000:>7.2f}"
+              f" {r['seconds']['p50'] * 1000:>14.1f}  {'ok' if ok else 'FAIL'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(r["correct"] == r["requests"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Stand-ins for Streamlit elements used by the client
+"""
+
+import time
+from typing import Callable, List, Optional
+
+
+class FakePlaceholder:
+    """
+    Records what the client renders instead of sending it to a browser
+
+    `markdown` encodes the body to UTF-8 to approximate the serialization cost
+    of a real delta, and tracks call count, characters rendered and time spent.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self.created = clock()
+        self.first_render: Optional[float] = None
+        self.renders = 0
+        self.rendered_chars = 0
+        self.render_seconds = 0.0
+        self.last = ""
+        self.messages: List[tuple] = []
+        self.tables: list = []
+
+    def markdown(self, body: str, **kwargs):
+        start = self._clock()
+        if self.first_render is None:
+            self.first_render = start
+        body.encode("utf-8")
+        self.renders += 1
+        self.rendered_chars += len(body)
+        self.last = body
+        self.render_seconds += self._clock() - start
+
+    def dataframe(self, data, **kwargs):
+        self.tables.append(data)
+
+    def container(self) -> "FakePlaceholder":
+        # Elements drawn into the container or its slots are recorded here too
+        return self
+
+    def empty(self) -> "FakePlaceholder":
+        return self
+
+    def _message(self, kind: str, body: str, **kwargs):
+        self.messages.append((kind, body))
+        self.last = body
+
+    def error(self, body: str, **kwargs):
+        self._message("error", body)
+
+    def warning(self, body: str, **kwargs):
+        self._message("warning", body)
+
+    def info(self, body: str, **kwargs):
+        self._message("info", body)
+
+    @property
+    def time_to_first_render(self) -> Optional[float]:
+        if self.first_render is None:
+            return None
+        return self.first_render - self.created
@@ -0,0 +1,325 @@
+"""
+Multi-session load test of the Streamlit UI process
+
+Drives N simulated analysts through main.py with Streamlit's AppTest, all
+in one process like the sessions of one container, against a local mock
+/chat/stream backend. Each session logs in, then asks --questions questions
+one after another. Every concurrency level runs in a fresh worker process,
+so its memory and CPU are not mixed with earlier levels or with the mock
+backend, which stays in the parent process.
+
+Reported per level:
+  - memory per session: resident memory growth of the worker divided by sessions,
+    and the conversation windows the store keeps per session
+  - CPU per session and per answer, and the worker's CPU utilization
+  - p50/p95/p99 time to first render (question submitted -> first answer output drawn)
+  - p50/p95/p99 render lag (new answer output -> drawn in the session)
+  - p50/p95/p99 backend request duration
+
+Timings and answer counts are read from the worker's metrics registry
+(esma_time_to_first_render_seconds, esma_render_lag_seconds,
+esma_request_seconds, esma_requests_total), the same numbers the app
+exports, so percentiles are estimated within histogram buckets.
+
+Runs are reproducible: answers, question texts and think times are fixed by the
+flags and --seed, sessions start together, and the report records the flags,
+revision and machine. Compare reports taken on the same machine and flags.
+
+AppTest does not serialize deltas to a browser, so absolute numbers are a
+lower bound for a real server; the trend across levels is what sizes containers.
+
+Usage:
+    python -m benchmarks.loadtest --sessions 1 5 10 20 --questions 3 --output load.json
+    python -m benchmarks.loadtest --sessions 50 --chunks 400 --interval 0.02 --first-chunk-delay 1.5
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict
+from typing import List, Optional
+
+from benchmarks.mock_server import MockBackend, MockConfig, add_config_arguments, config_from_args
+from benchmarks.suite import git_revision
+
+# Streamlit releases whose AppTest internals allow_concurrent_apptests was checked against
+STREAMLIT_TESTED = ((1, 50), (1, 65))
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+PASSWORD = "loadtest"
+
+
+def rss_bytes() -> int:
+    """Current resident memory of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current outside Linux
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def question(seed: int, session: int, number: int) -> str:
+    rng = random.Random(f"{seed}-{session}-{number}")
+    survey = rng.choice(["ENAHO", "GEIH", "EPHC", "ENEMDU"])
+    year = rng.randrange(2015, 2025)
+    return f"¿Cuál fue la tasa de informalidad en la {survey} {year}? (sesión {session}, pregunta {number})"
+
+
+def allow_concurrent_apptests():
+    """
+    Let AppTest runs overlap on several threads of one process
+
+    AppTest assumes one run at a time: each run patches config.get_option for
+    its duration and installs a mock Runtime that it removes when it ends,
+    under any run still going on another thread. Patching get_option once for
+    the whole process makes every save/restore equivalent, and the latest mock
+    Runtime is kept available between runs.
+
+    This relies on AppTest internals, so other Streamlit releases than
+    STREAMLIT_TESTED are refused; run a single session per level there.
+
+    Raises:
+        RuntimeError: The installed Streamlit was not checked
+    """
+    from unittest.mock import patch
+    import streamlit
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1.util import build_mock_config_get_option
+
+    version = tuple(int(part) for part in streamlit.__version__.split(".")[:2])
+    if not STREAMLIT_TESTED[0] <= version <= STREAMLIT_TESTED[1] or not hasattr(Runtime, "_instance"):
+        low, high = (".".join(map(str, v)) for v in STREAMLIT_TESTED)
+        raise RuntimeError(
+            f"Concurrent AppTest sessions are only checked on Streamlit {low} to {high}, "
+            f"not {streamlit.__version__}; use --sessions 1"
+        )
+
+    patch.object(config, "get_option", new=build_mock_config_get_option({"global.appTest": True})).start()
+
+    latest = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+            return cls._instance
+        if latest:
+            return latest[0]
+        raise RuntimeError("Runtime hasn't been created!")
+
+    def exists(cls):
+        return cls._instance is not None or bool(latest)
+
+    patch.object(Runtime, "instance", classmethod(instance)).start()
+    patch.object(Runtime, "exists", classmethod(exists)).start()
+
+
+def run_session(index: int, args: argparse.Namespace, start: threading.Barrier, out: dict):
+    from streamlit.testing.v1 import AppTest
+
+    errors = 0
+    app = AppTest.from_file(MAIN, default_timeout=args.timeout)
+    try:
+        app.run()
+        app.text_input[0].input(PASSWORD).run()
+    except Exception as e:
+        out["exception"] = repr(e)
+    # Wait even after a failed login so the other sessions are not held back
+    start.wait()
+    try:
+        if "exception" in out:
+            raise RuntimeError("Login failed")
+        think = random.Random(f"{args.seed}-{index}-think")
+        for number in range(args.questions):
+            if number and args.think:
+                time.sleep(think.uniform(0, 2 * args.think))
+            app.chat_input[0].set_value(question(args.seed, index, number)).run()
+            # A run can end on a rerun request before the answer is stored
+            for _ in range(10):
+                if not app.session_state["is_processing"]:
+                    break
+                app.run()
+            # Failed backend requests are counted from the registry
+            if app.exception or app.session_state["is_processing"]:
+                errors += 1
+    except Exception as e:
+        errors += 1
+        out.setdefault("exception", repr(e))
+    out["errors"] = errors
+    # Keep the session alive until memory has been measured
+    out["app"] = app
+
+
+def worker(args: argparse.Namespace) -> dict:
+    """Run one concurrency level in this process and return its measurements"""
+    from streamlit.testing.v1 import AppTest
+    from src.conversations import get_conversation_store
+    from src.metrics import registry
+
+    if args.sessions > 1:
+        allow_concurrent_apptests()
+
+    # Imports, first script run and a warm connection pool are not per-session costs
+    warm = AppTest.from_file(MAIN, default_timeout=args.timeout)
+    warm.run()
+    del warm
+    gc.collect()
+
+    rss_before = rss_bytes()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+
+    start = threading.Barrier(args.sessions)
+    outputs: List[dict] = [{} for _ in range(args.sessions)]
+    threads = [
+        threading.Thread(target=run_session, args=(i, args, start, outputs[i]), name=f"session-{i}")
+        for i in range(args.sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    gc.collect()
+    rss_after = rss_bytes()
+    store = get_conversation_store().memory_report()
+
+    # One backend, and the warm-up run asked nothing, so every series is this level's
+    snapshot = registry.snapshot()
+    requests = {
+        outcome: value
+        for outcomes in snapshot["counters"].get("esma_requests_total", {}).values()
+        for outcome, value in outcomes.items()
+    }
+    answers = int(requests.pop("ok", 0))
+
+    def histogram(name: str) -> Optional[dict]:
+        series = list(snapshot["histograms"].get(name, {}).values())
+        return series[0] if series else None
+
+    return {
+        "sessions": args.sessions,
+        "answers": answers,
+        "errors": sum(out["errors"] for out in outputs) + int(sum(requests.values())),
+        "exceptions": [out["exception"] for out in outputs if "exception" in out][:5],
+        "wall_seconds": wall,
+        "memory": {
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "per_session_bytes": (rss_after - rss_before) / args.sessions,
+            "conversation_window_mean_bytes": store["mean_bytes"],
+        },
+        "cpu": {
+            "seconds": cpu,
+            "per_session_seconds": cpu / args.sessions,
+            "per_answer_seconds": cpu / answers if answers else None,
+            "utilization": cpu / wall,
+        },
+        "time_to_first_render": histogram("esma_time_to_first_render_seconds"),
+        "render_lag": histogram("esma_render_lag_seconds"),
+        "answer_seconds": histogram("esma_request_seconds"),
+    }
+
+
+def run_level(sessions: int, backend: MockBackend, args: argparse.Namespace, db_dir: str) -> dict:
+    """Run one level in a fresh worker process pointed at the mock backend"""
+    env = dict(
+        os.environ,
+        ESMA_BASE_URL=backend.url,
+        password=PASSWORD,
+        ESMA_CONVERSATION_DB=os.path.join(db_dir, f"conversations-{sessions}.sqlite3"),
+        PYTHONHASHSEED=str(args.seed),
+    )
+    command = [
+        sys.executable, "-m", "benchmarks.loadtest", "--worker",
+        "--sessions", str(sessions),
+        "--questions", str(args.questions),
+        "--think", str(args.think),
+        "--seed", str(args.seed),
+        "--timeout", str(args.timeout),
+    ]
+    result = subprocess.run(
+        command, env=env, capture_output=True, text=True,
+        cwd=os.path.dirname(MAIN), timeout=args.timeout * (args.questions + 2)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Worker for {sessions} sessions failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def fmt(stats: Optional[dict], key: str) -> str:
+    return f"{stats[key] * 1000:.1f}" if stats else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20],
+                        help="Concurrency levels to run")
+    parser.add_argument("--questions", type=int, default=3, help="Questions asked by each session")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="Mean seconds a session waits between questions (seeded)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds allowed for one script run")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    # Mock flags; --seed also fixes question texts and think times
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.sessions = args.sessions[0]
+        print(json.dumps(worker(args)))
+        return
+
+    config: MockConfig = config_from_args(args)
+    report = {"meta": {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "questions": args.questions,
+        "think": args.think,
+        "seed": args.seed,
+        "mock": asdict(config),
+        "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("ESMA_")},
+    }, "levels": []}
+
+    print(f"{'sessions':>8} {'answers':>7} {'errors':>6} {'MB/sess':>8} {'cpu ms/ans':>10} {'util':>5}"
+          f" {'ttfr p50':>8} {'p95':>7} {'p99':>7} {'lag p50':>8} {'p95':>7} {'p99':>7}")
+    with tempfile.TemporaryDirectory(prefix="esma-loadtest-") as db_dir, MockBackend(config) as backend:
+        for sessions in args.sessions:
+            level = run_level(sessions, backend, args, db_dir)
+            report["levels"].append(level)
+            ttfr, lag, cpu = level["time_to_first_render"], level["render_lag"], level["cpu"]
+            per_answer = cpu["per_answer_seconds"]
+            print(f"{sessions:>8} {level['answers']:>7} {level['errors']:>6}"
+                  f" {level['memory']['per_session_bytes'] / 1e6:>8.2f}"
+                  f" {per_answer * 1000 if per_answer is not None else float('nan'):>10.1f}"
+                  f" {cpu['utilization']:>5.2f}"
+                  f" {fmt(ttfr, 'p50'):>8} {fmt(ttfr, 'p95'):>7} {fmt(ttfr, 'p99'):>7}"
+                  f" {fmt(lag, 'p50'):>8} {fmt(lag, 'p95'):>7} {fmt(lag, 'p99'):>7}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Report written to {args.output}")
+    if any(level["errors"] for level in report["levels"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""
+Local stand-in for the agent's /chat/stream endpoint
+
+Serves SSE answers with configurable size, pacing and payload style so the
+client can be measured without the real backend. Runs in a background
+thread inside benchmarks, or standalone to point the UI at it:
+
+    python -m benchmarks.mock_server --port 8000 --chunks 300 --interval 0.02
+    ESMA_BASE_URL=http://127.0.0.1:8000 streamlit run main.py
+"""
+
+import argparse
+import base64
+import json
+import random
+import socket
+import threading
+import time
+import zlib
+from dataclasses import dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+
+from src.tables import table_from_json, table_to_ipc
+
+# Text pieces cycled to build answers; they include the quotes, newlines,
+# tabs and backslashes that make the API's repr() payloads awkward to parse
+TEXT_PIECES = [
+    "La tasa de desempleo en 2023 fue de 6.8%. ",
+    "| Región | Tasa |\n|---|---|\n| Lima | 7.1 |\n",
+    "SELECT region, AVG(ingreso) FROM enaho WHERE anio = 2023 GROUP BY region;\n",
+    "El término \"informalidad\" incluye a quienes no tienen seguro.\t",
+    "It's a \"mixed\" 'quote' chunk with a backslash \\ in it. ",
+]
+
+
+def repr_payload(text: str) -> str:
+    """Payload in the API's mixed-quote format: JSON keys, repr() value"""
+    return '{"type": "content", "content": %s}' % repr(text)
+
+
+def json_payload(text: str) -> str:
+    return json.dumps({"type": "content", "content": text})
+
+
+PAYLOADS = {
+    "repr": repr_payload,
+    "json": json_payload,
+}
+
+
+@dataclass
+class MockConfig:
+    """Shape of the answers the mock backend sends"""
+    chunks: int = 200               # content events per answer
+    chunk_size: int = 40            # characters of answer text per event
+    interval: float = 0.0           # seconds between events
+    first_chunk_delay: float = 0.0  # seconds before the first event (agent "thinking")
+    payload: str = "repr"           # "repr" or "json"
+    malformed_every: int = 0        # send an unparseable data line every N events (0 = never)
+    events_per_write: int = 1       # events flushed per network write
+    status_code: int = 200
+    event_ids: bool = False         # send `id:` fields and resume after `Last-Event-ID`
+    honor_last_event_id: bool = True  # False replays the whole answer on resume
+    retry_ms: int = 0               # `retry:` field sent before the first event (0 = none)
+    cut_rate: float = 0.0           # chance per write of dropping the connection partway through it
+    seed: int = 0                   # seeds the cut points; request N uses seed + N
+    table_rows: int = 0             # rows of a "table" event sent after the text (0 = none)
+    table_format: str = "json"      # "json" rows or base64 "arrow" IPC
+    compression: str = ""           # "gzip", "br", "zstd", "auto" (best the client accepts) or "" (none)
+    headers_delay: float = 0.0      # seconds before the response headers (a backend that accepts and hangs)
+    stall_after: int = 0            # events sent before the stream stalls (0 = never)
+    stall: float = 0.0              # seconds the stream stays silent at `stall_after`
+    heartbeat_interval: float = 0.0  # send ": ping" comments this often while thinking or stalled (0 = never)
+
+
+def answer_text(config: MockConfig) -> Iterator[str]:
+    """Deterministic answer split into `config.chunks` pieces of `config.chunk_size` chars"""
+    source = "".join(TEXT_PIECES)
+    pos = 0
+    for _ in range(config.chunks):
+        piece = []
+        needed = config.chunk_size
+        while needed > 0:
+            take = source[pos:pos + needed]
+            piece.append(take)
+            needed -= len(take)
+            pos = (pos + len(take)) % len(source)
+        yield "".join(piece)
+
+
+def expected_answer(config: MockConfig) -> str:
+    """The full text a client should reconstruct from this configuration"""
+    return "".join(answer_text(config))
+
+
+def table_payload(config: MockConfig) -> dict:
+    """Deterministic query result with `config.table_rows` rows"""
+    regions = ["Lima", "Cusco", "Arequipa", "Piura", "Loreto"]
+    return {
+        "columns": ["region", "anio", "tasa", "observaciones"],
+        "rows": [
+            [regions[i % len(regions)], 2000 + i % 24, round(5 + (i * 37 % 100) / 10, 1), i * 11 % 997]
+            for i in range(config.table_rows)
+        ],
+    }
+
+
+def table_event(config: MockConfig) -> str:
+    """Data of the "table" event in the configured format"""
+    payload = table_payload(config)
+    if config.table_format == "arrow":
+        return base64.b64encode(table_to_ipc(table_from_json(payload))).decode("ascii")
+    return json.dumps(payload)
+
+
+def sse_events(config: MockConfig, after: int = 0) -> Iterator[bytes]:
+    """Events of one answer; with `event_ids`, only those after event `after`"""
+    encode = PAYLOADS[config.payload]
+    if config.retry_ms:
+        yield f"retry: {config.retry_ms}\n\n".encode("utf-8")
+    for i, text in enumerate(answer_text(config), start=1):
+        if config.event_ids:
+            if i <= after:
+                continue
+            yield f"id: {i}\ndata: {encode(text)}\n\n".encode("utf-8")
+        else:
+            yield f"data: {encode(text)}\n\n".encode("utf-8")
+        if config.malformed_every and i % config.malformed_every == 0:
+            yield b"data: {\"type\": \"content\", \"content\": <<garbled>>\n\n"
+    if config.table_rows:
+        event_id = config.chunks + 1
+        if not config.event_ids:
+            yield f"event: table\ndata: {table_event(config)}\n\n".encode("utf-8")
+        elif event_id > after:
+            yield f"id: {event_id}\nevent: table\ndata: {table_event(config)}\n\n".encode("utf-8")
+    yield b"data: [DONE]\n\n"
+
+
+class StreamCompressor:
+    """
+    Content-Encoding for a streamed body, flushed after every write
+
+    Each write is compressed and flushed at once (Z_SYNC_FLUSH or the
+    codec's equivalent), as a server must do for events to reach the client
+    without waiting for the compressor's buffer to fill. brotli and zstd
+    need the `brotli` and `zstandard` packages.
+    """
+
+    ENCODINGS = ("zstd", "br", "gzip")
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            compressor = zlib.compressobj(wbits=31)
+            self._write = lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = compressor.flush
+        elif encoding == "br":
+            import brotli
+            compressor = brotli.Compressor()
+            self._write = lambda data: compressor.process(data) + compressor.flush()
+            self._finish = compressor.finish
+        elif encoding == "zstd":
+            import zstandard
+            compressor = zstandard.ZstdCompressor().compressobj()
+            self._write = lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            self._finish = compressor.flush
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    @classmethod
+    def negotiate(cls, setting: str, accept_encoding: str) -> Optional["StreamCompressor"]:
+        """Compressor for a `compression` setting and the request's Accept-Encoding, or None"""
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        if setting == "auto":
+            setting = next((encoding for encoding in cls.ENCODINGS if encoding in accepted), "")
+        if not setting or setting not in accepted:
+            return None
+        return cls(setting)
+
+    def write(self, data: bytes) -> bytes:
+        return self._write(data)
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Small event writes must not wait for delayed ACKs
+    disable_nagle_algorithm = True
+    compressor: Optional[StreamCompressor] = None
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        config: MockConfig = self.server.config
+        request_number = self.server.record_request()
+        rng = random.Random(config.seed + request_number)
+        after = 0
+        last_event_id = self.headers.get("Last-Event-ID", "")
+        if config.event_ids and config.honor_last_event_id and last_event_id.isdigit():
+            after = int(last_event_id)
+        # A resume answered from the first event reruns the answer; counted once it delivers an event ID
+        rerun = json.loads(body or b"{}").get("thread_id", "") if last_event_id and not after else None
+
+        if config.headers_delay:
+            time.sleep(config.headers_delay)
+
+        try:
+            if config.status_code != 200:
+                self.send_response(config.status_code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.compressor = StreamCompressor.negotiate(config.compression, self.headers.get("Accept-Encoding", ""))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            if self.compressor is not None:
+                self.send_header("Content-Encoding", self.compressor.encoding)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            self._pause(config.first_chunk_delay, config.heartbeat_interval)
+            batch = []
+            for number, event in enumerate(sse_events(config, after), start=1):
+                batch.append(event)
+                if config.stall_after and number == config.stall_after:
+                    self._write_chunk(b"".join(batch))
+                    batch = []
+                    self._pause(config.stall, config.heartbeat_interval)
+                elif len(batch) >= config.events_per_write:
+                    if config.cut_rate and rng.random() < config.cut_rate:
+                        self._cut(b"".join(batch), rng)
+                        return
+                    written = b"".join(batch)
+                    self._write_chunk(written)
+                    batch = []
+                    if rerun is not None and b"id: " in written:
+                        self.server.record_rerun(rerun)
+                        rerun = None
+                    if config.interval:
+                        time.sleep(config.interval)
+            if batch:
+                self._write_chunk(b"".join(batch))
+            if self.compressor is not None:
+                self._write_chunk(self.compressor.finish(), compress=False)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away (cancelled stream); nothing left to do
+            pass
+
+    def do_GET(self):
+        self._health(send_body=True)
+
+    def do_HEAD(self):
+        self._health(send_body=False)
+
+    def _health(self, send_body: bool):
+        """Health check on any path; as slow as the answer headers and with the same status"""
+        config: MockConfig = self.server.config
+        if config.headers_delay:
+            time.sleep(config.headers_delay)
+        body = b'{"status": "ok"}' if config.status_code == 200 else b'{"status": "error"}'
+        try:
+            self.send_response(config.status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _pause(self, seconds: float, heartbeat_interval: float):
+        """Stay silent for `seconds`, apart from heartbeat comments every `heartbeat_interval`"""
+        end = time.monotonic() + seconds
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            if not heartbeat_interval:
+                time.sleep(remaining)
+                return
+            time.sleep(min(heartbeat_interval, remaining))
+            if time.monotonic() < end:
+                self._write_chunk(b": ping\n\n")
+
+    def _write_chunk(self, body: bytes, compress: bool = True):
+        if compress and self.compressor is not None:
+            body = self.compressor.write(body)
+        if not body:
+            return
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(body), body))
+        self.wfile.flush()
+
+    def _cut(self, body: bytes, rng: random.Random):
+        """Send part of a chunk and close the connection, like a dropped proxy or instance"""
+        if self.compressor is not None:
+            body = self.compressor.write(body)
+        self.wfile.write(b"%x\r\n%s" % (len(body), body[:rng.randrange(len(body))]))
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: MockConfig, handler=MockHandler):
+        super().__init__(address, handler)
+        self.config = config
+        self.requests = 0
+        # Resumes answered from the first event that delivered events, by thread_id
+        self.reruns: Dict[str, int] = {}
+        self._requests_lock = threading.Lock()
+        self._connections = set()
+
+    def record_request(self) -> int:
+        with self._requests_lock:
+            self.requests += 1
+            return self.requests
+
+    def record_rerun(self, thread_id: str):
+        with self._requests_lock:
+            self.reruns[thread_id] = self.reruns.get(thread_id, 0) + 1
+
+    def process_request(self, request, client_address):
+        with self._requests_lock:
+            self._connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self._requests_lock:
+            self._connections.discard(request)
+        super().shutdown_request(request)
+
+    def close_connections(self):
+        """Drop open keep-alive connections, as a backend that goes down would"""
+        with self._requests_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class MockBackend:
+    """
+    Mock backend running in a background thread
+
+    Usage:
+        with MockBackend(MockConfig(chunks=50)) as backend:
+            get_api_response_streaming("q", "t", placeholder, backend.url)
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0,
+                 server_class=MockServer):
+        self.server = server_class((host, port), config or MockConfig())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    @config.setter
+    def config(self, value: MockConfig):
+        self.server.config = value
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockBackend":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-backend", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.close_connections()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockBackend":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Expose every MockConfig field as a --flag"""
+    for field in fields(MockConfig):
+        flag = "--" + field.name.replace("_", "-")
+        if isinstance(field.default, bool):
+            parser.add_argument(flag, action=argparse.BooleanOptionalAction, default=field.default)
+        else:
+            parser.add_argument(flag, type=type(field.default), default=field.default)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(**{field.name: getattr(args, field.name) for field in fields(MockConfig)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), config_from_args(args))
+    print(f"Mock /chat/stream listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
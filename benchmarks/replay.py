@@ -0,0 +1,238 @@
+"""
+Replay of recorded answer streams (see src.recording)
+
+Serves capture files back as /chat/stream answers with their original
+status, content type, body bytes and read boundaries, and sends every
+capture through get_api_response_streaming. Reports whether the client
+still decodes the answer it decoded when the stream was recorded, and how
+fast. Timing follows the capture scaled by --speed: 1 is the original pace,
+10 is ten times faster and 0 sends every read at once (max speed).
+
+A request's resumes are replayed too: each response of the capture is
+served to the next request of the same thread, and every response but the
+last is cut where the original connection dropped. The wait before a resumed
+response already includes the client's original reconnect delay, which the
+client adds again on replay.
+
+Record some production answers with ESMA_RECORD_DIR, or try it against the
+mock backend with --record-mock:
+
+    python -m benchmarks.replay captures/ --speed 0 --repeat 5
+    python -m benchmarks.replay captures/ --record-mock 20 --speed 0
+    python -m benchmarks.replay captures/ --serve --port 8000 --speed 1
+    ESMA_BASE_URL=http://127.0.0.1:8000 streamlit run main.py
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, MockServer
+from benchmarks.suite import percentiles
+from src import recording
+from src.client import get_api_response_streaming
+from src.recording import Capture, iter_captures, wait_for_writes
+
+# Recorded outcomes that ended with the connection dropping rather than closing
+DROPPED = ("interrupted", "transport", "timeout")
+
+# Mock answers recorded by --record-mock: plain, paced, with a table, and cut with resumes
+MOCK_CONFIGS = [
+    MockConfig(chunks=200),
+    MockConfig(chunks=100, interval=0.002, first_chunk_delay=0.05),
+    MockConfig(chunks=50, table_rows=200),
+    MockConfig(chunks=200, event_ids=True, retry_ms=10, cut_rate=0.02, seed=7),
+]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        thread_id = json.loads(body or b"{}").get("thread_id", "")
+        capture, index = self.server.pick(thread_id, bool(self.headers.get("Last-Event-ID")))
+        speed = self.server.speed
+        if index >= len(capture.segments):
+            # The recorded request never got a response, e.g. connect failures
+            self.close_connection = True
+            return
+        segment = capture.segments[index]
+        last = index == len(capture.segments) - 1
+        dropped = not last or not capture.complete or (capture.error or "").startswith(DROPPED)
+
+        # Reads are paced against the capture's schedule, so sleep overshoot does not add up
+        due = time.monotonic()
+        try:
+            due = self._wait(due, segment.headers_delay, speed)
+            self.send_response(segment.status)
+            if segment.status != 200:
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            # Bodies are recorded decompressed, so they are served as identity
+            self.send_header("Content-Type", segment.content_type or "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for delay, data in segment.reads:
+                due = self._wait(due, delay, speed)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            if dropped:
+                self.close_connection = True
+                return
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    @staticmethod
+    def _wait(due: float, seconds: float, speed: float) -> float:
+        """Sleep until `seconds` / `speed` after `due` and return that time"""
+        if not speed:
+            return due
+        due += seconds / speed
+        remaining = due - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return due
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer(MockServer):
+    """
+    Serves captures instead of generated answers
+
+    A thread_id equal to a capture id, optionally followed by `#<anything>`,
+    gets that capture; other threads get the captures in turn.
+    """
+
+    def __init__(self, address, captures: List[Capture], speed: float = 1.0, handler=ReplayHandler):
+        super().__init__(address, MockConfig(), handler)
+        if not captures:
+            raise ValueError("No captures to replay")
+        self.captures = captures
+        self.speed = speed
+        self._by_id = {capture.id: capture for capture in captures}
+        self._served: Dict[str, tuple] = {}
+
+    def pick(self, thread_id: str, resuming: bool) -> tuple:
+        """Capture for a request and which of its responses to serve"""
+        number = self.record_request()
+        with self._requests_lock:
+            if resuming and thread_id in self._served:
+                capture, index = self._served[thread_id]
+                index += 1
+            else:
+                capture = self._by_id.get(thread_id.split("#")[0])
+                if capture is None:
+                    capture = self.captures[(number - 1) % len(self.captures)]
+                index = 0
+            self._served[thread_id] = (capture, index)
+        return capture, index
+
+
+class ReplayBackend(MockBackend):
+    """ReplayServer running in a background thread"""
+
+    def __init__(self, captures: List[Capture], speed: float = 1.0, host: str = "127.0.0.1", port: int = 0):
+        self.server = ReplayServer((host, port), captures, speed)
+        self._thread: Optional[threading.Thread] = None
+
+
+def record_mock(directory: str, count: int):
+    """Record `count` answers from mock backends into `directory`"""
+    recording.RECORD_DIR = directory
+    try:
+        for i in range(count):
+            config = MOCK_CONFIGS[i % len(MOCK_CONFIGS)]
+            with MockBackend(replace(config, seed=config.seed + i)) as backend:
+                get_api_response_streaming("pregunta", f"record-{i}", FakePlaceholder(), backend.url)
+    finally:
+        recording.RECORD_DIR = None
+    wait_for_writes()
+
+
+def replay(capture: Capture, url: str, thread_id: str) -> dict:
+    start = time.perf_counter()
+    answer = get_api_response_streaming("pregunta", thread_id, FakePlaceholder(), url)
+    seconds = time.perf_counter() - start
+    checkable = capture.complete and capture.error is None and not capture.truncated
+    same = (
+        hashlib.sha256(str(answer).encode("utf-8")).hexdigest() == capture.text_sha256
+        and len(getattr(answer, "tables", ())) == capture.tables
+    )
+    return {"id": capture.id, "seconds": seconds, "check": ("ok" if same else "CHANGED") if checkable else "skipped"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="Capture files or directories holding them")
+    parser.add_argument("--speed", type=float, default=1.0, help="Pace relative to the recording; 0 is max speed")
+    parser.add_argument("--repeat", type=int, default=1, help="Times every capture is replayed")
+    parser.add_argument("--concurrency", type=int, default=1, help="Captures replayed at once")
+    parser.add_argument("--record-mock", type=int, default=0, metavar="N",
+                        help="First record N mock answers into the (single) captures directory")
+    parser.add_argument("--serve", action="store_true", help="Only serve the captures, e.g. to the UI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.record_mock:
+        record_mock(args.captures[0], args.record_mock)
+    captures = list(iter_captures(*args.captures))
+    if not captures:
+        sys.exit(f"No captures found in {', '.join(args.captures)}")
+
+    if args.serve:
+        server = ReplayServer((args.host, args.port or 8000), captures, args.speed)
+        print(f"Replaying {len(captures)} captures on http://{args.host}:{args.port or 8000}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    jobs = [(capture, f"{capture.id}#{n}") for n in range(args.repeat) for capture in captures]
+    with ReplayBackend(captures, args.speed, args.host, args.port) as backend:
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda job: replay(job[0], backend.url, job[1]), jobs))
+        wall = time.perf_counter() - begin
+
+    by_id = {capture.id: capture for capture in captures}
+    print(f"{'capture':<25} {'outcome':<12} {'resp':>4} {'bytes':>9} {'recorded s':>10} {'replay p50 s':>12}  check")
+    for capture in captures:
+        runs = [r for r in results if r["id"] == capture.id]
+        checks = {r["check"] for r in runs}
+        check = "CHANGED" if "CHANGED" in checks else checks.pop()
+        print(f"{capture.id:<25} {capture.error or 'ok':<12} {len(capture.segments):>4} {capture.bytes:>9}"
+              f" {capture.duration:>10.3f} {percentiles([r['seconds'] for r in runs])['p50']:>12.3f}  {check}")
+    total_bytes = sum(by_id[r["id"]].bytes for r in results)
+    print(f"{len(results)} replays in {wall:.2f}s at speed {args.speed:g}: "
+          f"{len(results) / wall:.1f} answers/s, {total_bytes / wall / 1e6:.2f} MB/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"wall_seconds": wall, "speed": args.speed, "results": results}, f, indent=2)
+    if any(r["check"] == "CHANGED" for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
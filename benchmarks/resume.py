@@ -0,0 +1,102 @@
+"""
+Dropped-connection check for stream resumption
+
+Streams answers from a mock backend that cuts connections at random points
+and classifies what the client ends up with:
+  - resume:   the server sends event IDs and honors Last-Event-ID; every
+              answer must be complete unless the cut came before the first event
+  - replay:   the server sends event IDs but restarts the answer on resume;
+              replayed events must not be duplicated, and since every resume
+              reruns the answer, no request may be rerun more than once
+  - no_ids:   the server cannot resume; the partial answer must be kept and marked
+
+A "corrupt" answer (duplicated or missing text) fails the check in every scenario.
+
+Cut points are seeded, so a run with the same flags is reproducible.
+
+Usage:
+    python -m benchmarks.resume --requests 50 --cut-rate 0.05
+"""
+
+import argparse
+import json
+import sys
+import time
+from dataclasses import replace
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src.client import INTERRUPTED_MARKER, get_api_response_streaming
+from src.metrics import registry
+
+SCENARIOS = {
+    "resume": {"event_ids": True},
+    "replay": {"event_ids": True, "honor_last_event_id": False},
+    "no_ids": {"event_ids": False},
+}
+
+
+def classify(response: str, expected: str) -> str:
+    """complete, partial (marked prefix), no_answer (dropped before the first event) or corrupt"""
+    if response == expected:
+        return "complete"
+    if response.endswith(INTERRUPTED_MARKER):
+        text = response[:-len(INTERRUPTED_MARKER)]
+        return "partial" if expected.startswith(text) else "corrupt"
+    if not response or response.startswith("❌"):
+        return "no_answer"
+    return "corrupt"
+
+
+def run_scenario(name: str, base: MockConfig, requests: int) -> dict:
+    config = replace(base, **SCENARIOS[name])
+    expected = expected_answer(config)
+    results = {"complete": 0, "partial": 0, "no_answer": 0, "corrupt": 0}
+    durations = []
+
+    with MockBackend(config) as backend:
+        for i in range(requests):
+            placeholder = FakePlaceholder()
+            start = time.perf_counter()
+            response = get_api_response_streaming("pregunta", f"resume-{name}-{i}", placeholder, backend.url)
+            durations.append(time.perf_counter() - start)
+            results[classify(response, expected)] += 1
+        connections = backend.server.requests
+        reruns = max(backend.server.reruns.values(), default=0)
+
+    counters = registry.snapshot()["counters"]
+    resumes = counters.get("esma_stream_resumes_total", {}).get(backend.url, {}).get("all", 0)
+    return {
+        "requests": requests,
+        **results,
+        "connections": connections,
+        "resumes": resumes,
+        "max_reruns": reruns,
+        "mean_seconds": sum(durations) / len(durations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--cut-rate", type=float, default=0.05)
+    parser.add_argument("--retry-ms", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    args = parser.parse_args()
+
+    base = MockConfig(chunks=args.chunks, cut_rate=args.cut_rate, retry_ms=args.retry_ms, seed=args.seed)
+    results = {name: run_scenario(name, base, args.requests) for name in args.scenario or SCENARIOS}
+    print(json.dumps(results, indent=2))
+
+    if any(result["corrupt"] for result in results.values()):
+        sys.exit(1)
+    if "resume" in results and results["resume"]["partial"]:
+        sys.exit(1)
+    if "replay" in results and results["replay"]["max_reruns"] > 1:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
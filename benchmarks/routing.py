@@ -0,0 +1,120 @@
+"""
+Latency-aware routing across several mock backends
+
+Starts mock backends with different response latencies, drives the router
+and client through them and reports where conversations went:
+  - latency:  share of new conversations routed to the fastest backend
+  - sticky:   a conversation's backend gets slower than another one
+  - failover: a conversation's backend goes down
+  - recovery: the backend comes back and is health-checked again
+
+The expected routing is checked by tests/test_routing.py; this script only
+reports it with the router's view of each backend.
+
+Usage:
+    python -m benchmarks.routing --threads 30
+"""
+
+import argparse
+import json
+import time
+from dataclasses import replace
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src import routing
+from src.client import get_api_response_streaming
+from src.routing import Router
+
+# Seconds before each mock sends response headers
+LATENCIES = [0.2, 0.005, 0.08]
+HEALTH_INTERVAL = 0.2
+BASE = MockConfig(chunks=20)
+
+
+def ask(router: Router, thread_id: str) -> tuple:
+    url = router.route(thread_id)
+    answer = get_api_response_streaming("pregunta", thread_id, FakePlaceholder(), url)
+    return url, answer == expected_answer(BASE)
+
+
+def state(router: Router, url: str) -> dict:
+    return next(backend for backend in router.snapshot() if backend["url"] == url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=30, help="New conversations in the latency check")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    backends = [MockBackend(replace(BASE, headers_delay=latency)).start() for latency in LATENCIES]
+    urls = [backend.url for backend in backends]
+    fastest = urls[LATENCIES.index(min(LATENCIES))]
+    router = Router(urls, health_interval=HEALTH_INTERVAL, health_timeout=1.0)
+    # Answer requests report to the process-wide router
+    routing._router = router
+    router.start_health_checks()
+    results = {}
+    try:
+        # Let a few rounds of health checks measure every backend
+        time.sleep(HEALTH_INTERVAL * 4)
+
+        routed = [ask(router, f"routing-latency-{i}") for i in range(args.threads)]
+        share = sum(url == fastest for url, _ in routed) / len(routed)
+        results["latency"] = {
+            "fastest_share": share,
+            "complete": all(ok for _, ok in routed),
+        }
+
+        # The pinned backend gets slower than another one; the conversation stays
+        thread_id = "routing-sticky"
+        first, _ = ask(router, thread_id)
+        index = urls.index(first)
+        backends[index].config = replace(BASE, headers_delay=0.3)
+        time.sleep(HEALTH_INTERVAL * 4)
+        later = [ask(router, thread_id) for _ in range(3)]
+        results["sticky"] = {
+            "backend": first,
+            "stayed": all(url == first for url, _ in later),
+            "complete": all(ok for _, ok in later),
+        }
+
+        # The pinned backend goes down
+        port = backends[index].server.server_address[1]
+        backends[index].stop()
+        time.sleep(HEALTH_INTERVAL * 3)
+        url, complete = ask(router, thread_id)
+        results["failover"] = {
+            "from": first,
+            "to": url,
+            "complete": complete,
+            "down_detected": not state(router, first)["healthy"],
+        }
+
+        # ...and comes back on the same port
+        backends[index] = MockBackend(BASE, port=port).start()
+        time.sleep(HEALTH_INTERVAL * 4)
+        recovered = state(router, first)
+        results["recovery"] = {"healthy": recovered["healthy"]}
+        results["backends"] = router.snapshot()
+    finally:
+        router.stop_health_checks()
+        for backend in backends:
+            backend.stop()
+
+    for name in ("latency", "sticky", "failover", "recovery"):
+        print(f"{name:<9} {results[name]}")
+    print(f"{'backend':<24} {'healthy':>7} {'latency ms':>10} {'err rate':>8} {'threads':>7}")
+    for backend in results["backends"]:
+        latency = backend["latency"] * 1000 if backend["latency"] is not None else float("nan")
+        print(f"{backend['url']:<24} {str(backend['healthy']):>7} {latency:>10.1f}"
+              f" {backend['error_rate']:>8.2f} {backend['threads']:>7}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
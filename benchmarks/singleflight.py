@@ -0,0 +1,121 @@
+"""
+Single-flight check for identical concurrent questions
+
+Sends the same question from N sessions at once to a mock backend, with
+single-flight off and on, and reports upstream requests, wall time and
+whether every session got the complete answer. Scenarios:
+  - first_turn: opening questions; shared when on, so one upstream request
+  - cancel:     as first_turn, but the session that started the stream and one
+                other stop halfway; everyone else must still get the full answer
+  - later_turn: follow-up questions depend on each thread's history and must
+                never be shared
+
+Usage:
+    python -m benchmarks.singleflight --sessions 20 --chunks 100 --interval 0.01
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from dataclasses import replace
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src import singleflight
+from src.client import STOPPED_MARKER, get_api_response_streaming
+
+SCENARIOS = {
+    "first_turn": {"turn": 0, "cancel": False},
+    "cancel": {"turn": 0, "cancel": True},
+    "later_turn": {"turn": 1, "cancel": False},
+}
+
+
+def run_scenario(name: str, config: MockConfig, sessions: int, enabled: bool) -> dict:
+    scenario = SCENARIOS[name]
+    singleflight.SINGLE_FLIGHT_ENABLED = enabled
+    expected = expected_answer(config)
+    answers = [None] * sessions
+    cancels = [threading.Event() for _ in range(sessions)]
+    # The first session starts the stream; the last one is an ordinary follower
+    stopped = {0, sessions - 1} if scenario["cancel"] and sessions > 1 else set()
+
+    def session(i: int):
+        answers[i] = get_api_response_streaming(
+            "¿Cuál fue la tasa de informalidad en 2023?", f"singleflight-{name}-{i}", FakePlaceholder(),
+            backend.url, turn=scenario["turn"], cancel=cancels[i]
+        )
+
+    with MockBackend(config) as backend:
+        threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+        begin = time.perf_counter()
+        for i, thread in enumerate(threads):
+            thread.start()
+            if i == 0:
+                # Let the first session take the lead
+                time.sleep(0.05)
+        if stopped:
+            time.sleep(config.first_chunk_delay + config.chunks * config.interval / 2)
+            for i in stopped:
+                cancels[i].set()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - begin
+        upstream = backend.server.requests
+
+    complete = sum(answers[i] == expected for i in range(sessions) if i not in stopped)
+    stopped_ok = sum(answers[i].endswith(STOPPED_MARKER) for i in stopped)
+    return {
+        "scenario": name,
+        "single_flight": enabled,
+        "sessions": sessions,
+        "upstream_requests": upstream,
+        "wall_seconds": wall,
+        "complete": complete,
+        "expected_complete": sessions - len(stopped),
+        "stopped": stopped_ok,
+        "ok": complete == sessions - len(stopped) and stopped_ok == len(stopped),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between mock events")
+    parser.add_argument("--first-chunk-delay", type=float, default=0.5)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    config = replace(MockConfig(), chunks=args.chunks, interval=args.interval, first_chunk_delay=args.first_chunk_delay)
+    results = [
+        run_scenario(name, config, args.sessions, enabled)
+        for name in SCENARIOS
+        for enabled in (False, True)
+    ]
+    # Sharing only ever removes upstream requests for opening questions
+    expected_upstream = {
+        (name, enabled): 1 if enabled and SCENARIOS[name]["turn"] == 0 else args.sessions
+        for name in SCENARIOS for enabled in (False, True)
+    }
+
+    print(f"{'scenario':<11} {'sf':>3} {'upstream':>8} {'wall s':>7} {'complete':>9} {'stopped':>7}  check")
+    ok = True
+    for r in results:
+        passed = r["ok"] and r["upstream_requests"] == expected_upstream[r["scenario"], r["single_flight"]]
+        ok = ok and passed
+        print(f"{r['scenario']:<11} {'on' if r['single_flight'] else 'off':>3} {r['upstream_requests']:>8}"
+              f" {r['wall_seconds']:>7.2f} {r['complete']:>4}/{r['expected_complete']:<4} {r['stopped']:>7}"
+              f"  {'ok' if passed else 'FAIL'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
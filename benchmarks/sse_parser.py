@@ -0,0 +1,146 @@
+"""
+Throughput comparison between the original parse_sse_content and src.sse
+
+The decoder is faster on JSON payloads but slower (about 0.75x) on the
+API's repr() payloads. The legacy path splits lines with httpx and slices
+repr values without checking them, so it breaks on CR line endings,
+multi-line data, unescaped quotes, escaped backslashes, unicode escapes and
+U+2028 inside a value, and drops id:/retry: (needed to resume). At over
+250k events/s the decoder costs a few microseconds per chunk, far below
+rendering and network time.
+
+Usage:
+    python -m benchmarks.sse_parser [--events N] [--chunk-size BYTES]
+"""
+
+import argparse
+import json
+import re
+import time
+from typing import Callable, List, Optional
+
+from httpx._decoders import LineDecoder, TextDecoder
+
+from benchmarks.mock_server import TEXT_PIECES as SAMPLE_TEXTS, json_payload, repr_payload
+from src.sse import SSEDecoder, decode_content
+
+
+def legacy_parse_sse_content(content_str: str) -> Optional[str]:
+    """Original parse_sse_content (debug output removed), kept as the baseline"""
+    try:
+        if '"content": \'' in content_str or '"content":\'' in content_str:
+            if '"content": \'' in content_str:
+                start_marker = '"content": \''
+            else:
+                start_marker = '"content":\''
+            start_idx = content_str.index(start_marker) + len(start_marker)
+            if content_str.endswith('\'}'):
+                end_idx = len(content_str) - 2
+            elif '\'}\n' in content_str:
+                end_idx = content_str.index('\'}\n')
+            elif '\'}' in content_str:
+                end_idx = content_str.index('\'}')
+            else:
+                end_idx = len(content_str)
+            actual_content = content_str[start_idx:end_idx]
+            actual_content = actual_content.replace("\\n", "\n")
+            actual_content = actual_content.replace("\\t", "\t")
+            actual_content = actual_content.replace("\\'", "'")
+            actual_content = actual_content.replace("\\\\", "\\")
+            return actual_content if actual_content else None
+        try:
+            content_data = json.loads(content_str)
+            chunk = content_data.get("content", "")
+            return chunk if chunk else None
+        except json.JSONDecodeError:
+            pass
+        pattern = r'"content":\s*["\']([^"\']*)["\']'
+        match = re.search(pattern, content_str)
+        if match:
+            content = match.group(1)
+            content = content.replace("\\n", "\n")
+            content = content.replace("\\t", "\t")
+            content = content.replace("\\'", "'")
+            content = content.replace("\\\\", "\\")
+            return content
+        return None
+    except Exception:
+        return None
+
+
+def build_stream(n_events: int, payload: Callable[[str], str]) -> bytes:
+    lines = []
+    for i in range(n_events):
+        lines.append(f"data: {payload(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)])}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def split_chunks(body: bytes, chunk_size: int) -> List[bytes]:
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+def run_legacy(chunks: List[bytes]) -> List[str]:
+    """Baseline path: the decoders behind httpx's aiter_lines plus legacy_parse_sse_content"""
+    out = []
+    text_decoder = TextDecoder()
+    line_decoder = LineDecoder()
+    for chunk in chunks:
+        for line in line_decoder.decode(text_decoder.decode(chunk)):
+            if line.startswith("data: "):
+                content_str = line[len("data: "):].strip()
+                if not content_str or content_str == "[DONE]":
+                    continue
+                content = legacy_parse_sse_content(content_str)
+                if content:
+                    out.append(content)
+    return out
+
+
+def run_decoder(chunks: List[bytes]) -> List[str]:
+    """New path: SSEDecoder over raw bytes plus decode_content"""
+    out = []
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            content = decode_content(event.data)
+            if content:
+                out.append(content)
+    return out
+
+
+def measure(fn: Callable[[List[bytes]], List[str]], chunks: List[bytes], repeat: int) -> float:
+    """Best-of-`repeat` wall time in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, payload in (("repr", repr_payload), ("json", json_payload)):
+        body = build_stream(args.events, payload)
+        chunks = split_chunks(body, args.chunk_size)
+
+        # Exact round-trips of the sample chunks (the legacy regex truncates at quotes)
+        legacy_ok = sum(legacy_parse_sse_content(payload(text)) == text for text in SAMPLE_TEXTS)
+        decoder_ok = sum(decode_content(payload(text)) == text for text in SAMPLE_TEXTS)
+        legacy_time = measure(run_legacy, chunks, args.repeat)
+        decoder_time = measure(run_decoder, chunks, args.repeat)
+
+        mb = len(body) / 1e6
+        print(f"[{name}] {args.events} events, {mb:.2f} MB, {len(chunks)} chunks")
+        print(f"  legacy : {mb / legacy_time:8.1f} MB/s  {args.events / legacy_time:10.0f} ev/s  exact {legacy_ok}/{len(SAMPLE_TEXTS)}")
+        print(f"  decoder: {mb / decoder_time:8.1f} MB/s  {args.events / decoder_time:10.0f} ev/s  exact {decoder_ok}/{len(SAMPLE_TEXTS)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Client-side benchmark suite with machine-readable output
+
+Measures, against a local mock backend:
+  - parse_sse_content throughput for repr, JSON and malformed payloads
+  - per-chunk overhead of the get_api_response_streaming loop
+  - time-to-first-token on a warm connection pool
+  - placeholder render cost over a long streamed answer
+
+Usage:
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.compare baseline.json bench.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, replace
+from typing import Callable, Dict, List
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, PAYLOADS, answer_text, expected_answer
+from src.client import get_api_response_streaming, parse_sse_content
+from src.connection import get_client_manager
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "min": ordered[0],
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+        "mean": statistics.fmean(ordered),
+    }
+
+
+def best_of(fn: Callable[[], None], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parse(events: int, repeat: int) -> dict:
+    """parse_sse_content calls per second on pre-built payloads"""
+    config = MockConfig(chunks=events)
+    texts = list(answer_text(config))
+    results = {}
+
+    cases = {name: [encode(text) for text in texts] for name, encode in PAYLOADS.items()}
+    cases["malformed"] = ['{"type": "content", "content": <<garbled>>' for _ in texts]
+
+    for name, payloads in cases.items():
+        def run():
+            for payload in payloads:
+                parse_sse_content(payload)
+        seconds = best_of(run, repeat)
+        size = sum(len(p) for p in payloads)
+        results[name] = {
+            "calls_per_s": len(payloads) / seconds,
+            "mb_per_s": size / seconds / 1e6,
+            "us_per_call": seconds / len(payloads) * 1e6,
+        }
+    return results
+
+
+def bench_stream_loop(backend: MockBackend, chunks: int, repeat: int) -> dict:
+    """End-to-end client cost per chunk with an unthrottled local backend"""
+    results = {}
+    for payload in PAYLOADS:
+        # Batched writes keep the mock server's own per-write cost out of the measurement
+        config = MockConfig(chunks=chunks, payload=payload, events_per_write=50)
+        backend.config = config
+        expected = expected_answer(config)
+        timings = []
+        for _ in range(repeat):
+            placeholder = FakePlaceholder()
+            start = time.perf_counter()
+            answer = get_api_response_streaming("benchmark", "bench-thread", placeholder, backend.url)
+            timings.append(time.perf_counter() - start)
+            if answer != expected:
+                raise RuntimeError(f"stream loop produced a wrong answer for {payload} payloads")
+        best = min(timings)
+        results[payload] = {
+            "chunks": chunks,
+            "seconds": best,
+            "us_per_chunk": best / chunks * 1e6,
+            "chunks_per_s": chunks / best,
+        }
+    return results
+
+
+def bench_ttft(backend: MockBackend, requests: int, first_chunk_delay: float) -> dict:
+    """Time from the call to the first rendered token, minus the backend's own delay"""
+    backend.config = MockConfig(chunks=20, first_chunk_delay=first_chunk_delay)
+    samples = []
+    for _ in range(requests):
+        placeholder = FakePlaceholder()
+        get_api_response_streaming("benchmark", "bench-thread", placeholder, backend.url)
+        if placeholder.time_to_first_render is not None:
+            samples.append(placeholder.time_to_first_render - first_chunk_delay)
+    return {"requests": len(samples), "backend_delay_s": first_chunk_delay, "client_overhead_s": percentiles(samples)}
+
+
+def bench_render(backend: MockBackend, chunks: int, interval: float) -> dict:
+    """Render calls and characters pushed to the placeholder for one long, paced answer"""
+    backend.config = MockConfig(chunks=chunks, chunk_size=60, interval=interval)
+    placeholder = FakePlaceholder()
+    start = time.perf_counter()
+    get_api_response_streaming("benchmark", "bench-thread", placeholder, backend.url)
+    total = time.perf_counter() - start
+    return {
+        "chunks": chunks,
+        "answer_chars": chunks * 60,
+        "renders": placeholder.renders,
+        "rendered_chars": placeholder.rendered_chars,
+        "render_seconds": placeholder.render_seconds,
+        "stream_seconds": total,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write results as JSON to this path (default: stdout)")
+    parser.add_argument("--quick", action="store_true", help="Smaller workloads for a fast sanity run")
+    args = parser.parse_args()
+
+    scale = 0.1 if args.quick else 1.0
+    parse_events = int(20000 * scale)
+    loop_chunks = int(2000 * scale)
+    ttft_requests = max(5, int(50 * scale))
+    render_chunks = int(1000 * scale)
+
+    results = {"meta": {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "quick": args.quick,
+    }}
+
+    results["parse_sse_content"] = bench_parse(parse_events, repeat=5)
+
+    with MockBackend() as backend:
+        # Warm the pool so every measurement reuses the same connection
+        backend.config = replace(MockConfig(), chunks=1)
+        get_api_response_streaming("warmup", "bench-thread", FakePlaceholder(), backend.url)
+
+        results["stream_loop"] = bench_stream_loop(backend, loop_chunks, repeat=3)
+        results["ttft"] = bench_ttft(backend, ttft_requests, first_chunk_delay=0.01)
+        results["render"] = bench_render(backend, render_chunks, interval=0.001)
+        results["meta"]["mock_defaults"] = asdict(MockConfig())
+
+    get_client_manager().close()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Markdown tables vs typed table events
+
+For query results of growing size, compares what it costs to stream the
+result as a Markdown table (re-rendered as rows arrive) with a single
+"table" event decoded into an Arrow table (JSON rows and Arrow IPC):
+characters sent to the placeholder, render and decode time, and bytes held
+in memory. Also streams each format end to end through the mock backend
+and checks that the table arrives intact.
+
+Usage:
+    python -m benchmarks.tables --rows 100 500 2000
+"""
+
+import argparse
+import json
+import sys
+import time
+from dataclasses import replace
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, table_event, table_payload
+from src.client import get_api_response_streaming
+from src.conversations import message_size
+from src.render import StreamRenderer
+from src.tables import decode_table, table_from_json
+
+# Seconds between two streamed Markdown rows, as seen by the renderer's clock
+ROW_INTERVAL = 0.02
+
+
+def markdown_table(payload: dict) -> str:
+    lines = ["| " + " | ".join(payload["columns"]) + " |", "|" + "---|" * len(payload["columns"])]
+    lines += ["| " + " | ".join(str(value) for value in row) + " |" for row in payload["rows"]]
+    return "\n".join(lines) + "\n"
+
+
+def stream_markdown(text: str) -> dict:
+    """Feed a Markdown table line by line to the renderer, rows arriving every ROW_INTERVAL"""
+    now = [0.0]
+    placeholder = FakePlaceholder()
+    renderer = StreamRenderer(placeholder, clock=lambda: now[0])
+    start = time.perf_counter()
+    for line in text.splitlines(keepends=True):
+        renderer.append(line)
+        now[0] += ROW_INTERVAL
+    renderer.finish()
+    return {
+        "renders": placeholder.renders,
+        "rendered_chars": placeholder.rendered_chars,
+        "seconds": time.perf_counter() - start,
+        "memory_bytes": message_size({"role": "assistant", "content": text}),
+    }
+
+
+def decode_event(data: str) -> dict:
+    start = time.perf_counter()
+    table = decode_table(data)
+    return {
+        "event_bytes": len(data),
+        "seconds": time.perf_counter() - start,
+        "memory_bytes": message_size({"role": "assistant", "content": "", "tables": [table]}),
+    }
+
+
+def end_to_end(config: MockConfig) -> bool:
+    """Stream an answer with a table event and compare the table with what the mock sent"""
+    expected = table_from_json(table_payload(config))
+    with MockBackend(config) as backend:
+        placeholder = FakePlaceholder()
+        answer = get_api_response_streaming("pregunta", "tables", placeholder, backend.url)
+    tables = getattr(answer, "tables", ())
+    return len(tables) == 1 and tables[0].equals(expected) and placeholder.tables == list(tables)
+
+
+def run(rows: int) -> dict:
+    config = MockConfig(chunks=5, table_rows=rows)
+    payload = table_payload(config)
+    return {
+        "rows": rows,
+        "markdown": stream_markdown(markdown_table(payload)),
+        "json": decode_event(table_event(config)),
+        "arrow": decode_event(table_event(replace(config, table_format="arrow"))),
+        "end_to_end": {
+            "json": end_to_end(config),
+            "arrow": end_to_end(replace(config, table_format="arrow")),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    # First Arrow conversions pay one-off initialization
+    decode_table(table_event(MockConfig(table_rows=1)))
+    results = [run(rows) for rows in args.rows]
+    print(f"{'rows':>6} {'md renders':>10} {'md chars':>12} {'md ms':>8} {'md mem':>10}"
+          f" {'json ms':>8} {'arrow ms':>8} {'table mem':>10}  e2e")
+    for r in results:
+        md, js, ar = r["markdown"], r["json"], r["arrow"]
+        ok = all(r["end_to_end"].values())
+        print(f"{r['rows']:>6} {md['renders']:>10} {md['rendered_chars']:>12} {md['seconds'] * 1000:>8.2f}"
+              f" {md['memory_bytes']:>10} {js['seconds'] * 1000:>8.2f} {ar['seconds'] * 1000:>8.2f}"
+              f" {js['memory_bytes']:>10}  {'ok' if ok else 'FAIL'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(all(r["end_to_end"].values()) for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Phase deadlines and connect retries against a slow mock backend
+
+Each scenario streams one answer from a mock that misbehaves in one phase
+and reports what the session ended up with and how long it took:
+  - dead_backend:       headers never come
+  - thinking_heartbeat: long silence before the answer, with `: ping` comments
+  - thinking_silent:    the same silence without comments
+  - stall_heartbeat:    stream stalls halfway with comments
+  - stall_silent:       stream stalls halfway in silence
+  - stall_resume:       as stall_silent with SSE event IDs
+  - total:              answer slower than the total deadline
+  - late_start:         backend starts listening after a while, with connect retries
+  - refused:            nothing listening and retries disabled
+
+Deadlines are scaled down to fractions of a second. The expected result of
+each scenario is checked by tests/test_timeouts.py; this script only reports
+timings.
+
+Usage:
+    python -m benchmarks.timeouts
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+from dataclasses import replace
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src.client import INTERRUPTED_MARKER, get_api_response_streaming
+from src.metrics import registry
+from src.timeouts import StreamPolicy
+
+POLICY = StreamPolicy(total=3.0, connect=0.5, first_byte=0.5, idle=0.3, connect_retries=0, backoff=0.1, backoff_max=0.4)
+BASE = MockConfig(chunks=40, interval=0.005)
+
+# name: (mock settings, policy settings)
+SCENARIOS = {
+    "dead_backend": ({"headers_delay": 5.0}, {}),
+    "thinking_heartbeat": ({"first_chunk_delay": 1.0, "heartbeat_interval": 0.1}, {}),
+    "thinking_silent": ({"first_chunk_delay": 1.0}, {}),
+    "stall_heartbeat": ({"stall_after": 20, "stall": 1.0, "heartbeat_interval": 0.1}, {}),
+    "stall_silent": ({"stall_after": 20, "stall": 2.0}, {}),
+    "stall_resume": ({"stall_after": 20, "stall": 2.0, "event_ids": True, "retry_ms": 10}, {}),
+    "total": ({"interval": 0.2}, {"total": 1.0}),
+    "late_start": ({}, {"connect_retries": 8}),
+    "refused": ({}, {}),
+}
+
+# Seconds before the late_start backend starts listening
+LATE_START = 0.6
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def classify(response: str, expected: str) -> str:
+    if response == expected:
+        return "complete"
+    if response.endswith(INTERRUPTED_MARKER):
+        return "partial" if expected.startswith(response[:-len(INTERRUPTED_MARKER)]) else "corrupt"
+    return "error"
+
+
+def ask(url: str, name: str, policy: StreamPolicy) -> tuple:
+    start = time.perf_counter()
+    response = get_api_response_streaming("pregunta", f"timeouts-{name}", FakePlaceholder(), url, policy=policy)
+    return response, time.perf_counter() - start
+
+
+def run(name: str) -> dict:
+    mock, settings = SCENARIOS[name]
+    config = replace(BASE, **mock)
+    policy = replace(POLICY, **settings)
+
+    if name in ("late_start", "refused"):
+        # Nothing listens on the port until the backend is created, so connecting is refused
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        backends = []
+        timer = threading.Timer(LATE_START, lambda: backends.append(MockBackend(config, port=port).start()))
+        if name == "late_start":
+            timer.start()
+        response, seconds = ask(url, name, policy)
+        if name == "late_start":
+            timer.join()
+        for backend in backends:
+            backend.stop()
+    else:
+        with MockBackend(config) as backend:
+            url = backend.url
+            response, seconds = ask(url, name, policy)
+
+    outcomes = registry.snapshot()["counters"]["esma_requests_total"].get(url, {})
+    label = next(iter(outcomes), None)
+    retries = registry.snapshot()["counters"].get("esma_connect_retries_total", {}).get(url, {}).get("all", 0)
+    return {
+        "scenario": name,
+        "result": classify(response, expected_answer(config)),
+        "label": label,
+        "seconds": seconds,
+        "connect_retries": retries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [run(name) for name in args.scenarios]
+    print(f"{'scenario':<19} {'result':<9} {'label':<19} {'seconds':>7} {'retries':>7}")
+    for r in results:
+        print(f"{r['scenario']:<19} {r['result']:<9} {str(r['label']):<19} {r['seconds']:>7.2f}"
+              f" {r['connect_retries']:>7g}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Admission control for ESMA Chat
+Process-wide limit on concurrent backend streams with a bounded FIFO wait queue
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+from src.metrics import registry
+
+# Answer streams allowed to run against the backend at once, across all sessions
+MAX_CONCURRENT_STREAMS = int(os.getenv("ESMA_MAX_CONCURRENT_STREAMS", "20"))
+# Requests allowed to wait for a slot; further requests are rejected immediately
+MAX_QUEUED_STREAMS = int(os.getenv("ESMA_MAX_QUEUED_STREAMS", "50"))
+# Seconds a request may wait in the queue before giving up
+QUEUE_TIMEOUT = float(os.getenv("ESMA_QUEUE_TIMEOUT", "120"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot get a stream slot"""
+
+
+class QueueFull(AdmissionRejected):
+    """The wait queue already holds MAX_QUEUED_STREAMS requests"""
+
+
+class QueueTimeout(AdmissionRejected):
+    """The request waited QUEUE_TIMEOUT seconds without getting a slot"""
+
+
+class QueueCancelled(AdmissionRejected):
+    """The request was cancelled while it waited"""
+
+
+class AdmissionController:
+    """
+    Counting semaphore with a bounded first-in-first-out wait queue
+
+    Shared by every Streamlit session in the process. Waiting requests are
+    admitted in arrival order and can report their queue position while
+    they wait, so the UI can show it.
+    """
+
+    def __init__(
+        self,
+        limit: int = MAX_CONCURRENT_STREAMS,
+        max_queued: int = MAX_QUEUED_STREAMS,
+        timeout: float = QUEUE_TIMEOUT
+    ):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.active = 0
+        self._waiting: Deque[object] = deque()
+        self._condition = threading.Condition()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def acquire(
+        self,
+        on_position: Optional[Callable[[int], None]] = None,
+        cancel: Optional[threading.Event] = None
+    ):
+        """
+        Take a stream slot, waiting in line if all are busy
+
+        Args:
+            on_position: Called from the calling thread, outside any lock, with
+                the 1-based queue position whenever it changes, and with 0 once
+                the request is admitted after waiting
+            cancel: Leaves the queue when set
+
+        Raises:
+            QueueFull: The queue is full; raised without waiting
+            QueueTimeout: No slot became free within the queue timeout
+            QueueCancelled: `cancel` was set while waiting
+        """
+        with self._condition:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                registry.increment("esma_admission_total", outcome="admitted")
+                return
+            if len(self._waiting) >= self.max_queued:
+                registry.increment("esma_admission_total", outcome="rejected")
+                raise QueueFull(f"{len(self._waiting)} requests already waiting")
+            ticket = object()
+            self._waiting.append(ticket)
+
+        deadline = time.monotonic() + self.timeout
+        reported = None
+        try:
+            while True:
+                with self._condition:
+                    if self._waiting[0] is ticket and self.active < self.limit:
+                        self._waiting.popleft()
+                        self.active += 1
+                        # The next in line may be admissible too
+                        self._condition.notify_all()
+                        break
+                    position = self._waiting.index(ticket) + 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        registry.increment("esma_admission_total", outcome="timeout")
+                        raise QueueTimeout(f"No stream slot after {self.timeout:g}s")
+                    if cancel is not None and cancel.is_set():
+                        registry.increment("esma_admission_total", outcome="cancelled")
+                        raise QueueCancelled("Cancelled while waiting")
+                    if position == reported or on_position is None:
+                        self._condition.wait(min(remaining, 0.25 if cancel is not None else 1.0))
+                        continue
+                reported = position
+                on_position(position)
+        finally:
+            with self._condition:
+                if ticket in self._waiting:
+                    # Timed out, or the script was stopped while waiting
+                    self._waiting.remove(ticket)
+                    self._condition.notify_all()
+
+        registry.increment("esma_admission_total", outcome="queued")
+        if on_position is not None:
+            on_position(0)
+
+    def release(self):
+        """Give back a slot taken with acquire()."""
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide AdmissionController, creating it on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+                registry.gauge("esma_streams_active", "Answer streams running", lambda: _controller.active)
+                registry.gauge("esma_streams_queued", "Answer streams waiting for a slot", lambda: _controller.queued)
+    return _controller
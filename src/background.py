@@ -0,0 +1,338 @@
+"""
+Background answer streaming for ESMA Chat
+Runs a question in a worker thread while script runs poll its output
+"""
+
+import os
+import threading
+import time
+import streamlit as st
+from typing import Callable, List, Optional, Tuple
+
+from src.client import get_api_response_streaming
+from src.conversations import Conversation
+from src.metrics import registry
+
+# Seconds between two polls of a running answer
+POLL_INTERVAL = float(os.getenv("ESMA_POLL_INTERVAL", "0.05"))
+# Seconds between status redraws while nothing changes. Streamlit only notices
+# clicks (such as "stop") when the script sends something to the browser
+HEARTBEAT_INTERVAL = 0.25
+
+_TASK_KEY = "stream_task"
+
+
+class LatestElement:
+    """
+    Stand-in for st.empty() that a worker thread can write to
+
+    Keeps only the latest element, like a placeholder does, so a Mirror can
+    draw it onto the real placeholder from the script thread.
+    """
+
+    def __init__(self, on_change: Optional[Callable[[], None]] = None):
+        self._lock = threading.Lock()
+        self._call = None
+        self._on_change = on_change
+        self.version = 0
+        self.updated = 0.0
+
+    def _set(self, call):
+        with self._lock:
+            self._call = call
+        self._changed()
+
+    def _changed(self):
+        with self._lock:
+            self.version += 1
+            self.updated = time.monotonic()
+        if self._on_change is not None:
+            self._on_change()
+
+    def latest(self) -> tuple:
+        """The latest element (a call or a LatestContainer), its version and when it changed"""
+        with self._lock:
+            return self._call, self.version, self.updated
+
+    def markdown(self, body: str, **kwargs):
+        self._set(("markdown", body, kwargs))
+
+    def error(self, body: str, **kwargs):
+        self._set(("error", body, kwargs))
+
+    def warning(self, body: str, **kwargs):
+        self._set(("warning", body, kwargs))
+
+    def info(self, body: str, **kwargs):
+        self._set(("info", body, kwargs))
+
+    def container(self) -> "LatestContainer":
+        box = LatestContainer(self._changed)
+        self._set(box)
+        return box
+
+
+class LatestContainer:
+    """Stand-in for placeholder.container(); elements are only ever appended"""
+
+    def __init__(self, on_change: Callable[[], None]):
+        self._on_change = on_change
+        self.children: list = []
+
+    def _add(self, child):
+        self.children.append(child)
+        self._on_change()
+
+    def markdown(self, body: str, **kwargs):
+        self._add(("markdown", body, kwargs))
+
+    def dataframe(self, data, **kwargs):
+        self._add(("dataframe", data, kwargs))
+
+    def empty(self) -> LatestElement:
+        slot = LatestElement(self._on_change)
+        self._add(slot)
+        return slot
+
+
+class Mirror:
+    """
+    Draws a LatestElement onto a real placeholder during one script run
+
+    Only changes are sent: a container's elements are drawn once as they
+    are appended, and its slots are mirrored recursively, so a table is
+    not resent while the text below it streams.
+    """
+
+    def __init__(self, element: LatestElement, placeholder):
+        self.element = element
+        self.placeholder = placeholder
+        self._seen = -1
+        self._source: Optional[LatestContainer] = None
+        self._box = None
+        self._children: List[Optional["Mirror"]] = []
+
+    def update(self) -> Optional[float]:
+        """
+        Draw what changed since the last update
+
+        Returns:
+            When the drawn output was last changed (time.monotonic()), or None if nothing was drawn
+        """
+        call, version, updated = self.element.latest()
+        if version == self._seen:
+            return None
+        self._seen = version
+
+        if isinstance(call, LatestContainer):
+            if call is not self._source:
+                self._source, self._box, self._children = call, self.placeholder.container(), []
+            for child in call.children[len(self._children):]:
+                if isinstance(child, LatestElement):
+                    self._children.append(Mirror(child, self._box.empty()))
+                else:
+                    kind, body, kwargs = child
+                    getattr(self._box, kind)(body, **kwargs)
+                    self._children.append(None)
+            for child in self._children:
+                if child is not None:
+                    child.update()
+        elif call is not None:
+            self._source = None
+            kind, body, kwargs = call
+            getattr(self.placeholder, kind)(body, **kwargs)
+        else:
+            return None
+        return updated
+
+
+class CallLog:
+    """Stand-in for a container such as st.sidebar; records writes for later replay"""
+
+    def __init__(self):
+        self.calls: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return record
+
+    def replay(self, container):
+        for name, args, kwargs in self.calls:
+            getattr(container, name)(*args, **kwargs)
+
+
+class StreamTask:
+    """
+    One answer streaming in a worker thread, attached to a session
+
+    The thread runs the regular get_api_response_streaming pipeline against
+    stand-in elements. Script runs follow it with follow_task(); a run that
+    is interrupted (e.g. by a click) does not affect the stream, and the
+    next run picks up where the output is.
+    """
+
+    def __init__(
+        self,
+        conversation: Conversation,
+        question: str,
+        base_url: str,
+        connection_timeout: float,
+        debug_mode: bool = False
+    ):
+        self.conversation = conversation
+        self.question = question
+        self.base_url = base_url
+        self.connection_timeout = connection_timeout
+        self.debug_mode = debug_mode
+        self.turn = conversation.answers
+        self.submitted = time.monotonic()
+        self.time_to_first_render: Optional[float] = None
+        self._last_rendered = 0.0
+
+        self.output = LatestElement()
+        self.debug = CallLog()
+        self.queue_position = 0
+        self.response: Optional[str] = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="esma-stream", daemon=True)
+
+    def start(self) -> "StreamTask":
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop the answer; the HTTP stream is closed within a poll interval."""
+        self.cancelled.set()
+
+    def _on_queue(self, position: int):
+        self.queue_position = position
+
+    def rendered(self, updated: float):
+        """
+        Record that output last changed at `updated` reached the session's placeholder
+
+        Redraws of output already shown (e.g. after a rerun) are not counted.
+        """
+        if updated <= self._last_rendered:
+            return
+        self._last_rendered = updated
+        now = time.monotonic()
+        if self.time_to_first_render is None:
+            self.time_to_first_render = now - self.submitted
+            registry.observe("esma_time_to_first_render_seconds", self.base_url, self.time_to_first_render)
+        registry.observe("esma_render_lag_seconds", self.base_url, now - updated)
+
+    def _run(self):
+        try:
+            self.response = get_api_response_streaming(
+                self.question,
+                self.conversation.thread_id,
+                self.output,
+                self.base_url,
+                self.connection_timeout,
+                self.debug_mode,
+                turn=self.turn,
+                on_queue=self._on_queue,
+                cancel=self.cancelled,
+                debug_container=self.debug
+            )
+        except Exception as e:
+            self.response = f"❌ Error inesperado: {str(e)}"
+            self.output.error(self.response)
+        finally:
+            self.done.set()
+
+
+def start_task(conversation: Conversation, question: str, base_url: str,
+               connection_timeout: float, debug_mode: bool = False) -> Optional[StreamTask]:
+    """
+    Add `question` to the conversation and start answering it in the background
+
+    A session answers one question at a time: while its previous answer is
+    still streaming the question is refused, so that answer is neither
+    orphaned nor stored after the new question.
+
+    Returns:
+        The task attached to the session, or None if the question was refused
+    """
+    running = current_task()
+    if running is not None:
+        if not running.done.is_set():
+            return None
+        finish_task(running)
+    conversation.append("user", question)
+    task = StreamTask(conversation, question, base_url, connection_timeout, debug_mode).start()
+    st.session_state[_TASK_KEY] = task
+    st.session_state.is_processing = True
+    return task
+
+
+def current_task() -> Optional[StreamTask]:
+    return st.session_state.get(_TASK_KEY)
+
+
+def finish_task(task: StreamTask):
+    """Store the answer of a finished task and detach it from the session."""
+    task.conversation.append("assistant", task.response, getattr(task.response, "tables", ()))
+    task.debug.replay(st.sidebar)
+    st.session_state[_TASK_KEY] = None
+    st.session_state.is_processing = False
+
+
+def discard_task():
+    """Cancel the session's task, if any, without storing its answer."""
+    task = current_task()
+    if task is not None:
+        task.cancel()
+    st.session_state[_TASK_KEY] = None
+    st.session_state.is_processing = False
+
+
+def follow_task(task: StreamTask, status_placeholder):
+    """
+    Show a running answer with a stop button until it finishes
+
+    Polls the task every POLL_INTERVAL and redraws the answer only when it
+    changed. Clicking stop reruns the script; the new run cancels the task
+    and keeps following it until the stream has closed.
+
+    Args:
+        task: The session's task
+        status_placeholder: Sidebar status element, shows the queue position
+    """
+    with st.chat_message("assistant"):
+        output = st.empty()
+        stop_slot = st.empty()
+        if stop_slot.button("⏹️ Detener respuesta", key="stop_stream"):
+            task.cancel()
+
+    mirror = Mirror(task.output, output)
+    status = None
+    last_status = 0.0
+    while True:
+        # Read before replaying so the final output is drawn before leaving
+        done = task.done.is_set()
+        updated = mirror.update()
+        if updated is not None:
+            task.rendered(updated)
+
+        if task.cancelled.is_set():
+            wanted = ("info", "⏹️ Deteniendo...")
+        elif task.queue_position:
+            wanted = ("warning", f"⏳ En cola: posición {task.queue_position}")
+        else:
+            wanted = ("info", "🔄 Procesando...")
+        now = time.monotonic()
+        if wanted != status or now - last_status >= HEARTBEAT_INTERVAL:
+            getattr(status_placeholder, wanted[0])(wanted[1])
+            status, last_status = wanted, now
+
+        if done:
+            break
+        time.sleep(POLL_INTERVAL)
+
+    stop_slot.empty()
+    status_placeholder.success("✅ Listo")
+    finish_task(task)
@@ -0,0 +1,268 @@
+"""
+Answer cache for ESMA Chat
+Opt-in LRU memory cache with an optional SQLite tier, keyed on the normalized question
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from src.metrics import registry
+
+CACHE_ENABLED = os.getenv("ESMA_CACHE", "0").lower() in ("1", "true", "yes")
+# Seconds an answer stays valid in either tier
+CACHE_TTL = float(os.getenv("ESMA_CACHE_TTL", "86400"))
+# Memory tier limits
+CACHE_MAX_ENTRIES = int(os.getenv("ESMA_CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("ESMA_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Directory for the disk tier (unset keeps the cache in memory only)
+CACHE_DIR = os.getenv("ESMA_CACHE_DIR")
+CACHE_DISK_MAX_BYTES = int(os.getenv("ESMA_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+# Which turns of a conversation may use the cache; see AnswerCache.key
+CACHE_CONTEXT = os.getenv("ESMA_CACHE_CONTEXT", "first_turn")
+
+FIRST_TURN = "first_turn"
+ANY_TURN = "any"
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = "¿?¡!.,;: "
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form of a question for cache lookups
+
+    Case, accents, repeated whitespace and surrounding punctuation are
+    ignored, so "¿Tasa de desempleo 2023 por región?" and
+    "tasa de desempleo 2023 por region" share an entry.
+    """
+    text = unicodedata.normalize("NFKD", question.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _SPACES.sub(" ", text).strip(_EDGE_PUNCTUATION)
+
+
+def question_key(base_url: str, question: str) -> Optional[str]:
+    """Hash of a backend and normalized question, or None for an empty question"""
+    normalized = normalize_question(question)
+    if not normalized:
+        return None
+    return hashlib.sha256(f"{base_url}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """Answers in a SQLite file, evicted by TTL and least-recent access"""
+
+    def __init__(self, directory: str, ttl: float, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "answers.sqlite3")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, question TEXT, answer TEXT,"
+            " created REAL, accessed REAL, size INTEGER)"
+        )
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT answer, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE answers SET accessed = ? WHERE key = ?", (now, key))
+        return row[0], row[1]
+
+    def put(self, key: str, question: str, answer: str, created: float):
+        size = len(answer.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                (key, question, answer, created, created, size)
+            )
+            self._db.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+            if total > self.max_bytes:
+                # Drop least recently used rows until the file fits the budget again
+                excess = total - self.max_bytes
+                for row_key, row_size in self._db.execute(
+                    "SELECT key, size FROM answers ORDER BY accessed"
+                ).fetchall():
+                    if excess <= 0:
+                        break
+                    self._db.execute("DELETE FROM answers WHERE key = ?", (row_key,))
+                    excess -= row_size
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class AnswerCache:
+    """
+    Complete answers keyed on backend URL and normalized question
+
+    Lookups go to an in-memory LRU first and then to the disk tier, which
+    survives restarts when `directory` points at a mounted volume. Disk hits
+    are promoted to memory.
+
+    Only answers that were received completely are stored; errors, empty and
+    interrupted answers never are.
+    """
+
+    def __init__(
+        self,
+        ttl: float = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        directory: Optional[str] = CACHE_DIR,
+        disk_max_bytes: int = CACHE_DISK_MAX_BYTES,
+        context: str = CACHE_CONTEXT
+    ):
+        """
+        Args:
+            ttl: Seconds an answer stays valid
+            max_entries: Answers kept in memory
+            max_bytes: UTF-8 bytes of answers kept in memory
+            directory: Directory for the SQLite tier, or None for memory only
+            disk_max_bytes: UTF-8 bytes of answers kept on disk
+            context: FIRST_TURN or ANY_TURN; see key()
+        """
+        if context not in (FIRST_TURN, ANY_TURN):
+            raise ValueError(f"Unknown cache context policy: {context}")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.context = context
+        self.disk = _DiskTier(directory, ttl, disk_max_bytes) if directory else None
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._bytes = 0
+
+    def key(self, base_url: str, question: str, turn: int = 0) -> Optional[str]:
+        """
+        Cache key for a question, or None when the context policy excludes it
+
+        The backend keeps conversation history per thread_id, so the same
+        words can mean something else later in a conversation. With
+        FIRST_TURN only questions that open a conversation are cached and
+        served; ANY_TURN ignores history and suits deployments where
+        questions are self-contained. Either way the agent's memory for the
+        thread does not include turns answered from the cache.
+
+        Args:
+            base_url: Backend the answer came from
+            question: Question as typed by the user
+            turn: Number of answers already given in this conversation
+        """
+        if self.context == FIRST_TURN and turn > 0:
+            return None
+        return question_key(base_url, question)
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached answer for `key`, counting the lookup as a hit or miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, created, size = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    registry.increment("esma_cache_lookups_total", outcome="hit_memory")
+                    return answer
+                del self._entries[key]
+                self._bytes -= size
+
+        if self.disk is not None:
+            found = self.disk.get(key)
+            if found is not None:
+                answer, created = found
+                self._remember(key, answer, created)
+                registry.increment("esma_cache_lookups_total", outcome="hit_disk")
+                return answer
+
+        registry.increment("esma_cache_lookups_total", outcome="miss")
+        return None
+
+    def put(self, key: str, question: str, answer: str):
+        """Store a complete answer in both tiers"""
+        created = time.time()
+        self._remember(key, answer, created)
+        if self.disk is not None:
+            self.disk.put(key, normalize_question(question), answer, created)
+
+    def _remember(self, key: str, answer: str, created: float):
+        size = len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (answer, created, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def stats(self) -> dict:
+        """
+        Current size and lookup counters
+
+        Returns:
+            {"entries", "bytes", "disk_entries", "hit_memory", "hit_disk", "miss"}
+        """
+        counters = registry.snapshot()["counters"].get("esma_cache_lookups_total", {}).get("", {})
+        with self._lock:
+            entries, size = len(self._entries), self._bytes
+        return {
+            "entries": entries,
+            "bytes": size,
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "hit_memory": counters.get("hit_memory", 0),
+            "hit_disk": counters.get("hit_disk", 0),
+            "miss": counters.get("miss", 0),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Return the process-wide AnswerCache, or None unless ESMA_CACHE is enabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
@@ -3,17 +3,61 @@ API Client module for ESMA Chat
 Handles SSE streaming and response parsing
 """
 
-import json
-import re
+import asyncio
+import os
+import threading
+import time
 import httpx
 import streamlit as st
-from typing import Optional
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from src.admission import AdmissionRejected, QueueCancelled, QueueFull, QueueTimeout, get_admission_controller
+from src.cache import get_answer_cache
+from src.compression import ACCEPT_ENCODING
+from src.connection import IterationCancelled, get_client_manager
+from src.debug import NULL_CAPTURE, start_capture
+from src.formats import StreamDecoder, record_detection
+from src.metrics import RequestMetrics, classify_error, registry
+from src.recording import NULL_RECORDING, start_recording
+from src.render import StreamRenderer
+from src.routing import report_request
+from src.singleflight import Flight, get_single_flight
+from src.sse import decode_content
+from src.tables import Answer, Chunk
+from src.timeouts import Deadline, FirstByteTimeout, IdleTimeout, StreamPolicy, TotalTimeout
+
+# Reconnections attempted in a row after an answer stream drops (0 disables resuming)
+RESUME_ATTEMPTS = int(os.getenv("ESMA_RESUME_ATTEMPTS", "3"))
+# Seconds to wait before reconnecting when the server did not send a `retry:` field
+RESUME_DELAY = float(os.getenv("ESMA_RESUME_DELAY", "1.0"))
+
+INTERRUPTED_MARKER = "\n\n---\n⚠️ *Respuesta incompleta: se perdió la conexión con el servidor.*"
+STOPPED_MARKER = "\n\n---\n⏹️ *Respuesta detenida.*"
+
+
+class BackendStatusError(Exception):
+    """Raised when the API answers the stream request with a non-200 status"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Unexpected status code {status_code}")
+        self.status_code = status_code
+
+
+class StreamInterrupted(Exception):
+    """Raised when a stream that already delivered text drops and cannot be resumed"""
+
+    def __init__(self, cause: Exception):
+        super().__init__(f"Stream interrupted: {type(cause).__name__}: {cause}")
+        self.cause = cause
 
 
 def parse_sse_content(content_str: str, debug: bool = False) -> Optional[str]:
     """
     Parse SSE content handling repr() format from the API with mixed quotes
     
+    Thin wrapper over src.sse.decode_content, which reads standard JSON and
+    the API's repr()-style payloads in a single pass.
+    
     Args:
         content_str: Raw SSE content string
         debug: Enable debug output in Streamlit sidebar
@@ -24,212 +68,411 @@ def parse_sse_content(content_str: str, debug: bool = False) -> Optional[str]:
     if debug:
         st.sidebar.code(f"Raw SSE: {content_str[:100]}", language=None)
     
-    try:
-        # The API sends malformed JSON with mixed quotes: {"type": "content", "content": 'actual content'}
-        # We need to fix this to be valid JSON
-        
-        # Method 1: Try to fix mixed quotes
-        if '"content": \'' in content_str or '"content":\'' in content_str:
-            # Handle both with and without space after colon
-            if '"content": \'' in content_str:
-                start_marker = '"content": \''
-            else:
-                start_marker = '"content":\''
-            
-            start_idx = content_str.index(start_marker) + len(start_marker)
-            
-            # The content might be incomplete (truncated) or complete
-            # Look for the ending pattern '} or just take everything if incomplete
-            if content_str.endswith('\'}'):
-                end_idx = len(content_str) - 2  # Before '}
-            elif '\'}\n' in content_str:
-                end_idx = content_str.index('\'}\n')
-            elif '\'}' in content_str:
-                end_idx = content_str.index('\'}')
-            else:
-                # Content is truncated, take everything after the marker
-                end_idx = len(content_str)
-            
-            # Extract the actual content
-            actual_content = content_str[start_idx:end_idx]
-            
-            # Unescape characters from repr()
-            actual_content = actual_content.replace("\\n", "\n")
-            actual_content = actual_content.replace("\\t", "\t")
-            actual_content = actual_content.replace("\\'", "'")
-            actual_content = actual_content.replace("\\\\", "\\")
-            
-            if debug:
-                st.sidebar.success(f"Extracted: {actual_content[:50]}...")
-            
-            return actual_content if actual_content else None
-        
-        # Method 2: Try standard JSON parsing (in case the API is fixed)
+    content = decode_content(content_str.strip())
+    
+    if debug:
+        if content is None:
+            st.sidebar.warning("No parsing method succeeded")
+        else:
+            st.sidebar.success(f"Extracted: {content[:50]}...")
+    
+    return content
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    request: httpx.Request,
+    policy: StreamPolicy,
+    deadline: Deadline,
+    metrics: RequestMetrics
+) -> Tuple[httpx.Response, float]:
+    """
+    Send the stream request, retrying connect failures with jittered exponential backoff
+    
+    Nothing reached the backend when connecting failed, so retrying the POST
+    is safe. Retries stop at policy.connect_retries or when the backoff would
+    run past the total deadline.
+    
+    Returns:
+        The response, with headers read, and the monotonic time its first body bytes are due by
+    """
+    attempt = 0
+    while True:
+        first_byte_by = time.monotonic() + policy.first_byte
         try:
-            content_data = json.loads(content_str)
-            chunk = content_data.get("content", "")
-            
-            if debug:
-                st.sidebar.info("Standard JSON parsing succeeded")
-            
-            return chunk if chunk else None
-        except json.JSONDecodeError:
-            pass
-        
-        # Method 3: Try to extract any text between quotes
-        # Look for content between any quotes after "content":
-        pattern = r'"content":\s*["\']([^"\']*)["\']'
-        match = re.search(pattern, content_str)
-        if match:
-            content = match.group(1)
-            # Unescape
-            content = content.replace("\\n", "\n")
-            content = content.replace("\\t", "\t")
-            content = content.replace("\\'", "'")
-            content = content.replace("\\\\", "\\")
-            
-            if debug:
-                st.sidebar.info(f"Regex extraction: {content[:50]}...")
+            response = await deadline.wait(
+                client.send(request, stream=True), first_byte_by, FirstByteTimeout, policy.first_byte
+            )
+            return response, first_byte_by
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            delay = policy.backoff_delay(attempt)
+            if attempt >= policy.connect_retries or delay >= deadline.remaining():
+                raise
+            attempt += 1
+            metrics.connect_retries += 1
+            await asyncio.sleep(delay)
+
+
+async def _stream_chunks(
+    url: str,
+    payload: dict,
+    policy: StreamPolicy,
+    decoder: StreamDecoder,
+    metrics: RequestMetrics,
+    capture=NULL_CAPTURE,
+    recording=NULL_RECORDING
+) -> AsyncIterator[List[Chunk]]:
+    """
+    Open the chat stream on the shared pooled client and yield answer chunks
+    
+    Runs on the ClientManager loop; see get_api_response_streaming. Chunks
+    decoded from one network read are yielded together as a batch.
+    
+    Each phase has its own deadline (see src.timeouts): connecting, the first
+    bytes of the answer, silence between reads, and the whole answer. Any read
+    resets the idle watchdog, so SSE heartbeat comments keep a slow answer
+    alive even though they carry no text.
+    
+    If the connection drops or goes idle after the server sent SSE event IDs,
+    the same request is sent again with `Last-Event-ID` after the server's
+    `retry:` delay (RESUME_DELAY by default), up to RESUME_ATTEMPTS times in a
+    row. A server that answers a resume from the first event instead ignores
+    Last-Event-ID and reruns the whole answer, so that stream is not resumed
+    again. A drop that cannot be resumed raises StreamInterrupted once text
+    was delivered, or the original error otherwise.
+    
+    The response may be compressed (see src.compression); httpx decompresses
+    each network read as it arrives, so chunks are not held back.
+    
+    With ESMA_RECORD_DIR set, `recording` keeps every response's status and
+    decompressed body reads with their timing; see src.recording.
+    """
+    client = get_client_manager().client
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    resuming = False
+    failures = 0
+    deadline = Deadline(policy.total)
+    
+    while True:
+        delivered = metrics.chunks
+        try:
+            request = client.build_request(
+                "POST", url, json=payload, headers=headers, timeout=policy.httpx_timeout(),
+                extensions={"trace": metrics.trace}
+            )
+            response, until = await _send(client, request, policy, deadline, metrics)
+            timeout, seconds = FirstByteTimeout, policy.first_byte
+            try:
+                metrics.mark_ttfb()
+                recording.response(response)
+                if response.status_code != 200:
+                    raise BackendStatusError(response.status_code)
+                if not resuming:
+                    decoder.content_type = response.headers.get("content-type")
+                    metrics.content_encoding = response.headers.get("content-encoding", "identity")
+                body = response.aiter_bytes()
+                while True:
+                    try:
+                        data = await deadline.wait(anext(body), until, timeout, seconds)
+                    except StopAsyncIteration:
+                        break
+                    until, timeout, seconds = time.monotonic() + policy.idle, IdleTimeout, policy.idle
+                    metrics.bytes_decoded += len(data)
+                    capture.feed(data)
+                    recording.data(data)
+                    chunks = decoder.feed(data)
+                    metrics.mark_chunks(len(chunks))
+                    if chunks:
+                        capture.chunks(chunks)
+                        recording.chunks(chunks)
+                        yield chunks
+            finally:
+                # Bytes as sent on the wire, before decompression
+                metrics.bytes_received += response.num_bytes_downloaded
+                await response.aclose()
+            break
+        except (httpx.TransportError, BackendStatusError) as e:
+            if metrics.chunks > delivered:
+                failures = 0
+            failures += 1
+            last_event_id = decoder.last_event_id
+            retry = decoder.retry
+            delay = retry / 1000 if retry is not None else RESUME_DELAY
+            # A refused resume (e.g. 204 or 404) means the server cannot continue,
+            # and one that restarted the answer would only restart it again
+            resumable = (
+                last_event_id
+                and not (resuming and isinstance(e, BackendStatusError))
+                and not decoder.restarted
+                and not isinstance(e, TotalTimeout)
+                and delay < deadline.remaining()
+            )
+            if not resumable or failures > RESUME_ATTEMPTS:
+                if metrics.chunks:
+                    raise StreamInterrupted(e) from e
+                raise
             
-            return content
-        
-        if debug:
-            st.sidebar.warning("No parsing method succeeded")
-        
-        return None
-        
-    except Exception as e:
-        if debug:
-            st.sidebar.error(f"Parse error: {e}")
-        return None
+            await asyncio.sleep(delay)
+            decoder.resume()
+            headers["Last-Event-ID"] = last_event_id
+            resuming = True
+            metrics.resumes += 1
+    
+    capture.close()
+    chunks = decoder.close()
+    metrics.mark_chunks(len(chunks))
+    if chunks:
+        capture.chunks(chunks)
+        recording.chunks(chunks)
+        yield chunks
+
+
+def replay_answer(answer: str, placeholder) -> str:
+    """
+    Show a stored answer through the same renderer as a live stream
+    
+    Returns:
+        The answer
+    """
+    renderer = StreamRenderer(placeholder)
+    for line in answer.splitlines(keepends=True):
+        renderer.append(line)
+    return renderer.finish()
+
+
+def _upstream_error(error: Optional[BaseException], metrics: RequestMetrics) -> Optional[str]:
+    """Metric label for how an upstream answer stream ended"""
+    if error is None:
+        return None if metrics.chunks else "empty"
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    if isinstance(error, StreamInterrupted):
+        return "interrupted"
+    return classify_error(error)
+
+
+def _start_upstream(
+    flight: Flight,
+    base_url: str,
+    url: str,
+    payload: dict,
+    policy: StreamPolicy,
+    decoder: StreamDecoder,
+    capture,
+    on_queue: Optional[Callable[[int], None]],
+    cancel: Optional[threading.Event]
+):
+    """
+    Take a stream slot and start the flight's request on the client loop
+    
+    The slot and the request metrics belong to the upstream request rather
+    than to the session that started it: they are released and recorded when
+    the request ends, which for a shared flight can be after the leader
+    stopped following it.
+    
+    Raises:
+        AdmissionRejected: No slot was given; followers of the flight get the same error
+    """
+    # Process-wide limit on concurrent backend streams; see src.admission
+    admission = get_admission_controller()
+    try:
+        admission.acquire(on_queue, flight.leader_cancel(cancel))
+    except AdmissionRejected as e:
+        flight.abort(e)
+        raise
+    
+    # Aggregated process-wide and exported; see src.metrics
+    metrics = flight.metrics = RequestMetrics(backend=base_url)
+    # Opt-in capture of the stream for offline replay; see src.recording
+    recording = start_recording(base_url)
+    
+    def finished(error: Optional[BaseException]):
+        admission.release()
+        metrics.parse_failures = decoder.parse_failures
+        metrics.finish(_upstream_error(error, metrics))
+        registry.record(metrics)
+        # Latency and failures steer routing across backends; see src.routing
+        report_request(metrics)
+        recording.finish(metrics.error)
+    
+    flight.start(_stream_chunks(url, payload, policy, decoder, metrics, capture, recording), finished)
+
+
+def _debug_summary(decoder: StreamDecoder, chunk_count: int, metrics: Optional[RequestMetrics]) -> str:
+    """
+    One-line stream summary for the debug sidebar
+
+    A follower's flight has no metrics until its leader was admitted, and
+    none at all if the flight was aborted, so those fields show n/a.
+    """
+    summary = f"Format: {decoder.format}, Chunks: {chunk_count}, Parse failures: {decoder.parse_failures}, "
+    if metrics is None:
+        return summary + "Resumes: n/a, Encoding: n/a, Bytes: n/a"
+    return summary + (
+        f"Resumes: {metrics.resumes}, Encoding: {metrics.content_encoding}, "
+        f"Bytes: {metrics.bytes_received} wire / {metrics.bytes_decoded} decoded"
+    )
 
 
-async def get_api_response_streaming(
+def get_api_response_streaming(
     message: str, 
     thread_id: str, 
     placeholder, 
     base_url: str,
     connection_timeout: float = 60.0,
-    debug_mode: bool = False
+    debug_mode: bool = False,
+    turn: int = 0,
+    on_queue: Optional[Callable[[int], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    debug_container=None,
+    policy: Optional[StreamPolicy] = None
 ):
     """
     Get streaming response from API and display it in real-time
     
+    The HTTP stream runs on the process-wide ClientManager loop, reusing pooled
+    connections, while the placeholder is updated from the calling script thread.
+    With ESMA_SINGLE_FLIGHT, a first question identical to one already streaming
+    follows that stream instead of sending its own request.
+    
     Args:
         message: User message to send
         thread_id: Conversation thread ID
         placeholder: Streamlit placeholder for displaying response
         base_url: API base URL
-        connection_timeout: Timeout for API connection
+        connection_timeout: Seconds allowed for the whole answer, retries and resumes included;
+            the other phase deadlines come from src.timeouts
         debug_mode: Enable debug output
+        turn: Answers already given in this conversation, for the cache and sharing policies
+        on_queue: Called with the queue position while waiting for a stream slot, and 0 once admitted
+        cancel: Event that stops the answer and closes the HTTP stream when set
+        debug_container: Where debug output goes; defaults to st.sidebar
+        policy: Deadlines and connect retries; defaults to the src.timeouts settings
+            with connection_timeout as the total
     
     Returns:
-        Complete response string or error message
+        Complete response string (an Answer with its tables, if any) or error message
     """
+    sidebar = debug_container if debug_container is not None else st.sidebar
+    
+    # Opt-in; see src.cache for which turns may be served from it
+    cache = get_answer_cache()
+    cache_key = cache.key(base_url, message, turn) if cache is not None else None
+    if cache_key is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            if debug_mode:
+                sidebar.info(f"Cache hit: {cache_key[:12]}")
+            return replay_answer(cached, placeholder)
+    
     url = f"{base_url}/chat/stream"
     payload = {
         "message": message,
         "thread_id": thread_id
     }
     
+    # Identical opening questions already streaming share one upstream
+    # request; every other request gets a flight of its own. See src.singleflight
+    flights = get_single_flight()
+    flight_key = flights.key(base_url, message, turn, debug_mode) if flights is not None else None
+    flight, leader = flights.join(flight_key) if flight_key is not None else (Flight(), True)
+    
     full_response = ""
+    renderer = StreamRenderer(placeholder)
+    # Bounded and written to the sidebar only once the stream is over; see src.debug
+    capture = start_capture(debug_mode)
+    # The wire format (SSE, NDJSON or plain text) is detected once from the
+    # first bytes; see src.formats
+    decoder = StreamDecoder()
     
     try:
-        async with httpx.AsyncClient(timeout=connection_timeout) as client:
-            try:
-                async with client.stream("POST", url, json=payload) as response:
-                    if response.status_code != 200:
-                        error_msg = f"❌ Error: El servidor respondió con código {response.status_code}"
-                        placeholder.error(error_msg)
-                        return error_msg
-                    
-                    line_count = 0
-                    chunk_count = 0
-                    all_lines = []  # Store all lines for debugging
-                    
-                    # Process streaming response
-                    async for line in response.aiter_lines():
-                        line_count += 1
-                        all_lines.append(line)
-                        
-                        if debug_mode:
-                            # Show ALL lines, not just first 5
-                            if line_count <= 10:
-                                # Show the line with special character visualization
-                                display_line = repr(line) if line else "[EMPTY LINE]"
-                                st.sidebar.text(f"Line {line_count}: {display_line[:100]}")
-                        
-                        # Try different SSE formats
-                        # Standard SSE format: "data: ..."
-                        if line.startswith("data: "):
-                            content_str = line[len("data: "):].strip()
-                            
-                            if debug_mode and line_count <= 3:
-                                st.sidebar.code(f"Data content: {content_str[:100]}", language=None)
-                            
-                            # Skip empty data or special SSE signals
-                            if not content_str or content_str == "[DONE]":
-                                continue
-                            
-                            chunk = parse_sse_content(content_str, debug=debug_mode and chunk_count < 3)
-                            
-                            if chunk:
-                                chunk_count += 1
-                                full_response += chunk
-                                # Update the placeholder with accumulated response
-                                placeholder.markdown(full_response + "▌")
-                        
-                        # Also try parsing lines directly as JSON (some APIs don't use SSE format)
-                        elif line.strip() and not line.startswith(":"):  # Skip comments and empty lines
-                            try:
-                                # Try to parse the line directly as JSON
-                                data = json.loads(line)
-                                if isinstance(data, dict):
-                                    # Look for content in various possible fields
-                                    content = data.get("content") or data.get("text") or data.get("message") or data.get("response")
-                                    if content:
-                                        chunk_count += 1
-                                        full_response += str(content)
-                                        placeholder.markdown(full_response + "▌")
-                                        
-                                        if debug_mode:
-                                            st.sidebar.success(f"Found content in JSON: {content[:50]}")
-                            except json.JSONDecodeError:
-                                # Not JSON, might be plain text
-                                if line.strip() and len(line.strip()) > 1:
-                                    if debug_mode:
-                                        st.sidebar.warning(f"Non-JSON line: {line[:50]}")
-                                    # You could potentially add plain text handling here
-                                    pass
-                    
-                    if debug_mode:
-                        st.sidebar.info(f"Total lines: {line_count}, Chunks: {chunk_count}")
-                        if line_count > 0 and chunk_count == 0:
-                            st.sidebar.error("⚠️ Lines received but no chunks processed!")
-                            st.sidebar.text("First few lines received:")
-                            for i, line in enumerate(all_lines[:5]):
-                                st.sidebar.code(f"{i+1}: {repr(line[:200])}", language=None)
-                    
-                    # Remove cursor and show final response
-                    if full_response:
-                        placeholder.markdown(full_response)
+        if leader:
+            _start_upstream(
+                flight, base_url, url, payload, policy or StreamPolicy(total=connection_timeout),
+                decoder, capture, on_queue, cancel
+            )
+        batches = flight.follow(cancel)
+        try:
+            chunk_count = 0
+            
+            # Process streaming response
+            for batch in batches:
+                for chunk in batch:
+                    chunk_count += 1
+                    if isinstance(chunk, str):
+                        # Buffered; the placeholder is redrawn at a bounded rate
+                        renderer.append(chunk)
                     else:
-                        error_msg = "⚠️ No se recibió respuesta del servidor"
-                        if debug_mode:
-                            error_msg += f"\n\nDebug: {line_count} líneas recibidas, {chunk_count} chunks procesados"
-                        placeholder.warning(error_msg)
-                        return error_msg
-                        
-            except httpx.TimeoutException:
-                error_msg = "⏱️ Tiempo de espera agotado. Por favor, intenta de nuevo."
-                placeholder.error(error_msg)
-                return error_msg
-                
-            except httpx.ConnectError:
-                error_msg = "🔌 No se pudo conectar con el servidor. Verifica tu conexión a internet."
-                placeholder.error(error_msg)
+                        # Typed table event, drawn once as a dataframe; see src.tables
+                        renderer.add_table(chunk)
+            
+            if leader:
+                record_detection(base_url, decoder.format)
+            
+            # Remove cursor and show final response
+            full_response = renderer.finish()
+            if not full_response and not renderer.tables:
+                error_msg = "⚠️ No se recibió respuesta del servidor"
+                if debug_mode:
+                    error_msg += f"\n\nDebug: formato {decoder.format}, {chunk_count} chunks procesados"
+                placeholder.warning(error_msg)
                 return error_msg
-                
+            
+            if renderer.tables:
+                # The cache holds text only; answers with tables are not stored
+                full_response = Answer(full_response, renderer.tables)
+            elif cache_key is not None and leader:
+                cache.put(cache_key, message, full_response)
+
+        except IterationCancelled:
+            # Closing `batches` below leaves the flight; the request is cancelled
+            # and its connection dropped unless other sessions still follow it
+            renderer.append(STOPPED_MARKER)
+            full_response = Answer(renderer.finish(), renderer.tables)
+            return full_response
+        
+        except StreamInterrupted as e:
+            # Keep what arrived, clearly marked, instead of discarding the answer
+            renderer.append(INTERRUPTED_MARKER)
+            if debug_mode:
+                resumes = flight.metrics.resumes if flight.metrics is not None else 0
+                renderer.append(f"\n\nDebug: {e.cause!r}, {resumes} reanudaciones")
+            full_response = Answer(renderer.finish(), renderer.tables)
+            return full_response
+        
+        except BackendStatusError as e:
+            error_msg = f"❌ Error: El servidor respondió con código {e.status_code}"
+            placeholder.error(error_msg)
+            return error_msg
+            
+        except httpx.TimeoutException:
+            error_msg = "⏱️ Tiempo de espera agotado. Por favor, intenta de nuevo."
+            placeholder.error(error_msg)
+            return error_msg
+            
+        except httpx.ConnectError:
+            error_msg = "🔌 No se pudo conectar con el servidor. Verifica tu conexión a internet."
+            placeholder.error(error_msg)
+            return error_msg
+            
+        finally:
+            batches.close()
+            if capture.enabled:
+                capture.render(sidebar, _debug_summary(decoder, chunk_count, flight.metrics))
+    
+    # Raised by the leader's admission, and in followers of a flight that was not admitted
+    except QueueFull:
+        error_msg = "🚦 Hay demasiadas consultas en curso. Por favor, intenta de nuevo en unos minutos."
+        placeholder.error(error_msg)
+        return error_msg
+    except QueueTimeout:
+        error_msg = "⏳ Tu consulta esperó demasiado en la cola. Por favor, intenta de nuevo."
+        placeholder.error(error_msg)
+        return error_msg
+    except QueueCancelled:
+        placeholder.markdown(STOPPED_MARKER.strip())
+        return STOPPED_MARKER.strip()
+            
     except Exception as e:
         error_msg = f"❌ Error inesperado: {str(e)}"
         if debug_mode:
@@ -237,4 +480,4 @@ async def get_api_response_streaming(
         placeholder.error(error_msg)
         return error_msg
     
-    return full_response
\ No newline at end of file
+    return full_response
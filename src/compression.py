@@ -0,0 +1,57 @@
+"""
+Compressed transport for ESMA Chat
+Negotiates the Content-Encoding of answer streams with the backend
+"""
+
+import importlib.util
+import os
+from typing import List, Sequence
+
+# Encodings offered for /chat/stream, most preferred first; "identity" (or empty) disables compression
+STREAM_ENCODINGS = os.getenv("ESMA_STREAM_ENCODINGS", "zstd,br,gzip")
+
+# Packages httpx needs to decode each encoding; gzip and deflate only need zlib
+_DECODER_PACKAGES = {
+    "gzip": (),
+    "deflate": (),
+    "br": ("brotli", "brotlicffi"),
+    "zstd": ("zstandard",),
+}
+
+
+def decoder_available(encoding: str) -> bool:
+    """Whether httpx can decode `encoding` in this environment"""
+    packages = _DECODER_PACKAGES.get(encoding)
+    if packages is None:
+        return False
+    return not packages or any(importlib.util.find_spec(package) is not None for package in packages)
+
+
+def available_encodings(preferred: str = STREAM_ENCODINGS) -> List[str]:
+    """
+    Encodings from a comma-separated preference list that can be decoded here
+
+    br and zstd need the optional `brotli` and `zstandard` packages
+    (`pip install "httpx[brotli,zstd]"`); without them they are not offered.
+    """
+    encodings = [encoding.strip().lower() for encoding in preferred.split(",")]
+    return [encoding for encoding in dict.fromkeys(encodings) if decoder_available(encoding)]
+
+
+def accept_encoding(encodings: Sequence[str]) -> str:
+    """
+    Accept-Encoding header value offering `encodings` in order of preference
+
+    Preference is expressed with q-values, since servers are free to ignore
+    the order of the list. Without encodings, only identity is accepted.
+    """
+    if not encodings:
+        return "identity"
+    step = 0.9 / len(encodings)
+    return ", ".join(
+        encoding if i == 0 else f"{encoding};q={1 - i * step:.2f}"
+        for i, encoding in enumerate(encodings)
+    )
+
+
+ACCEPT_ENCODING = accept_encoding(available_encodings())
@@ -0,0 +1,153 @@
+"""
+Connection management for ESMA Chat
+Keeps a process-wide pooled HTTP client on a long-lived background event loop
+"""
+
+import asyncio
+import atexit
+import importlib.util
+import os
+import threading
+import httpx
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Pool limits, overridable per deployment through environment variables
+MAX_CONNECTIONS = int(os.getenv("ESMA_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("ESMA_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("ESMA_KEEPALIVE_EXPIRY", "120.0"))
+HTTP2_ENABLED = os.getenv("ESMA_HTTP2", "0").lower() in ("1", "true", "yes")
+
+# Seconds between checks of a cancel event while waiting for the next batch
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class IterationCancelled(Exception):
+    """Raised in a reader's thread when its cancel event is set, e.g. by Flight.follow"""
+
+
+class ClientManager:
+    """
+    Owns one httpx.AsyncClient and the event loop it lives on.
+
+    The loop runs in a daemon thread for the lifetime of the process, so every
+    Streamlit session reuses the same keep-alive pool instead of paying DNS,
+    TCP and TLS setup on each question. Coroutines are submitted from script
+    threads with `submit`.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = KEEPALIVE_EXPIRY,
+        http2: bool = HTTP2_ENABLED
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        # HTTP/2 needs the optional `h2` package; fall back to HTTP/1.1 without it
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared client. Only use it from coroutines running on the manager loop."""
+        if self._client is None:
+            raise RuntimeError("ClientManager is not running")
+        return self._client
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self.start()
+        return self._loop
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background loop thread if it is not running yet."""
+        with self._lock:
+            if self.running:
+                return
+
+            ready = threading.Event()
+            loop = asyncio.new_event_loop()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                self._client = httpx.AsyncClient(limits=self.limits, http2=self.http2)
+                ready.set()
+                loop.run_forever()
+
+            self._loop = loop
+            self._thread = threading.Thread(target=run_loop, name="esma-client-loop", daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def submit(self, coro: Awaitable[T]):
+        """
+        Schedule a coroutine on the manager loop
+
+        Returns:
+            concurrent.futures.Future with the coroutine result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self, timeout: float = 5.0):
+        """Close pooled connections and stop the loop thread."""
+        with self._lock:
+            if not self.running:
+                return
+
+            async def aclose():
+                await self._client.aclose()
+
+            try:
+                asyncio.run_coroutine_threadsafe(aclose(), self._loop).result(timeout)
+            except Exception:
+                pass
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._loop.close()
+
+            self._client = None
+            self._thread = None
+            self._loop = None
+
+
+_manager: Optional[ClientManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager() -> ClientManager:
+    """Return the process-wide ClientManager, starting it on first use."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ClientManager()
+    _manager.start()
+    return _manager
+
+
+def shutdown():
+    """Close the process-wide ClientManager, if one was started."""
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
+
+
+atexit.register(shutdown)
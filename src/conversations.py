@@ -0,0 +1,355 @@
+"""
+Conversation storage for ESMA Chat
+Full transcripts in SQLite keyed by thread_id, with a bounded recent window in memory
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from src.metrics import registry
+from src.tables import table_from_ipc, table_to_ipc
+
+# SQLite file holding every transcript. Point it at a mounted volume: the default
+# is in the temp directory, which on Cloud Run is an in-memory filesystem
+CONVERSATION_DB_SETTING = os.getenv("ESMA_CONVERSATION_DB")
+CONVERSATION_DB = CONVERSATION_DB_SETTING or os.path.join(tempfile.gettempdir(), "esma-conversations.sqlite3")
+# Most recent messages of a conversation kept in memory
+SESSION_WINDOW = int(os.getenv("ESMA_SESSION_WINDOW", "20"))
+# Bytes of messages a conversation may keep in memory; older ones are read back from SQLite
+SESSION_MEMORY_BUDGET = int(os.getenv("ESMA_SESSION_MEMORY_BUDGET", str(512 * 1024)))
+# Seconds without activity before a conversation's window is dropped from memory
+SESSION_IDLE_SECONDS = float(os.getenv("ESMA_SESSION_IDLE_SECONDS", "900"))
+# Seconds without activity (messages or views) before a transcript is deleted from
+# SQLite. Without a configured DB the file may live in memory, so transcripts go sooner
+CONVERSATION_RETENTION = float(os.getenv(
+    "ESMA_CONVERSATION_RETENTION", "86400" if CONVERSATION_DB_SETTING else str(SESSION_IDLE_SECONDS)
+))
+
+# Minimum seconds between two idle sweeps
+SWEEP_INTERVAL = 60.0
+
+
+def message_size(message: dict) -> int:
+    """Approximate bytes a message occupies in memory, tables included"""
+    size = sys.getsizeof(message) + sys.getsizeof(message["role"]) + sys.getsizeof(message["content"])
+    return size + sum(table.nbytes for table in message.get("tables", ()))
+
+
+def _message(role: str, content: str, tables: Sequence = ()) -> dict:
+    message = {"role": role, "content": content}
+    if tables:
+        message["tables"] = list(tables)
+    return message
+
+
+class _Window:
+    """Recent messages of one conversation held in memory"""
+
+    __slots__ = ("start", "messages", "bytes", "total", "answers", "last_active", "touched")
+
+    def __init__(self, total: int, answers: int):
+        self.start = total
+        self.messages: List[dict] = []
+        self.bytes = 0
+        self.total = total
+        self.answers = answers
+        self.last_active = time.monotonic()
+        # Wall-clock time last written to threads.last_active
+        self.touched = 0.0
+
+
+class ConversationStore:
+    """
+    Transcripts in SQLite with a small per-conversation window in memory
+
+    Every message is written to SQLite on arrival. Memory only holds the
+    last `window` messages of each active conversation, trimmed further to
+    `budget` bytes, so a session's footprint stays constant however long
+    the conversation gets. Tables of an answer are stored alongside it in
+    the Arrow IPC format. Older messages are read back when they are
+    viewed. Windows of idle conversations are dropped and reloaded on the
+    next access; transcripts idle for longer than `retention` are deleted.
+    Viewing a conversation counts as activity, and a conversation whose
+    window is in memory and not idle is never deleted. A deleted transcript
+    leaves its answer count behind, so a later question in that thread,
+    which the backend may still remember, is not mistaken for an opening
+    one by the cache and single-flight policies.
+
+    The SQLite file is only cheaper than session state if it is on disk. On
+    Cloud Run the container filesystem is held in memory, so ESMA_CONVERSATION_DB
+    should point at a mounted volume; without it transcripts are kept no longer
+    than their window (see CONVERSATION_RETENTION).
+    """
+
+    def __init__(
+        self,
+        path: str = CONVERSATION_DB,
+        window: int = SESSION_WINDOW,
+        budget: int = SESSION_MEMORY_BUDGET,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        retention: float = CONVERSATION_RETENTION
+    ):
+        """
+        Args:
+            path: SQLite file, or ":memory:"
+            window: Messages kept in memory per conversation
+            budget: Bytes kept in memory per conversation
+            idle_seconds: Inactivity before a window leaves memory
+            retention: Inactivity before a transcript is deleted
+        """
+        self.path = path
+        self.window = window
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.retention = retention
+
+        self._lock = threading.Lock()
+        self._windows: Dict[str, _Window] = {}
+        self._last_sweep = time.monotonic()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " thread_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT, content TEXT,"
+            " PRIMARY KEY (thread_id, seq)) WITHOUT ROWID"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            " thread_id TEXT PRIMARY KEY, messages INTEGER, answers INTEGER, last_active REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS message_tables ("
+            " thread_id TEXT NOT NULL, seq INTEGER NOT NULL, position INTEGER NOT NULL, data BLOB,"
+            " PRIMARY KEY (thread_id, seq, position)) WITHOUT ROWID"
+        )
+
+    def conversation(self, thread_id: str) -> "Conversation":
+        return Conversation(self, thread_id)
+
+    def _load(self, thread_id: str) -> _Window:
+        """Window for a conversation, loading it from SQLite if it is not in memory (lock held)"""
+        window = self._windows.get(thread_id)
+        if window is None:
+            row = self._db.execute(
+                "SELECT messages, answers FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            window = _Window(*(row or (0, 0)))
+            if window.total:
+                window.start = max(window.total - self.window, 0)
+                for message in self._read(thread_id, window.start, window.total):
+                    self._remember(window, message)
+            self._windows[thread_id] = window
+        window.last_active = time.monotonic()
+        now = time.time()
+        if now - window.touched >= SWEEP_INTERVAL:
+            # Views keep a transcript alive too, written at most once per sweep interval
+            self._db.execute("UPDATE threads SET last_active = ? WHERE thread_id = ?", (now, thread_id))
+            window.touched = now
+        return window
+
+    def _read(self, thread_id: str, start: int, end: int) -> List[dict]:
+        """Messages from `start` to `end` (exclusive) read from SQLite (lock held)"""
+        tables: Dict[int, list] = {}
+        for seq, data in self._db.execute(
+            "SELECT seq, data FROM message_tables WHERE thread_id = ? AND seq >= ? AND seq < ?"
+            " ORDER BY seq, position",
+            (thread_id, start, end)
+        ):
+            tables.setdefault(seq, []).append(table_from_ipc(data))
+        return [
+            _message(role, content, tables.get(seq, ()))
+            for seq, role, content in self._db.execute(
+                "SELECT seq, role, content FROM messages WHERE thread_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (thread_id, start, end)
+            )
+        ]
+
+    def _remember(self, window: _Window, message: dict):
+        window.messages.append(message)
+        window.bytes += message_size(message)
+        while window.messages and (len(window.messages) > self.window or window.bytes > self.budget):
+            window.bytes -= message_size(window.messages.pop(0))
+            window.start += 1
+
+    def append(self, thread_id: str, role: str, content: str, tables: Sequence = ()):
+        """
+        Args:
+            tables: Arrow tables referenced by markers in `content`; see src.tables
+        """
+        # Plain str: an Answer would keep its tables alive a second time
+        content = str(content)
+        message = _message(role, content, tables)
+        with self._lock:
+            window = self._load(thread_id)
+            self._db.execute(
+                "INSERT INTO messages VALUES (?, ?, ?, ?)", (thread_id, window.total, role, content)
+            )
+            self._db.executemany(
+                "INSERT INTO message_tables VALUES (?, ?, ?, ?)",
+                [(thread_id, window.total, i, table_to_ipc(table)) for i, table in enumerate(tables)]
+            )
+            window.total += 1
+            window.answers += role == "assistant"
+            window.touched = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?)",
+                (thread_id, window.total, window.answers, window.touched)
+            )
+            self._remember(window, message)
+        self._maybe_sweep()
+
+    def count(self, thread_id: str) -> int:
+        with self._lock:
+            return self._load(thread_id).total
+
+    def answers(self, thread_id: str) -> int:
+        with self._lock:
+            return self._load(thread_id).answers
+
+    def messages(self, thread_id: str, start: int = 0) -> List[dict]:
+        """
+        Messages from position `start` to the end
+
+        Served from memory when the window covers `start`; otherwise the
+        older part is read from SQLite for this call only.
+        """
+        with self._lock:
+            window = self._load(thread_id)
+            recent = list(window.messages)
+            window_start = window.start
+            if start >= window_start:
+                return recent[start - window_start:]
+            older = self._read(thread_id, start, window_start)
+        return older + recent
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL:
+            self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """
+        Drop idle windows from memory and expired transcripts from SQLite
+
+        Returns:
+            Number of windows dropped from memory
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._last_sweep = now
+            idle = [
+                thread_id for thread_id, window in self._windows.items()
+                if now - window.last_active > self.idle_seconds
+            ]
+            for thread_id in idle:
+                del self._windows[thread_id]
+
+            # Conversations still in use are skipped, whatever their stored last_active
+            expired = [
+                thread_id for (thread_id,) in self._db.execute(
+                    "SELECT thread_id FROM threads WHERE last_active < ? AND messages > 0",
+                    (time.time() - self.retention,)
+                ).fetchall()
+                if thread_id not in self._windows
+            ]
+            for thread_id in expired:
+                self._expire(thread_id)
+        return len(idle)
+
+    def delete(self, thread_id: str):
+        """Remove a conversation from memory and SQLite, e.g. when the user starts a new one"""
+        with self._lock:
+            self._windows.pop(thread_id, None)
+            self._delete(thread_id)
+
+    def _delete(self, thread_id: str):
+        """Delete a transcript from SQLite (lock held)"""
+        self._delete_messages(thread_id)
+        self._db.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+    def _expire(self, thread_id: str):
+        """Delete an expired transcript but keep its answer count, starting it over empty (lock held)"""
+        self._delete_messages(thread_id)
+        self._db.execute("UPDATE threads SET messages = 0 WHERE thread_id = ?", (thread_id,))
+
+    def _delete_messages(self, thread_id: str):
+        self._db.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+        self._db.execute("DELETE FROM message_tables WHERE thread_id = ?", (thread_id,))
+
+    def memory_report(self) -> dict:
+        """
+        Memory held by conversation windows
+
+        Returns:
+            {"sessions", "total_bytes", "mean_bytes", "max_bytes",
+             "per_session": {thread_id: bytes}}
+        """
+        with self._lock:
+            per_session = {thread_id: window.bytes for thread_id, window in self._windows.items()}
+        total = sum(per_session.values())
+        return {
+            "sessions": len(per_session),
+            "total_bytes": total,
+            "mean_bytes": total / len(per_session) if per_session else 0,
+            "max_bytes": max(per_session.values(), default=0),
+            "per_session": per_session,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Conversation:
+    """One thread's view of the store, used where a list of messages used to be"""
+
+    def __init__(self, store: ConversationStore, thread_id: str):
+        self.store = store
+        self.thread_id = thread_id
+
+    def __len__(self) -> int:
+        return self.store.count(self.thread_id)
+
+    @property
+    def answers(self) -> int:
+        """Assistant messages so far"""
+        return self.store.answers(self.thread_id)
+
+    def append(self, role: str, content: str, tables: Sequence = ()):
+        self.store.append(self.thread_id, role, content, tables)
+
+    def messages(self, start: int = 0) -> List[dict]:
+        return self.store.messages(self.thread_id, start)
+
+    def delete(self):
+        self.store.delete(self.thread_id)
+
+
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """Return the process-wide ConversationStore, opening it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore()
+                registry.gauge(
+                    "esma_sessions_in_memory", "Conversations with a window in memory",
+                    lambda: _store.memory_report()["sessions"]
+                )
+                registry.gauge(
+                    "esma_session_memory_bytes", "Bytes held by conversation windows",
+                    lambda: _store.memory_report()["total_bytes"]
+                )
+                registry.gauge(
+                    "esma_session_memory_max_bytes", "Largest conversation window in bytes",
+                    lambda: _store.memory_report()["max_bytes"]
+                )
+    return _store
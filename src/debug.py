@@ -0,0 +1,151 @@
+"""
+Debug capture for ESMA Chat
+Bounded record of raw stream lines, rendered once after the answer finishes
+"""
+
+import os
+import random
+import threading
+from collections import deque
+from typing import Deque, List
+
+# First raw lines of a response, always kept when capturing
+DEBUG_HEAD_LINES = int(os.getenv("ESMA_DEBUG_HEAD_LINES", "20"))
+# Ring buffer of the most recent raw lines after the head
+DEBUG_TAIL_LINES = int(os.getenv("ESMA_DEBUG_TAIL_LINES", "200"))
+# Keep one in N lines in the ring buffer
+DEBUG_SAMPLE_EVERY = int(os.getenv("ESMA_DEBUG_SAMPLE_EVERY", "1"))
+# Fraction of requests captured while debug mode is on
+DEBUG_SAMPLE_RATE = float(os.getenv("ESMA_DEBUG_SAMPLE_RATE", "1.0"))
+# Characters kept per captured line
+DEBUG_LINE_CHARS = int(os.getenv("ESMA_DEBUG_LINE_CHARS", "300"))
+# Decoded chunks shown as examples
+DEBUG_CHUNK_SAMPLES = 10
+
+
+class NullCapture:
+    """Capture used when debug mode is off; every method is a no-op"""
+
+    enabled = False
+
+    def feed(self, data: bytes):
+        pass
+
+    def chunks(self, chunks: List[str]):
+        pass
+
+    def close(self):
+        pass
+
+    def render(self, container, summary: str):
+        pass
+
+
+NULL_CAPTURE = NullCapture()
+
+
+class DebugCapture:
+    """
+    Raw lines of one response in fixed memory
+
+    Fed from the client event loop with each network read; nothing touches
+    Streamlit until render() is called after the stream has ended. Memory is
+    bounded by the head and ring buffer sizes times DEBUG_LINE_CHARS,
+    however long the answer is.
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        head_lines: int = DEBUG_HEAD_LINES,
+        tail_lines: int = DEBUG_TAIL_LINES,
+        sample_every: int = DEBUG_SAMPLE_EVERY,
+        line_chars: int = DEBUG_LINE_CHARS
+    ):
+        self.head_lines = head_lines
+        self.sample_every = max(sample_every, 1)
+        self.line_chars = line_chars
+
+        self.head: List[str] = []
+        self.tail: Deque[str] = deque(maxlen=tail_lines)
+        self.samples: List[str] = []
+        self.lines = 0
+        self.bytes = 0
+        self._partial = b""
+        self._lock = threading.Lock()
+
+    def feed(self, data: bytes):
+        """Record a network read, split into lines"""
+        *complete, rest = data.split(b"\n")
+        with self._lock:
+            self.bytes += len(data)
+            if complete:
+                complete[0] = self._partial + complete[0]
+                for raw in complete:
+                    self._line(raw)
+                self._partial = rest[:self.line_chars]
+            elif len(self._partial) < self.line_chars:
+                self._partial += rest[:self.line_chars - len(self._partial)]
+
+    def chunks(self, chunks: List[str]):
+        """Keep the first decoded chunks as examples"""
+        if len(self.samples) < DEBUG_CHUNK_SAMPLES:
+            with self._lock:
+                for chunk in chunks[:DEBUG_CHUNK_SAMPLES - len(self.samples)]:
+                    if isinstance(chunk, str):
+                        self.samples.append(repr(chunk)[:100])
+                    else:
+                        self.samples.append(f"<table {chunk.num_rows}x{chunk.num_columns}>")
+
+    def close(self):
+        with self._lock:
+            if self._partial:
+                self._line(self._partial)
+                self._partial = b""
+
+    def _line(self, raw: bytes):
+        self.lines += 1
+        if self.lines <= self.head_lines:
+            self.head.append(self._text(raw))
+        elif self.lines % self.sample_every == 0:
+            self.tail.append(self._text(raw))
+
+    def _text(self, raw: bytes) -> str:
+        return raw[:self.line_chars].rstrip(b"\r").decode("utf-8", errors="replace")
+
+    def render(self, container, summary: str):
+        """
+        Write the capture to a Streamlit container in one pass
+
+        Args:
+            container: Where to write, e.g. st.sidebar
+            summary: One-line description of the stream (format, chunks, ...)
+        """
+        with self._lock:
+            head, tail, samples = list(self.head), list(self.tail), list(self.samples)
+            lines, size = self.lines, self.bytes
+
+        container.info(f"{summary}, Lines: {lines}, Bytes: {size}")
+        for i, sample in enumerate(samples, start=1):
+            container.text(f"Chunk {i}: {sample}")
+        if head:
+            container.code("\n".join(head), language=None)
+        if tail:
+            skipped = lines - len(head) - len(tail)
+            if skipped > 0:
+                container.caption(f"… {skipped} lines not kept …")
+            container.code("\n".join(tail), language=None)
+
+
+def start_capture(debug_mode: bool):
+    """
+    Capture for one request
+
+    Returns:
+        A DebugCapture, or NULL_CAPTURE when debug mode is off or the request
+        is not sampled
+    """
+    if not debug_mode or random.random() >= DEBUG_SAMPLE_RATE:
+        return NULL_CAPTURE
+    return DebugCapture()
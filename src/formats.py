@@ -0,0 +1,283 @@
+"""
+Wire format detection for ESMA Chat
+Chooses an SSE, NDJSON or plain-text decoder once per stream
+"""
+
+import codecs
+import json
+from typing import List, Optional, Set
+
+from src.metrics import registry
+from src.sse import SSEDecoder, decode_content
+from src.tables import TABLE_EVENT, Chunk, TableDecodeError, decode_table, table_from_json
+
+SSE = "sse"
+NDJSON = "ndjson"
+TEXT = "text"
+
+# Keys that may carry the answer text in NDJSON objects, in order of preference
+CONTENT_KEYS = ("content", "text", "message", "response")
+
+# Bytes inspected before giving up on finding a complete first line
+SNIFF_LIMIT = 1024
+
+_SSE_FIELDS = ("data:", "event:", "id:", "retry:", ":")
+_SSE_LINES = ("data", "event", "id", "retry")
+
+
+def detect_format(prefix: bytes, content_type: Optional[str] = None) -> Optional[str]:
+    """
+    Detect the wire format of a stream from its first bytes
+
+    Args:
+        prefix: First bytes of the response body
+        content_type: Content-Type header, used when it is unambiguous
+
+    Returns:
+        SSE, NDJSON or TEXT, or None if more bytes are needed
+    """
+    if content_type:
+        media_type = content_type.split(";", 1)[0].strip().lower()
+        if media_type == "text/event-stream":
+            return SSE
+        if media_type in ("application/x-ndjson", "application/jsonl", "application/json-seq"):
+            return NDJSON
+
+    text = prefix.decode("utf-8", errors="replace").lstrip("\ufeff\r\n")
+    newline = min((i for i in (text.find("\n"), text.find("\r")) if i != -1), default=-1)
+    if newline == -1 and len(prefix) < SNIFF_LIMIT:
+        return None
+
+    first_line = text if newline == -1 else text[:newline]
+    if first_line.startswith(_SSE_FIELDS) or first_line in _SSE_LINES:
+        return SSE
+    if first_line.lstrip().startswith("{"):
+        return NDJSON
+    return TEXT
+
+
+class SSEStreamDecoder:
+    """
+    Answer chunks from SSE `data:` payloads
+
+    Events of type TABLE_EVENT are decoded in one go into an Arrow table,
+    which is returned among the text chunks.
+
+    Tracks event IDs so an interrupted stream can be resumed on a new
+    connection with `Last-Event-ID`. After a resume, events whose ID was
+    already delivered on an earlier connection are dropped, which also
+    covers servers that replay the answer from the start. Such a server
+    is flagged through `restarted`, since resuming it again would rerun the
+    whole answer once more.
+    """
+
+    format = SSE
+
+    def __init__(self):
+        self.events = SSEDecoder()
+        self.parse_failures = 0
+        self.last_event_id = ""
+        # The server answered a resume from an ID that was already delivered
+        self.restarted = False
+        self._delivered_ids: Set[str] = set()
+        self._current_ids: Set[str] = set()
+        self._resumed = False
+
+    @property
+    def retry(self) -> Optional[int]:
+        """Reconnection delay in milliseconds requested by the server, if any"""
+        return self.events.retry
+
+    def feed(self, chunk: bytes) -> List[Chunk]:
+        return self._decode(self.events.feed(chunk))
+
+    def close(self) -> List[Chunk]:
+        return self._decode(self.events.close())
+
+    def resume(self):
+        """Discard the interrupted connection's partial event and expect a new stream"""
+        retry = self.events.retry
+        self.events = SSEDecoder()
+        self.events.retry = retry
+        self._delivered_ids |= self._current_ids
+        self._current_ids = set()
+        self._resumed = True
+
+    def _decode(self, events) -> List[Chunk]:
+        chunks = []
+        for event in events:
+            if event.id:
+                if self._resumed:
+                    # The first ID after a resume tells whether Last-Event-ID was honored
+                    self._resumed = False
+                    self.restarted = self.restarted or event.id in self._delivered_ids
+                if event.id in self._delivered_ids:
+                    continue
+                self._current_ids.add(event.id)
+                self.last_event_id = event.id
+            if event.event == TABLE_EVENT:
+                try:
+                    chunks.append(decode_table(event.data))
+                except TableDecodeError:
+                    self.parse_failures += 1
+                continue
+            if not event.data or event.data == "[DONE]":
+                continue
+            content = decode_content(event.data)
+            if content:
+                chunks.append(content)
+            elif content is None and not event.data.lstrip().startswith("{"):
+                # Objects without content are control events; anything else is garbage
+                self.parse_failures += 1
+        return chunks
+
+
+class NDJSONStreamDecoder:
+    """
+    Answer chunks from newline-delimited JSON objects
+
+    The key carrying the text is picked from CONTENT_KEYS on the first object
+    that has one and reused for the rest of the stream. Objects with
+    `"type": "table"` are decoded into Arrow tables.
+    """
+
+    format = NDJSON
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+        self.content_key: Optional[str] = None
+        self.parse_failures = 0
+
+    def feed(self, chunk: bytes) -> List[Chunk]:
+        text = self._pending + self._decoder.decode(chunk)
+        *lines, self._pending = text.split("\n")
+        return self._decode(lines)
+
+    def close(self) -> List[Chunk]:
+        lines = [self._pending + self._decoder.decode(b"", final=True)]
+        self._pending = ""
+        return self._decode(lines)
+
+    def _decode(self, lines: List[str]) -> List[Chunk]:
+        chunks = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                self.parse_failures += 1
+                continue
+            if not isinstance(data, dict):
+                continue
+            if data.get("type") == TABLE_EVENT:
+                try:
+                    chunks.append(table_from_json(data))
+                except TableDecodeError:
+                    self.parse_failures += 1
+                continue
+
+            if self.content_key is None:
+                self.content_key = next((key for key in CONTENT_KEYS if key in data), None)
+                if self.content_key is None:
+                    continue
+            content = data.get(self.content_key)
+            if content:
+                chunks.append(str(content))
+        return chunks
+
+
+class TextStreamDecoder:
+    """Answer chunks from a plain-text body, passed through as decoded"""
+
+    format = TEXT
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.parse_failures = 0
+
+    def feed(self, chunk: bytes) -> List[str]:
+        text = self._decoder.decode(chunk)
+        return [text] if text else []
+
+    def close(self) -> List[str]:
+        text = self._decoder.decode(b"", final=True)
+        return [text] if text else []
+
+
+_DECODERS = {
+    SSE: SSEStreamDecoder,
+    NDJSON: NDJSONStreamDecoder,
+    TEXT: TextStreamDecoder,
+}
+
+
+class StreamDecoder:
+    """
+    Detects the wire format from the first bytes and delegates to its decoder
+
+    Bytes are held back only until the first line is complete (or
+    SNIFF_LIMIT bytes arrived); after that each chunk goes straight to the
+    chosen decoder with no per-line format checks.
+    """
+
+    def __init__(self, content_type: Optional[str] = None):
+        self.content_type = content_type
+        self.format: Optional[str] = None
+        self.decoder = None
+        self._prefix = b""
+
+    @property
+    def parse_failures(self) -> int:
+        return self.decoder.parse_failures if self.decoder is not None else 0
+
+    @property
+    def last_event_id(self) -> str:
+        """ID to resume from; empty unless the stream is SSE and the server sends IDs"""
+        return self.decoder.last_event_id if self.format == SSE else ""
+
+    @property
+    def retry(self) -> Optional[int]:
+        return self.decoder.retry if self.format == SSE else None
+
+    @property
+    def restarted(self) -> bool:
+        """Whether the server restarted the answer instead of resuming it (see SSEStreamDecoder)"""
+        return self.decoder.restarted if self.format == SSE else False
+
+    def resume(self):
+        """Prepare for the continuation of an interrupted SSE stream on a new connection"""
+        self.decoder.resume()
+
+    def feed(self, chunk: bytes) -> List[Chunk]:
+        if self.decoder is not None:
+            return self.decoder.feed(chunk)
+
+        self._prefix += chunk
+        detected = detect_format(self._prefix, self.content_type)
+        if detected is None:
+            return []
+        return self._start(detected)
+
+    def close(self) -> List[Chunk]:
+        if self.decoder is None:
+            if not self._prefix:
+                return []
+            chunks = self._start(detect_format(self._prefix + b"\n", self.content_type))
+            return chunks + self.decoder.close()
+        return self.decoder.close()
+
+    def _start(self, detected: str) -> List[Chunk]:
+        self.format = detected
+        self.decoder = _DECODERS[detected]()
+        prefix, self._prefix = self._prefix, b""
+        return self.decoder.feed(prefix)
+
+
+def record_detection(base_url: str, detected: Optional[str]):
+    """Count the format a backend deployment answered with (esma_stream_formats_total)."""
+    if detected is None:
+        return
+    registry.increment("esma_stream_formats_total", base_url, detected)
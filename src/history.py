@@ -0,0 +1,62 @@
+"""
+Chat history rendering for ESMA Chat
+Shows the most recent messages and loads older ones a page at a time
+"""
+
+import os
+import streamlit as st
+
+from src.conversations import SESSION_WINDOW, Conversation
+from src.tables import render_answer
+
+# Messages rendered on every run; older ones are loaded on demand in pages of this size.
+# Defaults to the in-memory window so a normal run never reads SQLite
+HISTORY_WINDOW = int(os.getenv("ESMA_HISTORY_WINDOW", str(SESSION_WINDOW)))
+
+_SHOWN_KEY = "history_shown"
+
+
+def render_message(message: dict):
+    with st.chat_message(message["role"]):
+        if "tables" in message:
+            render_answer(st, message["content"], message["tables"])
+        else:
+            st.markdown(message["content"])
+
+
+def reset_history():
+    """Collapse the transcript back to the latest window, e.g. for a new conversation."""
+    st.session_state.pop(_SHOWN_KEY, None)
+
+
+def _show_more(window: int):
+    st.session_state[_SHOWN_KEY] = st.session_state.get(_SHOWN_KEY, window) + window
+
+
+@st.fragment
+def render_history(conversation: Conversation, window: int = HISTORY_WINDOW):
+    """
+    Render the transcript, newest `window` messages first-class and older ones paged
+
+    Every full run (including the one triggered by a new question) renders
+    at most the visible window, so the cost of a turn no longer grows with
+    the length of the conversation. Loading older messages reruns only this
+    fragment and reads them from the conversation store.
+
+    Args:
+        conversation: The session's conversation
+        window: Messages shown initially and added per "show more" click
+    """
+    shown = max(st.session_state.get(_SHOWN_KEY, window), window)
+    hidden = len(conversation) - shown
+
+    if hidden > 0:
+        st.button(
+            f"⬆️ Mostrar mensajes anteriores ({hidden} ocultos)",
+            on_click=_show_more,
+            args=(window,),
+            use_container_width=True
+        )
+
+    for message in conversation.messages(max(hidden, 0)):
+        render_message(message)
@@ -0,0 +1,380 @@
+"""
+Request metrics for ESMA Chat
+Per-request timings aggregated into process-wide histograms and exported
+in the Prometheus text format
+"""
+
+import os
+import threading
+import time
+import httpx
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Serve /metrics on this local port when set
+METRICS_PORT = os.getenv("ESMA_METRICS_PORT")
+# Rewrite this file (Prometheus textfile format) after requests finish when set
+METRICS_FILE = os.getenv("ESMA_METRICS_FILE")
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Redraws of a running answer take milliseconds, so render timings get finer low buckets
+RENDER_BUCKETS = (0.001, 0.0025, 0.005) + LATENCY_BUCKETS
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6)
+CHUNK_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000)
+
+
+@dataclass
+class RequestMetrics:
+    """Timings and counts for one /chat/stream request; times are seconds from `started`"""
+    backend: str
+    started: float = field(default_factory=time.monotonic)
+    connect: Optional[float] = None
+    reused_connection: bool = True
+    ttfb: Optional[float] = None
+    first_chunk: Optional[float] = None
+    total: Optional[float] = None
+    chunks: int = 0
+    bytes_received: int = 0
+    bytes_decoded: int = 0
+    content_encoding: Optional[str] = None
+    parse_failures: int = 0
+    resumes: int = 0
+    connect_retries: int = 0
+    error: Optional[str] = None
+    _connect_started: float = field(default=0.0, repr=False)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    async def trace(self, event_name: str, info: dict):
+        """httpx `trace` extension hook; only fires when a new connection is opened"""
+        if event_name == "connection.connect_tcp.started":
+            self.reused_connection = False
+            self._connect_started = self.elapsed()
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            self.connect = self.elapsed() - self._connect_started
+
+    def mark_ttfb(self):
+        if self.ttfb is None:
+            self.ttfb = self.elapsed()
+
+    def mark_chunks(self, count: int):
+        if count and self.first_chunk is None:
+            self.first_chunk = self.elapsed()
+        self.chunks += count
+
+    def finish(self, error: Optional[str] = None):
+        self.total = self.elapsed()
+        self.error = error
+
+
+def classify_error(exc: BaseException) -> str:
+    """Short error class used as a metric label"""
+    status_code = getattr(exc, "status_code", None)
+    if status_code is not None:
+        return f"http_{status_code}"
+    if isinstance(exc, httpx.TimeoutException):
+        # Stream phase deadlines (see src.timeouts) carry their phase
+        phase = getattr(exc, "phase", None)
+        if phase is None and isinstance(exc, httpx.ConnectTimeout):
+            phase = "connect"
+        return f"timeout_{phase}" if phase else "timeout"
+    if isinstance(exc, httpx.ConnectError):
+        return "connect"
+    if isinstance(exc, httpx.TransportError):
+        return "transport"
+    return "other"
+
+
+class Histogram:
+    """Fixed-bucket histogram with cumulative Prometheus semantics"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+_HISTOGRAMS = {
+    "esma_connect_seconds": ("Time to open a new backend connection (TCP + TLS)", LATENCY_BUCKETS),
+    "esma_ttfb_seconds": ("Time until response headers were received", LATENCY_BUCKETS),
+    "esma_first_chunk_seconds": ("Time until the first answer chunk was decoded", LATENCY_BUCKETS),
+    "esma_request_seconds": ("Total duration of a /chat/stream request", LATENCY_BUCKETS),
+    "esma_response_bytes": ("Bytes received per response, as sent on the wire", SIZE_BUCKETS),
+    "esma_response_decoded_bytes": ("Bytes per response after decompression", SIZE_BUCKETS),
+    "esma_response_chunks": ("Answer chunks per response", CHUNK_BUCKETS),
+    "esma_time_to_first_render_seconds": ("Question submitted until the first answer output was drawn", RENDER_BUCKETS),
+    "esma_render_lag_seconds": ("New answer output until it was drawn in the session", RENDER_BUCKETS),
+    "esma_warmup_dns_seconds": ("DNS resolution during backend warm-up", LATENCY_BUCKETS),
+    "esma_warmup_connect_seconds": ("Connection setup (TCP + TLS) during backend warm-up", LATENCY_BUCKETS),
+    "esma_warmup_request_seconds": ("Warm-up request duration, including backend cold starts", LATENCY_BUCKETS),
+}
+_COUNTERS = {
+    "esma_requests_total": "Requests by outcome",
+    "esma_connections_opened_total": "Requests that had to open a new connection",
+    "esma_parse_failures_total": "Payloads that could not be decoded",
+    "esma_stream_resumes_total": "Reconnections with Last-Event-ID after a dropped stream",
+    "esma_connect_retries_total": "Connection attempts retried after a connect failure",
+    "esma_response_encodings_total": "Responses by Content-Encoding",
+    "esma_stream_formats_total": "Answer streams by detected wire format: sse, ndjson, text",
+    "esma_cache_lookups_total": "Answer cache lookups by outcome",
+    "esma_warmups_total": "Backend warm-ups by outcome",
+    "esma_admission_total": "Stream slot requests: admitted, queued (admitted after waiting), rejected, timeout, cancelled",
+    "esma_single_flight_total": "Shareable requests that started an upstream stream (leader) or joined one (follower)",
+    "esma_recordings_total": "Answer stream captures by outcome: written, truncated, failed",
+}
+
+
+class MetricsRegistry:
+    """Process-wide aggregation of RequestMetrics across all sessions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._counters: Dict[Tuple[str, str, str], float] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def _histogram(self, name: str, backend: str) -> Histogram:
+        key = (name, backend)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(_HISTOGRAMS[name][1])
+        return histogram
+
+    def _increment(self, name: str, backend: str, outcome: str = "", amount: float = 1):
+        key = (name, backend, outcome)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge(self, name: str, description: str, read: Callable[[], float]):
+        """
+        Register a value read when metrics are exported, e.g. current memory use
+
+        `read` returns a number, or {backend: number} for one series per backend.
+        """
+        with self._lock:
+            self._gauges[name] = (description, read)
+
+    def increment(self, name: str, backend: str = "", outcome: str = "", amount: float = 1):
+        """Add to a counter outside of a request, e.g. cache lookups"""
+        with self._lock:
+            self._increment(name, backend, outcome, amount)
+
+    def observe(self, name: str, backend: str, value: float):
+        """Add a sample to a histogram outside of a request, e.g. warm-up timings"""
+        with self._lock:
+            self._histogram(name, backend).observe(value)
+
+    def record(self, metrics: RequestMetrics):
+        backend = metrics.backend
+        with self._lock:
+            self._increment("esma_requests_total", backend, metrics.error or "ok")
+            self._increment("esma_parse_failures_total", backend, amount=metrics.parse_failures)
+            self._increment("esma_stream_resumes_total", backend, amount=metrics.resumes)
+            self._increment("esma_connect_retries_total", backend, amount=metrics.connect_retries)
+            if metrics.content_encoding is not None:
+                self._increment("esma_response_encodings_total", backend, metrics.content_encoding)
+            if not metrics.reused_connection:
+                self._increment("esma_connections_opened_total", backend)
+                if metrics.connect is not None:
+                    self._histogram("esma_connect_seconds", backend).observe(metrics.connect)
+            if metrics.ttfb is not None:
+                self._histogram("esma_ttfb_seconds", backend).observe(metrics.ttfb)
+            if metrics.first_chunk is not None:
+                self._histogram("esma_first_chunk_seconds", backend).observe(metrics.first_chunk)
+            if metrics.total is not None:
+                self._histogram("esma_request_seconds", backend).observe(metrics.total)
+            if metrics.error is None:
+                self._histogram("esma_response_bytes", backend).observe(metrics.bytes_received)
+                self._histogram("esma_response_decoded_bytes", backend).observe(metrics.bytes_decoded)
+                self._histogram("esma_response_chunks", backend).observe(metrics.chunks)
+
+        if METRICS_FILE:
+            _schedule_file_write(METRICS_FILE)
+
+    def snapshot(self) -> dict:
+        """
+        Summary for programmatic use
+
+        Returns:
+            {"histograms": {name: {backend: {count, sum, p50, p95, p99}}},
+             "counters": {name: {backend: {outcome: value}}},
+             "gauges": {name: value or {backend: value}}}
+        """
+        with self._lock:
+            histograms: dict = {}
+            for (name, backend), histogram in self._histograms.items():
+                histograms.setdefault(name, {})[backend] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.50),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+            counters: dict = {}
+            for (name, backend, outcome), value in self._counters.items():
+                counters.setdefault(name, {}).setdefault(backend, {})[outcome or "all"] = value
+            gauges = list(self._gauges.items())
+        return {
+            "histograms": histograms,
+            "counters": counters,
+            "gauges": {name: read() for name, (_, read) in gauges},
+        }
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            for name, description in _COUNTERS.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} counter")
+                for (counter, backend, outcome), value in sorted(self._counters.items()):
+                    if counter != name:
+                        continue
+                    labels = ",".join(
+                        f'{label}="{text}"' for label, text in (("backend", backend), ("outcome", outcome)) if text
+                    )
+                    lines.append(f"{name}{{{labels}}} {value:g}")
+
+            gauges = list(self._gauges.items())
+
+            for name, (description, buckets) in _HISTOGRAMS.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for (histogram_name, backend), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f'{name}_bucket{{backend="{backend}",le="{le}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{backend="{backend}"}} {histogram.sum:g}')
+                    lines.append(f'{name}_count{{backend="{backend}"}} {histogram.count}')
+        # Read outside the lock: the callbacks may take other locks
+        for name, (description, read) in gauges:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            value = read()
+            if isinstance(value, dict):
+                for backend, item in sorted(value.items()):
+                    lines.append(f'{name}{{backend="{backend}"}} {item:g}')
+            else:
+                lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def write_metrics_file(path: str):
+    """Atomically replace `path` with the current metrics."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render_prometheus())
+    os.replace(tmp_path, path)
+
+
+# Set when the metrics file is out of date; the writer thread clears it and rewrites the file
+_file_stale = threading.Event()
+_file_writer: Optional[threading.Thread] = None
+_file_writer_lock = threading.Lock()
+
+
+def _schedule_file_write(path: str):
+    """
+    Have the writer thread rewrite `path`, starting it on first use
+
+    record() runs on the client event loop, so it never writes itself: the
+    file I/O and the gauge callbacks (some take other locks) run on the
+    writer thread. Requests finishing while a write is in progress are
+    folded into a single further write.
+    """
+    global _file_writer
+    _file_stale.set()
+    if _file_writer is None:
+        with _file_writer_lock:
+            if _file_writer is None:
+                _file_writer = threading.Thread(
+                    target=_file_writer_loop, args=(path,), name="esma-metrics-file", daemon=True
+                )
+                _file_writer.start()
+
+
+def _file_writer_loop(path: str):
+    while True:
+        _file_stale.wait()
+        _file_stale.clear()
+        try:
+            write_metrics_file(path)
+        except OSError:
+            # Retried after the next request
+            pass
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporter: Optional[ThreadingHTTPServer] = None
+_exporter_lock = threading.Lock()
+
+
+def start_exporter(port: Optional[int] = None, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics from a daemon thread; safe to call on every Streamlit rerun
+
+    Args:
+        port: Port to bind; defaults to ESMA_METRICS_PORT, and nothing is started without one
+
+    Returns:
+        The running server, or None when disabled or the port is taken
+    """
+    global _exporter
+    if port is None:
+        if not METRICS_PORT:
+            return None
+        port = int(METRICS_PORT)
+
+    with _exporter_lock:
+        if _exporter is None:
+            try:
+                _exporter = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError:
+                return None
+            _exporter.daemon_threads = True
+            threading.Thread(target=_exporter.serve_forever, name="esma-metrics", daemon=True).start()
+    return _exporter
@@ -0,0 +1,289 @@
+"""
+Stream recording for ESMA Chat
+Opt-in capture of answer stream bytes with their timing, for replay against the client
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+import httpx
+
+from src.metrics import registry
+from src.tables import table_marker
+
+# Directory for capture files (unset disables recording)
+RECORD_DIR = os.getenv("ESMA_RECORD_DIR")
+# Fraction of answer requests recorded
+RECORD_SAMPLE_RATE = float(os.getenv("ESMA_RECORD_SAMPLE_RATE", "1.0"))
+# Body bytes kept per request; later bytes are dropped and the capture marked truncated
+RECORD_MAX_BYTES = int(os.getenv("ESMA_RECORD_MAX_BYTES", str(16 * 1024 * 1024)))
+# Captures written by one process before recording stops
+RECORD_MAX_FILES = int(os.getenv("ESMA_RECORD_MAX_FILES", "1000"))
+
+CAPTURE_SUFFIX = ".esmacap"
+MAGIC = b"ESMACAP1\n"
+
+# Frame header: kind, microseconds since the previous frame, payload length
+_FRAME = struct.Struct("<cII")
+_META = b"m"      # JSON: capture id, backend, path, wall-clock start
+_HEADERS = b"h"   # JSON: status, content type and encoding of one response
+_DATA = b"d"      # body bytes of one network read
+_END = b"e"       # JSON: outcome, chunks, tables and hash of the decoded answer text
+
+_MAX_DELAY_US = 2 ** 32 - 1
+
+# One background thread writes every capture, in order, off the client loop
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="esma-recorder")
+_files_lock = threading.Lock()
+_files_started = 0
+
+
+class NullRecording:
+    """Recording used when recording is off; every method is a no-op"""
+
+    enabled = False
+
+    def response(self, response: httpx.Response):
+        pass
+
+    def data(self, data: bytes):
+        pass
+
+    def chunks(self, chunks: list):
+        pass
+
+    def finish(self, error: Optional[str]):
+        pass
+
+
+NULL_RECORDING = NullRecording()
+
+
+class Recording:
+    """
+    Bytes and timing of one upstream answer request, written as one capture file
+
+    Fed from the client event loop like DebugCapture, with the body of
+    every response the request got (resumes included), as the decoder
+    saw it: after transport decompression. Frames are kept in memory, up to
+    RECORD_MAX_BYTES of body, and written by a background thread once the
+    request ends, to a temporary name that is renamed when complete.
+
+    File layout, gzip-compressed: MAGIC, then frames of _FRAME followed by
+    their payload. Each frame carries the microseconds since the one
+    before it, so the first response frame holds the time to headers and
+    each data frame the gap since the previous read.
+    """
+
+    enabled = True
+
+    def __init__(self, directory: str, backend: str, path: str = "/chat/stream", max_bytes: int = RECORD_MAX_BYTES):
+        self.directory = directory
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.bytes = 0
+        self.truncated = False
+        self._chunks = 0
+        self._tables = 0
+        self._text = hashlib.sha256()
+        self._buffer = bytearray(MAGIC)
+        self._last = time.monotonic()
+        self._frame(_META, json.dumps({
+            "id": self.id, "backend": backend, "path": path, "started": time.time()
+        }).encode("utf-8"))
+
+    def _frame(self, kind: bytes, payload: bytes):
+        now = time.monotonic()
+        delay = min(int((now - self._last) * 1_000_000), _MAX_DELAY_US)
+        self._last = now
+        self._buffer += _FRAME.pack(kind, delay, len(payload))
+        self._buffer += payload
+
+    def response(self, response: httpx.Response):
+        """Record the status and headers of a response (one per connection attempt that got one)"""
+        self._frame(_HEADERS, json.dumps({
+            "status": response.status_code,
+            "content_type": response.headers.get("content-type"),
+            "content_encoding": response.headers.get("content-encoding", "identity"),
+        }).encode("utf-8"))
+
+    def data(self, data: bytes):
+        """Record a network read of the body"""
+        if self.truncated or not data:
+            return
+        if self.bytes + len(data) > self.max_bytes:
+            self.truncated = True
+            return
+        self.bytes += len(data)
+        self._frame(_DATA, data)
+
+    def chunks(self, chunks: list):
+        """Hash the decoded answer the way StreamRenderer.text spells it, so replays can be checked"""
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                self._text.update(chunk.encode("utf-8"))
+            else:
+                self._text.update(table_marker(self._tables).encode("utf-8"))
+                self._tables += 1
+            self._chunks += 1
+
+    def finish(self, error: Optional[str]):
+        """
+        Close the capture and write it in the background
+
+        Args:
+            error: Metric label of how the request ended (see classify_error), None on success
+        """
+        self._frame(_END, json.dumps({
+            "error": error,
+            "chunks": self._chunks,
+            "tables": self._tables,
+            "text_sha256": self._text.hexdigest(),
+            "truncated": self.truncated,
+        }).encode("utf-8"))
+        data, self._buffer = bytes(self._buffer), bytearray()
+        _writer.submit(self._write, data)
+
+    def _write(self, data: bytes):
+        path = os.path.join(self.directory, self.id + CAPTURE_SUFFIX)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with gzip.open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            registry.increment("esma_recordings_total", self.backend, "failed")
+            return
+        registry.increment("esma_recordings_total", self.backend, "truncated" if self.truncated else "written")
+
+
+def start_recording(backend: str):
+    """
+    Recording for one upstream answer request
+
+    Returns:
+        A Recording, or NULL_RECORDING when ESMA_RECORD_DIR is unset, the
+        request is not sampled or RECORD_MAX_FILES captures were started
+    """
+    global _files_started
+    if not RECORD_DIR or random.random() >= RECORD_SAMPLE_RATE:
+        return NULL_RECORDING
+    with _files_lock:
+        if _files_started >= RECORD_MAX_FILES:
+            return NULL_RECORDING
+        _files_started += 1
+    return Recording(RECORD_DIR, backend)
+
+
+def wait_for_writes():
+    """Block until every recording finished so far is on disk"""
+    _writer.submit(lambda: None).result()
+
+
+@dataclass
+class Segment:
+    """One response of a recorded request: the first, or a resume after a drop"""
+    status: int
+    content_type: Optional[str]
+    content_encoding: str
+    headers_delay: float                 # seconds from the previous frame to the headers
+    reads: List[Tuple[float, bytes]] = field(default_factory=list)  # (seconds since previous frame, body bytes)
+
+    @property
+    def duration(self) -> float:
+        return self.headers_delay + sum(delay for delay, _ in self.reads)
+
+
+@dataclass
+class Capture:
+    """A capture file read back"""
+    path: str
+    id: str
+    backend: str
+    started: float
+    segments: List[Segment]
+    error: Optional[str] = None
+    chunks: int = 0
+    tables: int = 0
+    text_sha256: Optional[str] = None
+    truncated: bool = False
+    complete: bool = False    # the end frame was present
+
+    @property
+    def bytes(self) -> int:
+        return sum(len(data) for segment in self.segments for _, data in segment.reads)
+
+    @property
+    def duration(self) -> float:
+        """Seconds from the first response's headers being awaited to the last read"""
+        return sum(segment.duration for segment in self.segments)
+
+
+def read_capture(path: str) -> Capture:
+    """
+    Read a capture file written by Recording
+
+    Raises:
+        ValueError: The file is not a capture
+    """
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a stream capture")
+
+    capture = Capture(path=path, id="", backend="", started=0.0, segments=[])
+    offset = len(MAGIC)
+    while offset + _FRAME.size <= len(data):
+        kind, delay_us, length = _FRAME.unpack_from(data, offset)
+        offset += _FRAME.size
+        payload = data[offset:offset + length]
+        offset += length
+        delay = delay_us / 1_000_000
+        if kind == _META:
+            meta = json.loads(payload)
+            capture.id, capture.backend, capture.started = meta["id"], meta["backend"], meta["started"]
+        elif kind == _HEADERS:
+            headers = json.loads(payload)
+            capture.segments.append(Segment(
+                headers["status"], headers["content_type"], headers["content_encoding"], delay
+            ))
+        elif kind == _DATA and capture.segments:
+            capture.segments[-1].reads.append((delay, payload))
+        elif kind == _END:
+            end = json.loads(payload)
+            capture.error = end["error"]
+            capture.chunks = end["chunks"]
+            capture.tables = end["tables"]
+            capture.text_sha256 = end["text_sha256"]
+            capture.truncated = end["truncated"]
+            capture.complete = True
+    return capture
+
+
+def capture_paths(*locations: str) -> List[str]:
+    """Capture files among `locations`, which may be files or directories, sorted by name"""
+    paths = []
+    for location in locations:
+        if os.path.isdir(location):
+            paths.extend(
+                os.path.join(location, name) for name in os.listdir(location) if name.endswith(CAPTURE_SUFFIX)
+            )
+        else:
+            paths.append(location)
+    return sorted(paths)
+
+
+def iter_captures(*locations: str) -> Iterator[Capture]:
+    for path in capture_paths(*locations):
+        yield read_capture(path)
@@ -0,0 +1,133 @@
+"""
+Incremental rendering of streamed answers
+Buffers chunks and flushes them to a Streamlit placeholder at a bounded rate
+"""
+
+import os
+import time
+from typing import Callable, List
+
+from src.tables import table_marker
+
+# Minimum seconds between two renders of the same answer
+RENDER_INTERVAL = float(os.getenv("ESMA_RENDER_INTERVAL", "0.08"))
+# Pending characters that force a render before the interval elapses (0 disables)
+RENDER_MIN_CHARS = int(os.getenv("ESMA_RENDER_MIN_CHARS", "0"))
+
+CURSOR = "▌"
+
+
+class StreamRenderer:
+    """
+    Accumulates streamed chunks and re-renders the placeholder at most once per interval
+
+    Every placeholder.markdown call re-parses the whole answer and sends a
+    delta to the browser, so rendering on every chunk makes long answers
+    quadratic. Chunks are kept in a list and joined only when a frame is
+    actually drawn, which bounds the number of renders by elapsed time
+    rather than by the number of chunks the agent sends.
+
+    Tables are drawn once with `dataframe` in a container that replaces the
+    placeholder; text that follows them streams into a new slot below, so
+    later redraws never resend a table.
+    """
+
+    def __init__(
+        self,
+        placeholder,
+        interval: float = RENDER_INTERVAL,
+        min_chars: int = RENDER_MIN_CHARS,
+        cursor: str = CURSOR,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            placeholder: Streamlit placeholder (anything with a `markdown` method, and
+                `container` if the answer has tables)
+            interval: Minimum seconds between renders; 0 renders every chunk
+            min_chars: Pending characters that trigger a render regardless of interval
+            cursor: Suffix shown while the answer is still streaming
+            clock: Monotonic time source, overridable for benchmarks
+        """
+        self.placeholder = placeholder
+        self.interval = interval
+        self.min_chars = min_chars
+        self.cursor = cursor
+        self._clock = clock
+
+        self._parts: List[str] = []
+        # Text and table markers before the segment being streamed
+        self._done: List[str] = []
+        self._box = None
+        self.tables: list = []
+        self._length = 0
+        self._pending = 0
+        self._last_flush = float("-inf")
+        self.render_count = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def text(self) -> str:
+        """Everything received so far, with a marker in place of each table."""
+        return "".join(self._done) + self._segment()
+
+    def _segment(self) -> str:
+        """Text received since the last table"""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def append(self, chunk: str):
+        """Add a chunk and render if the frame budget allows it."""
+        if not chunk:
+            return
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        self._pending += len(chunk)
+
+        if self._clock() - self._last_flush >= self.interval:
+            self.flush()
+        elif self.min_chars and self._pending >= self.min_chars:
+            self.flush()
+
+    def add_table(self, table):
+        """Close the current text segment and draw `table` below it, once."""
+        segment = self._segment()
+        if self._box is None:
+            self._box = self.placeholder.container()
+            if segment:
+                self._box.markdown(segment)
+        elif segment:
+            self._draw(segment)
+        self._box.dataframe(table)
+        self.render_count += 1
+
+        self.placeholder = self._box.empty()
+        self._done.append(segment + table_marker(len(self.tables)))
+        self.tables.append(table)
+        self._parts = []
+        self._pending = 0
+
+    def flush(self):
+        """Render the current text with the streaming cursor."""
+        self._draw(self._segment() + self.cursor)
+
+    def finish(self) -> str:
+        """
+        Render the final text without cursor
+
+        Returns:
+            The complete answer, with a marker in place of each table
+        """
+        segment = self._segment()
+        if segment:
+            self._draw(segment)
+        return self.text
+
+    def _draw(self, body: str):
+        self.placeholder.markdown(body)
+        self.render_count += 1
+        self._pending = 0
+        self._last_flush = self._clock()
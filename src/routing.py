@@ -0,0 +1,244 @@
+"""
+Backend routing for ESMA Chat
+Routes conversations across several agent backends by health, latency and error rate
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence
+
+from src.connection import get_client_manager
+from src.metrics import RequestMetrics, classify_error, registry
+
+# Path requested with GET to check a backend, e.g. "/health"; without one a HEAD / is sent
+HEALTH_PATH = os.getenv("ESMA_HEALTH_PATH", "")
+# Seconds between two health checks of every backend (0 disables them)
+HEALTH_INTERVAL = float(os.getenv("ESMA_HEALTH_INTERVAL", "15"))
+HEALTH_TIMEOUT = float(os.getenv("ESMA_HEALTH_TIMEOUT", "5"))
+# Weight of the newest sample in the latency and error rate averages
+EWMA_ALPHA = float(os.getenv("ESMA_ROUTING_ALPHA", "0.3"))
+# Failed checks or requests in a row before a backend stops getting conversations
+UNHEALTHY_AFTER = int(os.getenv("ESMA_UNHEALTHY_AFTER", "2"))
+# How much the error rate inflates a backend's latency when ranking: latency * (1 + PENALTY * rate)
+ERROR_PENALTY = float(os.getenv("ESMA_ROUTING_ERROR_PENALTY", "5"))
+# Conversations whose backend is remembered (least recently used are forgotten)
+MAX_PINNED_THREADS = int(os.getenv("ESMA_ROUTING_MAX_THREADS", "10000"))
+
+# Request outcomes that say something about the backend; cancelled or empty answers do not
+_FAULTS = ("connect", "timeout", "transport", "http_5", "interrupted")
+# Faults that mean the backend is not there at all, so one is enough to stop routing to it
+_DOWN = ("connect", "timeout_connect")
+
+
+def backend_urls(default: str) -> List[str]:
+    """Backends from ESMA_BASE_URLS (comma-separated), or just `default`"""
+    urls = [url.strip().rstrip("/") for url in os.getenv("ESMA_BASE_URLS", "").split(",")]
+    return list(dict.fromkeys(url for url in urls if url)) or [default]
+
+
+@dataclass
+class BackendState:
+    """What the router knows about one backend"""
+    url: str
+    healthy: bool = True
+    latency: Optional[float] = None  # EWMA seconds to response headers
+    error_rate: float = 0.0          # EWMA of failed checks and requests
+    failures: int = 0                # in a row
+    last_error: Optional[str] = None
+    checked: Optional[float] = None  # wall time of the last health check
+
+
+class Router:
+    """
+    Picks a backend per conversation and keeps the conversation there
+
+    The agent keeps conversation memory per thread_id on the backend that
+    answered, so a thread stays on its backend for as long as that backend
+    is healthy. New threads go to the healthy backend with the lowest
+    error-weighted EWMA latency. When a thread's backend becomes unhealthy
+    its next question fails over to the best remaining one; the agent there
+    starts without the thread's earlier turns.
+
+    Latency and errors come from periodic health checks and from the
+    outcome of every answer request (see report).
+    """
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        health_path: str = HEALTH_PATH,
+        health_interval: float = HEALTH_INTERVAL,
+        health_timeout: float = HEALTH_TIMEOUT,
+        alpha: float = EWMA_ALPHA,
+        unhealthy_after: int = UNHEALTHY_AFTER,
+        error_penalty: float = ERROR_PENALTY,
+        max_threads: int = MAX_PINNED_THREADS
+    ):
+        if not urls:
+            raise ValueError("Router needs at least one backend")
+        self.urls = list(urls)
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.alpha = alpha
+        self.unhealthy_after = unhealthy_after
+        self.error_penalty = error_penalty
+        self.max_threads = max_threads
+        self._backends: Dict[str, BackendState] = {url: BackendState(url) for url in self.urls}
+        self._pins: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._checks = None
+
+    def route(self, thread_id: str) -> str:
+        """Backend for the next request of `thread_id`"""
+        with self._lock:
+            pinned = self._pins.get(thread_id)
+            if pinned is not None and self._backends[pinned].healthy:
+                self._pins.move_to_end(thread_id)
+                outcome, url = "sticky", pinned
+            else:
+                url = self._best()
+                if pinned is None:
+                    outcome = "new"
+                else:
+                    outcome = "failover" if url != pinned else "sticky"
+                    self._pins.move_to_end(thread_id)
+                self._pins[thread_id] = url
+                while len(self._pins) > self.max_threads:
+                    self._pins.popitem(last=False)
+        registry.increment("esma_routing_total", url, outcome)
+        return url
+
+    def _score(self, backend: BackendState) -> float:
+        # Unmeasured backends rank first so they get measured
+        return (backend.latency or 0.0) * (1 + self.error_penalty * backend.error_rate)
+
+    def _best(self) -> str:
+        healthy = [backend for backend in self._backends.values() if backend.healthy]
+        if healthy:
+            return min(healthy, key=self._score).url
+        # Nothing is healthy: the one failing least is the best bet
+        return min(self._backends.values(), key=lambda backend: (backend.failures, self._score(backend))).url
+
+    def observe(self, url: str, latency: Optional[float], error: Optional[str] = None):
+        """
+        Fold one health check or request outcome into the backend's state
+
+        Args:
+            url: Backend
+            latency: Seconds to response headers, if any arrived
+            error: Metric label of the failure (see classify_error), None on success
+        """
+        with self._lock:
+            backend = self._backends.get(url)
+            if backend is None:
+                return
+            if latency is not None:
+                backend.latency = latency if backend.latency is None else (
+                    self.alpha * latency + (1 - self.alpha) * backend.latency
+                )
+            backend.error_rate = self.alpha * (error is not None) + (1 - self.alpha) * backend.error_rate
+            if error is None:
+                backend.failures = 0
+                backend.healthy = True
+                return
+            backend.failures += 1
+            backend.last_error = error
+            if backend.failures >= self.unhealthy_after or error in _DOWN:
+                backend.healthy = False
+
+    def report(self, metrics: RequestMetrics):
+        """Learn from a finished answer request; outcomes that are not the backend's doing are ignored"""
+        error = metrics.error
+        if error is None:
+            self.observe(metrics.backend, metrics.ttfb)
+        elif error.startswith(_FAULTS):
+            self.observe(metrics.backend, None, error)
+
+    async def check(self, url: str):
+        """Health-check one backend: any answer below 500 within HEALTH_TIMEOUT counts as up"""
+        client = get_client_manager().client
+        start = time.monotonic()
+        error = None
+        try:
+            if self.health_path:
+                response = await client.get(f"{url}{self.health_path}", timeout=self.health_timeout)
+            else:
+                response = await client.head(url, timeout=self.health_timeout)
+            if response.status_code >= 500:
+                error = f"http_{response.status_code}"
+        except Exception as e:
+            error = classify_error(e)
+        self.observe(url, time.monotonic() - start if error is None else None, error)
+        with self._lock:
+            self._backends[url].checked = time.time()
+        registry.increment("esma_health_checks_total", url, error or "ok")
+
+    async def _check_forever(self):
+        while True:
+            await asyncio.gather(*(self.check(url) for url in self.urls))
+            await asyncio.sleep(self.health_interval)
+
+    def start_health_checks(self):
+        """Check every backend now and then every health_interval, on the client loop"""
+        with self._lock:
+            if self._checks is None and self.health_interval > 0:
+                self._checks = get_client_manager().submit(self._check_forever())
+
+    def stop_health_checks(self):
+        with self._lock:
+            if self._checks is not None:
+                self._checks.cancel()
+                self._checks = None
+
+    def snapshot(self) -> List[dict]:
+        """State of every backend, with the number of conversations routed to it"""
+        with self._lock:
+            threads: Dict[str, int] = {}
+            for url in self._pins.values():
+                threads[url] = threads.get(url, 0) + 1
+            return [dict(asdict(backend), threads=threads.get(backend.url, 0)) for backend in self._backends.values()]
+
+    def _gauge(self, field: str) -> Dict[str, float]:
+        with self._lock:
+            return {
+                url: float(value) for url, backend in self._backends.items()
+                if (value := getattr(backend, field)) is not None
+            }
+
+
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+
+
+def get_router(default_url: str) -> Router:
+    """
+    Return the process-wide Router over backend_urls(default_url)
+
+    Health checks only run when there is more than one backend to choose from.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                router = Router(backend_urls(default_url))
+                registry.gauge("esma_backend_healthy", "1 if the backend gets new conversations",
+                               lambda: router._gauge("healthy"))
+                registry.gauge("esma_backend_latency_seconds", "EWMA seconds to response headers",
+                               lambda: router._gauge("latency"))
+                registry.gauge("esma_backend_error_rate", "EWMA share of failed checks and requests",
+                               lambda: router._gauge("error_rate"))
+                if len(router.urls) > 1:
+                    router.start_health_checks()
+                _router = router
+    return _router
+
+
+def report_request(metrics: RequestMetrics):
+    """Feed a finished answer request to the router, if one was created"""
+    if _router is not None:
+        _router.report(metrics)
@@ -0,0 +1,228 @@
+"""
+Single-flight request sharing for ESMA Chat
+Identical opening questions in flight share one upstream stream, fanned out to every session
+"""
+
+import asyncio
+import os
+import threading
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.cache import question_key
+from src.connection import CANCEL_POLL_INTERVAL, IterationCancelled, get_client_manager
+from src.metrics import registry
+
+# Share identical opening questions in flight. Sessions that join a flight
+# send follow-ups on threads where the backend never saw the opening turn
+SINGLE_FLIGHT_ENABLED = os.getenv("ESMA_SINGLE_FLIGHT", "0").lower() in ("1", "true", "yes")
+
+
+class Flight:
+    """
+    One upstream answer stream and the sessions following it
+
+    Every request streams through a Flight; only shared ones have more than
+    one follower. Batches are kept until the stream ends, so a session that
+    joins late starts from the first chunk. The upstream belongs to the
+    flight rather than to the session that started it: it is cancelled when
+    the last follower leaves, not when the first one does.
+    """
+
+    def __init__(self, key: Optional[str] = None, on_close: Optional[Callable[["Flight"], None]] = None):
+        self.key = key
+        self.followers = 1
+        self.metrics = None
+        self._on_close = on_close
+        self._condition = threading.Condition()
+        self._batches: List[list] = []
+        self._done = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._future = None
+
+    def subscribe(self) -> bool:
+        """Add a follower; False once the flight has ended or was abandoned"""
+        with self._condition:
+            if self._closed:
+                return False
+            self.followers += 1
+            return True
+
+    def start(self, upstream: AsyncIterator[list], on_done: Callable[[Optional[BaseException]], None]):
+        """
+        Run `upstream` on the client loop and publish its batches
+
+        Args:
+            upstream: Async iterator of chunk batches, e.g. client._stream_chunks
+            on_done: Called on the client loop with the upstream's exception (None if it
+                completed) before followers see the end of the stream
+        """
+        self._future = get_client_manager().submit(self._pump(upstream, on_done))
+
+    def abort(self, error: BaseException):
+        """End the flight with `error` before any upstream was started, e.g. when admission failed"""
+        self._finish(error)
+
+    async def _pump(self, upstream: AsyncIterator[list], on_done):
+        error = None
+        try:
+            async for batch in upstream:
+                with self._condition:
+                    self._batches.append(batch)
+                    self._condition.notify_all()
+        except BaseException as e:
+            error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            try:
+                on_done(error)
+            finally:
+                self._finish(error)
+
+    def _finish(self, error: Optional[BaseException]):
+        with self._condition:
+            self._done = True
+            self._closed = True
+            self._error = error
+            self._condition.notify_all()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def follow(self, cancel: Optional[threading.Event] = None) -> Iterator[list]:
+        """
+        Yield the flight's batches from the first one, in the caller thread
+
+        Re-raises the upstream's exception once the batches before it were
+        yielded. Setting `cancel` raises IterationCancelled within
+        CANCEL_POLL_INTERVAL. Closing the generator leaves the flight.
+        """
+        index = 0
+        try:
+            while True:
+                with self._condition:
+                    while index == len(self._batches) and not self._done:
+                        if cancel is not None and cancel.is_set():
+                            raise IterationCancelled()
+                        self._condition.wait(CANCEL_POLL_INTERVAL if cancel is not None else None)
+                    batches = self._batches[index:]
+                    index += len(batches)
+                    ended = self._done and index == len(self._batches)
+                    error = self._error
+                for batch in batches:
+                    if cancel is not None and cancel.is_set():
+                        raise IterationCancelled()
+                    yield batch
+                if ended:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave()
+
+    def _leave(self):
+        with self._condition:
+            self.followers -= 1
+            abandoned = self.followers == 0 and not self._done
+            if abandoned:
+                self._closed = True
+        if abandoned:
+            if self._on_close is not None:
+                self._on_close(self)
+            if self._future is not None:
+                # Cancels the upstream request and drops its connection
+                self._future.cancel()
+
+    def leader_cancel(self, cancel: Optional[threading.Event]) -> Optional["_UnlessFollowed"]:
+        """Cancel event for the leader's admission wait that ignores `cancel` while others follow"""
+        return _UnlessFollowed(cancel, self) if cancel is not None else None
+
+
+class _UnlessFollowed:
+    """Set when `cancel` is set and no other session follows the flight"""
+
+    def __init__(self, cancel: threading.Event, flight: Flight):
+        self.cancel = cancel
+        self.flight = flight
+
+    def is_set(self) -> bool:
+        return self.cancel.is_set() and self.flight.followers <= 1
+
+
+class SingleFlight:
+    """
+    Flights of identical questions currently streaming, by normalized request
+
+    Sharing rules. A request is shared only when its answer cannot depend on
+    anything but the question:
+      - Only the first question of a conversation is shared. The backend keeps
+        history per thread_id, so later turns are always sent on their own.
+      - Requests in debug mode are never shared, since they need their own raw
+        stream for the debug capture.
+      - The upstream request carries the thread_id of the session that started
+        it. The backend's history for the other sessions' threads does not
+        include this turn, exactly as with answers served from the cache, so
+        their follow-up questions are answered without the opening question.
+        This is visible to users and documented next to ESMA_SINGLE_FLIGHT.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Flight] = {}
+
+    def key(self, base_url: str, question: str, turn: int = 0, debug_mode: bool = False) -> Optional[str]:
+        """
+        Sharing key for a request, or None when the rules above exclude it
+
+        Args:
+            base_url: Backend the request goes to
+            question: Question as typed by the user
+            turn: Number of answers already given in this conversation
+            debug_mode: Whether the session captures debug output
+        """
+        if turn > 0 or debug_mode:
+            return None
+        return question_key(base_url, question)
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """
+        Follow the flight in progress for `key`, or start a new one
+
+        Returns:
+            (flight, leader); the leader must start or abort the flight
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.subscribe():
+                registry.increment("esma_single_flight_total", outcome="follower")
+                return flight, False
+            flight = Flight(key, self._remove)
+            self._flights[key] = flight
+        registry.increment("esma_single_flight_total", outcome="leader")
+        return flight, True
+
+    def _remove(self, flight: Flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """Return the process-wide SingleFlight, or None when ESMA_SINGLE_FLIGHT is off."""
+    global _single_flight
+    if not SINGLE_FLIGHT_ENABLED:
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+                registry.gauge("esma_single_flights", "Shared upstream streams in flight", lambda: len(_single_flight))
+    return _single_flight
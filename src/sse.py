@@ -0,0 +1,432 @@
+"""
+Server-Sent Events decoding for ESMA Chat
+Incremental byte-level SSE parser and single-pass payload content extraction
+"""
+
+import codecs
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+_BOM = "\ufeff"
+
+
+@dataclass(slots=True)
+class SSEEvent:
+    """A dispatched SSE event"""
+    data: str
+    event: str = "message"
+    id: str = ""
+    retry: Optional[int] = None
+
+
+class SSEDecoder:
+    """
+    Incremental Server-Sent Events decoder
+
+    Implements the event stream interpretation of the WHATWG HTML spec as a
+    state machine over raw bytes, so it can be fed directly from
+    `response.aiter_bytes()` with chunks split at arbitrary positions,
+    including inside a CRLF pair or a multi-byte UTF-8 sequence.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending: List[str] = []
+        self._skip_lf = False
+        self._started = False
+
+        self._data: List[str] = []
+        self._event = ""
+
+        self.last_event_id = ""
+        self.retry: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """
+        Consume a chunk of bytes
+
+        Returns:
+            Events completed by this chunk, in stream order
+        """
+        return self._consume(self._decoder.decode(chunk))
+
+    def close(self) -> List[SSEEvent]:
+        """
+        Signal end of stream
+
+        Per the spec, a trailing event that was not terminated by a blank line
+        is discarded; a trailing unterminated line is still processed as a field.
+        """
+        events = self._consume(self._decoder.decode(b"", final=True))
+        if self._pending:
+            # Whole lines of the unfinished event may be pending too
+            for line in "".join(self._pending).split("\n"):
+                self._process_line(line)
+            self._pending = []
+        self._reset_event()
+        return events
+
+    def _consume(self, text: str) -> List[SSEEvent]:
+        if not text:
+            return []
+
+        if not self._started:
+            self._started = True
+            if text.startswith(_BOM):
+                text = text[1:]
+
+        if self._skip_lf:
+            self._skip_lf = False
+            if text.startswith("\n"):
+                text = text[1:]
+
+        if "\n" not in text and "\r" not in text:
+            # Partial line: keep the pieces and join once the line ends
+            self._pending.append(text)
+            return []
+        if self._pending:
+            self._pending.append(text)
+            buffer = "".join(self._pending)
+        else:
+            buffer = text
+
+        events = []
+
+        if "\r" not in buffer and not self._data and not self._event and "\n\n" in buffer:
+            # Common case: LF-only line endings and an event boundary in this
+            # chunk. Split into whole events; the usual single `data:` line
+            # event needs no line handling at all. The unfinished event at the
+            # end is kept as text and scanned again with the next chunk
+            *blocks, rest = buffer.split("\n\n")
+            for block in blocks:
+                if block.startswith("data: ") and "\n" not in block:
+                    events.append(SSEEvent(block[6:], "message", self.last_event_id, self.retry))
+                    continue
+                for line in block.split("\n"):
+                    event = self._process_line(line)
+                    if event is not None:
+                        events.append(event)
+                event = self._dispatch()
+                if event is not None:
+                    events.append(event)
+            self._pending = [rest] if rest else []
+            return events
+
+        if "\r" not in buffer:
+            # LF-only line endings within an event: split in one call and
+            # handle data lines and event boundaries inline, so a long event
+            # is not scanned again with every chunk
+            *lines, rest = buffer.split("\n")
+            data = self._data
+            for line in lines:
+                if line.startswith("data: "):
+                    data.append(line[6:])
+                elif line:
+                    self._process_line(line)
+                else:
+                    if data:
+                        events.append(SSEEvent(
+                            data[0] if len(data) == 1 else "\n".join(data),
+                            self._event or "message",
+                            self.last_event_id,
+                            self.retry
+                        ))
+                    self._data = data = []
+                    self._event = ""
+            self._pending = [rest] if rest else []
+            return events
+
+        pos = 0
+        end = len(buffer)
+
+        while pos < end:
+            lf = buffer.find("\n", pos)
+            cr = buffer.find("\r", pos, lf if lf != -1 else end)
+            if cr != -1:
+                line_end = cr
+                if cr + 1 < end:
+                    next_pos = cr + 2 if buffer[cr + 1] == "\n" else cr + 1
+                else:
+                    # CR at the end of the chunk: an LF may follow in the next one
+                    next_pos = cr + 1
+                    self._skip_lf = True
+            elif lf != -1:
+                line_end = lf
+                next_pos = lf + 1
+            else:
+                break
+
+            event = self._process_line(buffer[pos:line_end])
+            if event is not None:
+                events.append(event)
+            pos = next_pos
+
+        self._pending = [buffer[pos:]] if pos < end else []
+        return events
+
+    def _process_line(self, line: str) -> Optional[SSEEvent]:
+        if not line:
+            return self._dispatch()
+
+        if line.startswith("data: "):
+            self._data.append(line[6:])
+            return None
+
+        colon = line.find(":")
+        if colon == 0:
+            # Comment / heartbeat
+            return None
+        if colon == -1:
+            field, value = line, ""
+        else:
+            field = line[:colon]
+            value = line[colon + 1:]
+            if value.startswith(" "):
+                value = value[1:]
+
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif field == "retry":
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        if not self._data:
+            self._reset_event()
+            return None
+        event = SSEEvent(
+            data="\n".join(self._data),
+            event=self._event or "message",
+            id=self.last_event_id,
+            retry=self.retry
+        )
+        self._reset_event()
+        return event
+
+    def _reset_event(self):
+        self._data = []
+        self._event = ""
+
+
+# Escapes understood in both JSON strings and Python repr() output
+_SIMPLE_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "b": "\b",
+    "f": "\f",
+    "0": "\0",
+    "\\": "\\",
+    "'": "'",
+    '"': '"',
+    "/": "/",
+}
+_HEX_ESCAPES = {"x": 2, "u": 4, "U": 8}
+_decode_unicode_escape = codecs.getdecoder("unicode_escape")
+
+# Body of a quoted string up to (not including) the closing quote or the end of input
+_STRING_BODY = {
+    '"': re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S),
+    "'": re.compile(r"[^'\\]*(?:\\.[^'\\]*)*", re.S),
+}
+# Object key without escapes followed by the colon, the shape every real payload has
+_PLAIN_KEY = re.compile(r"""[ \t\r\n]*(?:"([^"\\]*)"|'([^'\\]*)')[ \t\r\n]*:[ \t\r\n]*""")
+_WS = re.compile(r"[ \t\r\n]*")
+# Exact prefix of the API's content events, checked before the general parser
+_CONTENT_PREFIX = '{"type": "content", "content": '
+_CONTENT_START = len(_CONTENT_PREFIX)
+_QUOTES = "\"'"
+
+
+def _unescape(raw: str) -> str:
+    """Resolve backslash escapes from a JSON or repr() string body."""
+    value = None
+    if "\\/" not in raw:
+        # Both formats only emit escapes Python understands (JSON's \/ aside),
+        # so the C unicode_escape codec can decode the body in one call;
+        # backslashreplace keeps non-Latin-1 characters intact through it
+        try:
+            value = _decode_unicode_escape(raw.encode("latin-1", "backslashreplace"))[0]
+        except (UnicodeDecodeError, DeprecationWarning):
+            pass
+    if value is None:
+        value = _unescape_slow(raw)
+
+    if "\\u" in raw:
+        try:
+            value.encode("utf-8")
+        except UnicodeEncodeError:
+            # JSON encodes astral characters as \uXXXX surrogate pairs
+            value = value.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+    return value
+
+
+def _unescape_slow(raw: str) -> str:
+    """Escape-by-escape fallback for JSON's escaped slash and escapes cut off by truncation."""
+    segments = raw.split("\\")
+    parts = [segments[0]]
+    literal = False
+
+    for segment in segments[1:]:
+        if literal:
+            # Text following an escaped backslash
+            parts.append(segment)
+            literal = False
+        elif not segment:
+            parts.append("\\")
+            literal = True
+        elif segment[0] in _SIMPLE_ESCAPES:
+            parts.append(_SIMPLE_ESCAPES[segment[0]])
+            parts.append(segment[1:])
+        elif segment[0] in _HEX_ESCAPES:
+            size = _HEX_ESCAPES[segment[0]] + 1
+            try:
+                if len(segment) < size:
+                    raise ValueError("escape cut off")
+                parts.append(chr(int(segment[1:size], 16)))
+                parts.append(segment[size:])
+            except ValueError:
+                parts.append("\\" + segment)
+        else:
+            # Unknown escapes are kept verbatim, like Python does
+            parts.append("\\" + segment)
+
+    return "".join(parts)
+
+
+def _read_string(text: str, i: int) -> Tuple[str, int]:
+    """
+    Read a quoted string starting at text[i] (the opening quote)
+
+    The body is matched in one regex pass and only unescaped when it contains
+    a backslash. A string cut off by the end of the payload returns
+    everything up to the end.
+
+    Returns:
+        (unescaped value, index after the closing quote)
+    """
+    end = _STRING_BODY[text[i]].match(text, i + 1).end()
+    if end < len(text) and text[end] == "\\":
+        # Cut off right after a backslash
+        end = len(text)
+    raw = text[i + 1:end]
+    value = _unescape(raw) if "\\" in raw else raw
+    return value, min(end + 1, len(text))
+
+
+def _skip_value(text: str, i: int) -> int:
+    """Skip a non-target value (scalar, string, object or array) and return the next index."""
+    end = len(text)
+    if i >= end:
+        return end
+    if text[i] in _QUOTES:
+        return _read_string(text, i)[1]
+    if text[i] in "{[":
+        depth = 0
+        while i < end:
+            c = text[i]
+            if c in _QUOTES:
+                i = _read_string(text, i)[1]
+                continue
+            if c in "{[":
+                depth += 1
+            elif c in "}]":
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        return end
+    while i < end and text[i] not in ",}":
+        i += 1
+    return i
+
+
+def _read_key(text: str, i: int) -> Tuple[Optional[str], int]:
+    """Read an object key and its colon; returns (None, i) if there is none."""
+    match = _PLAIN_KEY.match(text, i)
+    if match:
+        key = match.group(1)
+        return (match.group(2) if key is None else key), match.end()
+
+    # Keys with escapes take the slow path
+    i = _WS.match(text, i).end()
+    if i >= len(text) or text[i] not in _QUOTES:
+        return None, i
+    key, i = _read_string(text, i)
+    i = _WS.match(text, i).end()
+    if i >= len(text) or text[i] != ":":
+        return None, i
+    return key, _WS.match(text, i + 1).end()
+
+
+def extract_field(payload: str, keys: Tuple[str, ...] = ("content",)) -> Optional[str]:
+    """
+    Extract the first top-level string value for one of `keys` from an event payload
+
+    Handles standard JSON as well as the repr()-style objects the API emits,
+    e.g. {"type": "content", "content": 'it\'s "quoted"\n'}, in a single
+    pass without trying several parsers. Values truncated by the end of the
+    payload are returned as far as they go.
+
+    Returns:
+        The unescaped value, or None if no key matches or the payload is not an object
+    """
+    i = _WS.match(payload).end()
+    end = len(payload)
+    if i >= end or payload[i] != "{":
+        return None
+    i += 1
+
+    while True:
+        key, i = _read_key(payload, i)
+        if key is None:
+            return None
+
+        if key in keys:
+            if i < end and payload[i] in _QUOTES:
+                return _read_string(payload, i)[0]
+            return None
+
+        i = _WS.match(payload, _skip_value(payload, i)).end()
+        if i >= end or payload[i] != ",":
+            return None
+        i += 1
+
+
+def decode_content(payload: str) -> Optional[str]:
+    """
+    Decode the text chunk carried by one event payload
+
+    Returns:
+        The content string, or None for empty content, [DONE] markers and
+        payloads without a content field
+    """
+    if not payload or payload == "[DONE]":
+        return None
+
+    if payload.startswith(_CONTENT_PREFIX):
+        # Fast path for the API's own shape: the value is everything between
+        # the quote after the prefix and the closing quote + brace, provided
+        # that every occurrence of the quote character inside it is escaped
+        closing = payload[-2:]
+        if (closing == "'}" or closing == '"}') and payload[_CONTENT_START] == closing[0]:
+            quote = closing[0]
+            raw = payload[_CONTENT_START + 1:-2]
+            if "\\" not in raw:
+                if quote not in raw:
+                    return raw or None
+            else:
+                # Once escaped backslashes are removed, every backslash starts an
+                # escape, so counting escaped quotes is exact
+                plain = raw.replace("\\\\", "") if "\\\\" in raw else raw
+                if plain[-1:] != "\\" and (quote not in plain or plain.count(quote) == plain.count("\\" + quote)):
+                    return _unescape(raw) or None
+
+    return extract_field(payload) or None
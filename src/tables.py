@@ -0,0 +1,163 @@
+"""
+Structured table results for ESMA Chat
+Decodes typed "table" events into Arrow tables and renders them as dataframes
+"""
+
+import base64
+import binascii
+import json
+import re
+from typing import List, Sequence, Union
+
+import pyarrow as pa
+
+# SSE event type (or NDJSON "type" value) carrying a table instead of answer text
+TABLE_EVENT = "table"
+
+# Stands in for a table inside the stored answer text; invisible if rendered as plain Markdown
+TABLE_MARKER = "<!-- esma-table:{} -->"
+_MARKER_RE = re.compile(r"<!-- esma-table:(\d+) -->")
+
+
+# What stream decoders return: answer text, or a decoded table
+Chunk = Union[str, pa.Table]
+
+
+class TableDecodeError(ValueError):
+    """Raised when a table event cannot be decoded"""
+
+
+def _column(values: list) -> pa.Array:
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed types in one column: keep them readable as text
+        return pa.array([None if value is None else str(value) for value in values], pa.string())
+
+
+def _build(names: Sequence, columns: Sequence[list]) -> pa.Table:
+    return pa.Table.from_arrays([_column(values) for values in columns], names=[str(name) for name in names])
+
+
+def table_from_json(payload: Union[dict, list]) -> pa.Table:
+    """
+    Build a table from the JSON shapes the backend may send
+
+    Accepts {"columns": [...], "rows": [[...], ...]}, {"rows": [{...}, ...]}
+    or a bare list of row objects. Rows are transposed once into columns.
+
+    Raises:
+        TableDecodeError: The payload is not one of these shapes
+    """
+    if isinstance(payload, dict):
+        names = payload.get("columns")
+        rows = payload.get("rows")
+    else:
+        names, rows = None, payload
+    if not isinstance(rows, list):
+        raise TableDecodeError("Table payload has no rows")
+
+    if all(isinstance(row, dict) for row in rows):
+        if names is None:
+            # Union of keys in first-seen order
+            names = list(dict.fromkeys(key for row in rows for key in row))
+        return _build(names, [[row.get(name) for row in rows] for name in names])
+
+    if not all(isinstance(row, list) for row in rows):
+        raise TableDecodeError("Table rows must all be lists or all be objects")
+    width = len(names) if names is not None else len(rows[0]) if rows else 0
+    if any(len(row) != width for row in rows):
+        raise TableDecodeError(f"Table rows must have {width} values")
+    if names is None:
+        names = [str(i) for i in range(width)]
+    columns = [list(values) for values in zip(*rows)] if rows else [[] for _ in names]
+    return _build(names, columns)
+
+
+def table_to_ipc(table: pa.Table) -> bytes:
+    """Serialize a table in the Arrow IPC stream format"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def table_from_ipc(data: bytes) -> pa.Table:
+    """Read a table written with table_to_ipc (or any Arrow IPC stream)"""
+    try:
+        return pa.ipc.open_stream(data).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise TableDecodeError(f"Invalid Arrow IPC stream: {e}") from e
+
+
+def decode_table(data: str) -> pa.Table:
+    """
+    Decode the data of a table event
+
+    JSON payloads (see table_from_json) are read as is; anything else is
+    taken as a base64-encoded Arrow IPC stream.
+
+    Raises:
+        TableDecodeError: The data is neither
+    """
+    text = data.strip()
+    if text[:1] in ("{", "["):
+        try:
+            payload = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise TableDecodeError(f"Invalid table JSON: {e}") from e
+        return table_from_json(payload)
+    try:
+        raw = base64.b64decode(text, validate=True)
+    except binascii.Error as e:
+        raise TableDecodeError(f"Table data is neither JSON nor base64: {e}") from e
+    return table_from_ipc(raw)
+
+
+def table_marker(index: int) -> str:
+    return TABLE_MARKER.format(index)
+
+
+def split_answer(content: str, tables: Sequence[pa.Table]) -> List[Chunk]:
+    """
+    Split stored answer text at its table markers
+
+    Returns:
+        Text segments and tables in display order; markers without a table are dropped
+    """
+    parts: List[Chunk] = []
+    pos = 0
+    for match in _MARKER_RE.finditer(content):
+        parts.append(content[pos:match.start()])
+        index = int(match.group(1))
+        if index < len(tables):
+            parts.append(tables[index])
+        pos = match.end()
+    parts.append(content[pos:])
+    return parts
+
+
+def render_answer(container, content: str, tables: Sequence[pa.Table]):
+    """Draw an answer with tables into `container`: Markdown for text, st.dataframe for tables."""
+    for part in split_answer(content, tables):
+        if isinstance(part, str):
+            if part.strip():
+                container.markdown(part)
+        else:
+            container.dataframe(part)
+
+
+class Answer(str):
+    """
+    Answer text that carries the tables its markers refer to
+
+    A str, so everything that handles answers as text keeps working;
+    the conversation store reads `tables` to persist them.
+    """
+
+    tables: tuple = ()
+
+    def __new__(cls, content: str, tables: Sequence[pa.Table] = ()):
+        answer = super().__new__(cls, content)
+        answer.tables = tuple(tables)
+        return answer
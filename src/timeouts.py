@@ -0,0 +1,96 @@
+"""
+Stream deadlines for ESMA Chat
+Phase-aware timeouts for answer streams and the retry policy for connect failures
+"""
+
+import asyncio
+import os
+import random
+import time
+import httpx
+from dataclasses import dataclass
+from typing import Awaitable, Type, TypeVar
+
+T = TypeVar("T")
+
+# Seconds to open a TCP/TLS connection, per attempt
+CONNECT_TIMEOUT = float(os.getenv("ESMA_CONNECT_TIMEOUT", "10"))
+# Seconds from sending a question to the first bytes of its answer (agent thinking included)
+FIRST_BYTE_TIMEOUT = float(os.getenv("ESMA_FIRST_BYTE_TIMEOUT", "120"))
+# Seconds without any bytes once the answer started; SSE heartbeat comments count
+IDLE_TIMEOUT = float(os.getenv("ESMA_IDLE_TIMEOUT", "60"))
+# Connection attempts retried after a connect failure (0 disables retries)
+CONNECT_RETRIES = int(os.getenv("ESMA_CONNECT_RETRIES", "3"))
+# Backoff before connect retry N is drawn from [0, min(MAX, BASE * 2**N)] seconds
+CONNECT_BACKOFF = float(os.getenv("ESMA_CONNECT_BACKOFF", "0.5"))
+CONNECT_BACKOFF_MAX = float(os.getenv("ESMA_CONNECT_BACKOFF_MAX", "8"))
+
+
+class StreamTimeout(httpx.TimeoutException):
+    """An answer stream phase ran past its deadline"""
+
+    phase = ""
+
+    def __init__(self, seconds: float):
+        super().__init__(f"No {self.phase.replace('_', ' ')} within {seconds:g}s")
+        self.seconds = seconds
+
+
+class FirstByteTimeout(StreamTimeout):
+    """The backend did not start answering in time"""
+    phase = "first_byte"
+
+
+class IdleTimeout(StreamTimeout):
+    """The answer stream went silent, heartbeats included"""
+    phase = "idle"
+
+
+class TotalTimeout(StreamTimeout):
+    """The whole answer took too long; never retried or resumed"""
+    phase = "total"
+
+
+@dataclass
+class StreamPolicy:
+    """Deadlines, in seconds, and connect retry policy for one answer stream"""
+    total: float
+    connect: float = CONNECT_TIMEOUT
+    first_byte: float = FIRST_BYTE_TIMEOUT
+    idle: float = IDLE_TIMEOUT
+    connect_retries: int = CONNECT_RETRIES
+    backoff: float = CONNECT_BACKOFF
+    backoff_max: float = CONNECT_BACKOFF_MAX
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        """httpx only enforces connect; reads are bounded by the phase deadlines instead"""
+        return httpx.Timeout(None, connect=self.connect)
+
+    def backoff_delay(self, attempt: int, rng: random.Random = random) -> float:
+        """Full-jitter exponential backoff before retry `attempt` (0-based)"""
+        return rng.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+
+class Deadline:
+    """Total deadline of one answer, which caps every phase deadline inside it"""
+
+    def __init__(self, total: float):
+        self.total = total
+        self.expires = time.monotonic() + total
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    async def wait(self, awaitable: Awaitable[T], until: float, timeout: Type[StreamTimeout], seconds: float) -> T:
+        """
+        Await `awaitable` until the monotonic time `until` at the latest
+
+        Raises:
+            `timeout`(seconds) when `until` passes first, TotalTimeout when the total deadline does
+        """
+        if self.expires <= until:
+            until, timeout, seconds = self.expires, TotalTimeout, self.total
+        try:
+            return await asyncio.wait_for(awaitable, max(until - time.monotonic(), 0))
+        except TimeoutError:
+            raise timeout(seconds) from None
@@ -0,0 +1,111 @@
+"""
+Backend warm-up for ESMA Chat
+Resolves DNS, opens a pooled connection and wakes the backend before the first question
+"""
+
+import asyncio
+import os
+import socket
+import threading
+import time
+import httpx
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from src.connection import get_client_manager
+from src.metrics import RequestMetrics, classify_error, registry
+
+WARMUP_ENABLED = os.getenv("ESMA_WARMUP", "1").lower() in ("1", "true", "yes")
+# Path requested with GET to wake the backend, e.g. "/health"; without one a HEAD / is sent
+WARMUP_PATH = os.getenv("ESMA_WARMUP_PATH", "")
+# Seconds the warm-up request may take (Cloud Run cold starts included)
+WARMUP_TIMEOUT = float(os.getenv("ESMA_WARMUP_TIMEOUT", "30"))
+# Minimum seconds between two warm-ups of the same backend, across all sessions
+WARMUP_INTERVAL = float(os.getenv("ESMA_WARMUP_INTERVAL", "30"))
+
+
+@dataclass
+class WarmupResult:
+    """Timings of one warm-up, in seconds"""
+    base_url: str
+    started: float = field(default_factory=time.time)
+    dns: Optional[float] = None
+    connect: Optional[float] = None
+    request: Optional[float] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+
+async def _warm_up(base_url: str, path: str, timeout: float) -> WarmupResult:
+    result = WarmupResult(base_url)
+    url = httpx.URL(base_url)
+    try:
+        start = time.monotonic()
+        port = url.port or (443 if url.scheme == "https" else 80)
+        await asyncio.wait_for(
+            asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM), timeout
+        )
+        result.dns = time.monotonic() - start
+
+        # The request leaves its connection in the shared pool for the first question
+        trace = RequestMetrics(backend=base_url)
+        client = get_client_manager().client
+        start = time.monotonic()
+        if path:
+            response = await client.get(f"{base_url}{path}", timeout=timeout, extensions={"trace": trace.trace})
+        else:
+            response = await client.head(base_url, timeout=timeout, extensions={"trace": trace.trace})
+        result.request = time.monotonic() - start
+        result.connect = trace.connect
+        result.status_code = response.status_code
+    except Exception as e:
+        result.error = classify_error(e)
+
+    registry.increment("esma_warmups_total", base_url, result.error or "ok")
+    if result.dns is not None:
+        registry.observe("esma_warmup_dns_seconds", base_url, result.dns)
+    if result.connect is not None:
+        registry.observe("esma_warmup_connect_seconds", base_url, result.connect)
+    if result.request is not None:
+        registry.observe("esma_warmup_request_seconds", base_url, result.request)
+    _results[base_url] = result
+    return result
+
+
+_results: Dict[str, WarmupResult] = {}
+_last_started: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def warm_up(
+    base_url: str,
+    path: str = WARMUP_PATH,
+    timeout: float = WARMUP_TIMEOUT,
+    force: bool = False
+) -> Optional[Future]:
+    """
+    Start a warm-up of `base_url` on the client loop without waiting for it
+
+    Args:
+        base_url: Backend to warm up
+        path: GET this path instead of sending HEAD to the base URL
+        timeout: Seconds allowed for DNS and for the request
+        force: Ignore WARMUP_INTERVAL
+
+    Returns:
+        Future with the WarmupResult, or None when disabled or warmed up recently
+    """
+    if not WARMUP_ENABLED and not force:
+        return None
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_started.get(base_url, float("-inf")) < WARMUP_INTERVAL:
+            return None
+        _last_started[base_url] = now
+    return get_client_manager().submit(_warm_up(base_url, path, timeout))
+
+
+def last_warmup(base_url: str) -> Optional[WarmupResult]:
+    """Most recent finished warm-up of `base_url`, if any."""
+    return _results.get(base_url)
@@ -0,0 +1,42 @@
+"""
+Tests for compressed answer streams through the client
+Each Content-Encoding decoded back to the answer the mock sent, with fewer bytes on the wire
+"""
+
+from dataclasses import replace
+
+import pytest
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src.client import get_api_response_streaming
+from src.compression import decoder_available
+from src.metrics import registry
+
+BASE = MockConfig(chunks=200)
+
+
+def byte_sums(url: str) -> tuple:
+    """Wire and decoded bytes recorded so far for `url`"""
+    histograms = registry.snapshot()["histograms"]
+    wire = histograms.get("esma_response_bytes", {}).get(url, {}).get("sum", 0)
+    decoded = histograms.get("esma_response_decoded_bytes", {}).get(url, {}).get("sum", 0)
+    return wire, decoded
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_compressed_answer_is_decoded(encoding):
+    if not decoder_available(encoding):
+        pytest.skip(f"decoder package for {encoding} not installed")
+    config = replace(BASE, compression=encoding)
+
+    with MockBackend(config) as backend:
+        wire_before, decoded_before = byte_sums(backend.url)
+        answer = get_api_response_streaming("pregunta", f"compression-{encoding}", FakePlaceholder(), backend.url)
+        wire, decoded = byte_sums(backend.url)
+        negotiated = registry.snapshot()["counters"]["esma_response_encodings_total"][backend.url]
+
+    assert answer == expected_answer(config)
+    assert encoding in negotiated
+    bytes_received, bytes_decoded = wire - wire_before, decoded - decoded_before
+    assert 0 < bytes_received < bytes_decoded
@@ -0,0 +1,102 @@
+"""
+Tests for src.conversations
+Idle eviction and retention of transcripts, and the answer count that feeds the cache and sharing turn
+"""
+
+import time
+
+import pytest
+
+from src.conversations import SWEEP_INTERVAL, ConversationStore
+
+
+@pytest.fixture
+def store():
+    store = ConversationStore(":memory:", idle_seconds=60, retention=300)
+    yield store
+    store.close()
+
+
+def chat(store, thread_id="thread"):
+    conversation = store.conversation(thread_id)
+    conversation.append("user", "¿Cuál fue la tasa de informalidad en 2023?")
+    conversation.append("assistant", "Fue de 70,7 %.")
+    return conversation
+
+
+def age(store, thread_id, seconds):
+    """Pretend the stored activity of a thread happened `seconds` ago"""
+    store._db.execute(
+        "UPDATE threads SET last_active = ? WHERE thread_id = ?", (time.time() - seconds, thread_id)
+    )
+
+
+def idle(store, thread_id):
+    """Pretend the in-memory window of a thread was last used long ago"""
+    store._windows[thread_id].last_active -= store.idle_seconds + 1
+    store._windows[thread_id].touched -= SWEEP_INTERVAL
+
+
+def test_active_window_is_never_expired(store):
+    conversation = chat(store)
+    age(store, "thread", store.retention + 1)
+
+    conversation.messages()
+    store.evict_idle()
+
+    assert len(conversation) == 2
+    assert conversation.answers == 1
+    assert [m["role"] for m in conversation.messages()] == ["user", "assistant"]
+
+
+def test_viewing_refreshes_stored_activity(store):
+    conversation = chat(store)
+    idle(store, "thread")
+    store.evict_idle()
+    assert store.memory_report()["sessions"] == 0
+
+    # Viewed after the window left memory, close to the retention limit
+    age(store, "thread", store.retention - 1)
+    assert len(conversation.messages()) == 2
+    idle(store, "thread")
+    store.evict_idle()
+
+    row = store._db.execute("SELECT last_active FROM threads WHERE thread_id = 'thread'").fetchone()
+    assert time.time() - row[0] < SWEEP_INTERVAL
+    assert len(conversation) == 2
+
+
+def test_expired_transcript_keeps_answer_count(store):
+    conversation = chat(store)
+    idle(store, "thread")
+    age(store, "thread", store.retention + 1)
+
+    store.evict_idle()
+
+    assert len(conversation) == 0
+    assert conversation.messages() == []
+    # The backend may still hold this thread, so the next question is not an opening one
+    assert conversation.answers == 1
+
+    conversation.append("user", "¿Y en 2022?")
+    assert [m["content"] for m in conversation.messages()] == ["¿Y en 2022?"]
+    assert conversation.answers == 1
+
+
+def test_expired_transcript_is_swept_once(store):
+    chat(store)
+    idle(store, "thread")
+    age(store, "thread", store.retention + 1)
+    store.evict_idle()
+
+    assert store._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+    assert store._db.execute("SELECT messages, answers FROM threads").fetchall() == [(0, 1)]
+
+
+def test_delete_forgets_thread(store):
+    conversation = chat(store)
+    conversation.delete()
+
+    assert len(conversation) == 0
+    assert conversation.answers == 0
+    assert store._db.execute("SELECT COUNT(*) FROM threads").fetchone()[0] == 0
@@ -0,0 +1,60 @@
+"""
+Tests for stream resumption in src.client
+Answers over connections cut at seeded points, against servers that resume, replay or cannot resume
+"""
+
+from dataclasses import replace
+
+import pytest
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src.client import INTERRUPTED_MARKER, get_api_response_streaming
+
+# A cut in about one write out of twenty; each seed cuts an answer at different points
+BASE = MockConfig(chunks=100, cut_rate=0.05, retry_ms=10)
+SEEDS = range(6)
+
+
+def ask(config: MockConfig, name: str) -> tuple:
+    """The answer to one question and the mock server that sent it"""
+    with MockBackend(config) as backend:
+        response = get_api_response_streaming(
+            "pregunta", f"resume-{name}-{config.seed}", FakePlaceholder(), backend.url
+        )
+    return response, backend.server
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_resumed_answer_is_complete(seed):
+    config = replace(BASE, event_ids=True, seed=seed)
+    response, server = ask(config, "resume")
+
+    # No text is duplicated or missing across the resumed connections
+    assert server.requests > 1
+    assert response == expected_answer(config)
+    assert not server.reruns
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_restarted_stream_is_not_resumed_again(seed):
+    # The server sends event IDs but answers a resume from the first event
+    config = replace(BASE, event_ids=True, honor_last_event_id=False, seed=seed)
+    response, server = ask(config, "replay")
+
+    # One resume finds the answer restarted; the client gives up instead of rerunning it again
+    assert server.requests == 2
+    assert max(server.reruns.values()) == 1
+    # Replayed events are not appended a second time
+    assert response.endswith(INTERRUPTED_MARKER)
+    assert expected_answer(config).startswith(response[:-len(INTERRUPTED_MARKER)])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_unresumable_answer_keeps_marked_prefix(seed):
+    config = replace(BASE, event_ids=False, seed=seed)
+    response, server = ask(config, "no_ids")
+
+    assert server.requests == 1
+    assert response.endswith(INTERRUPTED_MARKER)
+    assert expected_answer(config).startswith(response[:-len(INTERRUPTED_MARKER)])
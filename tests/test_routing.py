@@ -0,0 +1,198 @@
+"""
+Tests for src.routing
+Backend ranking, sticky conversations and failover, alone and against mock backends with health checks
+"""
+
+import time
+from dataclasses import replace
+
+import pytest
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src import routing
+from src.client import get_api_response_streaming
+from src.metrics import RequestMetrics
+from src.routing import Router
+
+A, B, C = "http://a", "http://b", "http://c"
+
+
+def router(*urls, **kwargs) -> Router:
+    """A router that only learns from observe, with no health checks"""
+    return Router(urls or (A, B), health_interval=0, alpha=0.5, **kwargs)
+
+
+def state(router: Router, url: str) -> dict:
+    return next(backend for backend in router.snapshot() if backend["url"] == url)
+
+
+# --- Router alone ----------------------------------------------------------
+
+def test_unmeasured_backend_ranks_first():
+    r = router()
+    r.observe(A, 0.05)
+    assert r.route("t1") == B
+
+
+def test_latency_is_an_ewma():
+    r = router()
+    r.observe(A, 0.1)
+    r.observe(A, 0.3)
+    r.observe(A, 0.3)
+    assert state(r, A)["latency"] == pytest.approx(0.25)
+
+
+def test_new_threads_go_to_lowest_weighted_latency():
+    r = router(A, B, C)
+    r.observe(A, 0.2)
+    r.observe(B, 0.05)
+    r.observe(C, 0.1)
+    assert r.route("t1") == B
+
+    # Errors inflate B's latency past C's without making it unhealthy
+    r.observe(B, None, "http_502")
+    assert state(r, B)["healthy"]
+    assert r.route("t2") == C
+
+
+def test_thread_stays_on_its_backend_when_another_gets_faster():
+    r = router()
+    r.observe(A, 0.05)
+    r.observe(B, 0.1)
+    assert r.route("t1") == A
+
+    r.observe(A, 0.5)
+    assert r.route("t2") == B
+    assert r.route("t1") == A
+
+
+def test_thread_fails_over_and_stays_after_recovery():
+    r = router()
+    r.observe(A, 0.05)
+    r.observe(B, 0.1)
+    assert r.route("t1") == A
+
+    # One connect failure is enough to stop routing to A
+    r.observe(A, None, "connect")
+    assert not state(r, A)["healthy"]
+    assert r.route("t1") == B
+
+    r.observe(A, 0.01)
+    assert state(r, A)["healthy"]
+    assert r.route("t1") == B
+
+
+def test_unhealthy_after_consecutive_failures():
+    r = router(unhealthy_after=2)
+    r.observe(A, None, "timeout_first_byte")
+    assert state(r, A)["healthy"]
+    r.observe(A, None, "timeout_first_byte")
+    assert not state(r, A)["healthy"]
+    assert state(r, A)["failures"] == 2
+
+
+def test_least_failing_backend_when_none_is_healthy():
+    r = router()
+    for _ in range(3):
+        r.observe(A, None, "connect")
+    r.observe(B, None, "connect")
+    assert r.route("t1") == B
+
+
+def test_least_recently_routed_thread_is_forgotten():
+    r = router(max_threads=2)
+    r.observe(A, 0.05)
+    r.observe(B, 0.1)
+    r.route("t1")
+    r.route("t2")
+    r.route("t1")
+    r.route("t3")
+    assert sum(backend["threads"] for backend in r.snapshot()) == 2
+
+    # B is now the best backend; t1 is still pinned to A, t2 was forgotten and starts over
+    r.observe(A, 0.5)
+    assert r.route("t1") == A
+    assert r.route("t2") == B
+
+
+def test_report_ignores_outcomes_that_are_not_the_backends_fault():
+    r = router()
+    for error in ("cancelled", "empty"):
+        r.report(RequestMetrics(backend=A, error=error))
+    assert state(r, A)["error_rate"] == 0.0
+
+    r.report(RequestMetrics(backend=A, error="http_503"))
+    assert state(r, A)["failures"] == 1
+
+
+# --- Against mock backends -------------------------------------------------
+
+# Seconds before each mock sends response headers
+LATENCIES = [0.2, 0.005, 0.08]
+HEALTH_INTERVAL = 0.1
+BASE = MockConfig(chunks=20)
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(HEALTH_INTERVAL / 2)
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    """Mock backends of different latency and a health-checked router over them"""
+    backends = [MockBackend(replace(BASE, headers_delay=latency)).start() for latency in LATENCIES]
+    r = Router([backend.url for backend in backends], health_interval=HEALTH_INTERVAL, health_timeout=1.0)
+    # Answer requests report to the process-wide router
+    monkeypatch.setattr(routing, "_router", r)
+    r.start_health_checks()
+    try:
+        # Every backend measured a few times
+        wait_until(lambda: all(
+            backend["checked"] is not None and backend["latency"] is not None for backend in r.snapshot()
+        ))
+        time.sleep(HEALTH_INTERVAL * 3)
+        yield r, backends
+    finally:
+        r.stop_health_checks()
+        for backend in backends:
+            backend.stop()
+
+
+def ask(r: Router, thread_id: str) -> str:
+    url = r.route(thread_id)
+    assert get_api_response_streaming("pregunta", thread_id, FakePlaceholder(), url) == expected_answer(BASE)
+    return url
+
+
+def test_new_conversations_go_to_fastest_backend(cluster):
+    r, backends = cluster
+    fastest = backends[LATENCIES.index(min(LATENCIES))].url
+
+    routed = [ask(r, f"routing-latency-{i}") for i in range(10)]
+    assert sum(url == fastest for url in routed) >= 8
+
+
+def test_conversation_stays_fails_over_and_backend_recovers(cluster):
+    r, backends = cluster
+    thread_id = "routing-sticky"
+    first = ask(r, thread_id)
+    index = [backend.url for backend in backends].index(first)
+
+    # Slower than another backend: the conversation stays
+    backends[index].config = replace(BASE, headers_delay=0.3)
+    wait_until(lambda: state(r, first)["latency"] > 0.15)
+    assert [ask(r, thread_id) for _ in range(2)] == [first, first]
+
+    # Down: the next question is answered by another backend
+    port = backends[index].server.server_address[1]
+    backends[index].stop()
+    wait_until(lambda: not state(r, first)["healthy"])
+    assert ask(r, thread_id) != first
+
+    # Back on the same port: health checks mark it healthy again
+    backends[index] = MockBackend(BASE, port=port).start()
+    wait_until(lambda: state(r, first)["healthy"])
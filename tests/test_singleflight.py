@@ -0,0 +1,75 @@
+"""
+Tests for src.singleflight through the client
+Followers of a shared flight whose leader never got a stream slot
+"""
+
+import threading
+import time
+
+import pytest
+
+import src.client
+from benchmarks.fakes import FakePlaceholder
+from src.admission import QueueFull, QueueTimeout
+from src.client import STOPPED_MARKER, get_api_response_streaming
+from src.singleflight import SingleFlight
+
+BASE_URL = "http://127.0.0.1:9"
+QUESTION = "¿Cuál fue la tasa de informalidad en 2023?"
+
+
+@pytest.fixture
+def flights(monkeypatch):
+    flights = SingleFlight()
+    monkeypatch.setattr(src.client, "get_single_flight", lambda: flights)
+    return flights
+
+
+def start_follower(flights, cancel=None):
+    """Join the leader's flight from another thread, as a second session would"""
+    result = {}
+    placeholder = FakePlaceholder()
+
+    def run():
+        result["answer"] = get_api_response_streaming(
+            QUESTION, "follower-thread", placeholder, BASE_URL, cancel=cancel
+        )
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    # The follower is attached once the flight counts it
+    key = flights.key(BASE_URL, QUESTION)
+    deadline = time.monotonic() + 5
+    while flights._flights[key].followers < 2:
+        assert time.monotonic() < deadline, "follower did not join"
+        time.sleep(0.01)
+    return thread, result, placeholder
+
+
+@pytest.mark.parametrize("error, expected", [
+    (QueueFull(), "🚦"),
+    (QueueTimeout(), "⏳"),
+], ids=["full", "timeout"])
+def test_follower_of_aborted_flight_gets_admission_error(flights, error, expected):
+    flight, leader = flights.join(flights.key(BASE_URL, QUESTION))
+    assert leader and flight.metrics is None
+    thread, result, placeholder = start_follower(flights)
+
+    flight.abort(error)
+    thread.join(5)
+
+    assert result["answer"].startswith(expected)
+    assert placeholder.messages == [("error", result["answer"])]
+
+
+def test_follower_stopping_before_admission_is_marked_stopped(flights):
+    flight, _ = flights.join(flights.key(BASE_URL, QUESTION))
+    cancel = threading.Event()
+    thread, result, _ = start_follower(flights, cancel)
+
+    cancel.set()
+    thread.join(5)
+
+    assert str(result["answer"]).endswith(STOPPED_MARKER.strip())
+    assert flight.metrics is None
+    flight.abort(QueueFull())
@@ -0,0 +1,219 @@
+"""
+Tests for src.sse
+SSE framing across arbitrary chunk splits and content extraction from JSON and repr() payloads
+"""
+
+import json
+
+import pytest
+
+from src.sse import SSEDecoder, decode_content, extract_field
+
+
+def feed_all(chunks, close=True):
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    if close:
+        events.extend(decoder.close())
+    return decoder, events
+
+
+def every_split(data: bytes):
+    """The stream cut into two chunks at every byte position, then one byte at a time"""
+    for i in range(len(data) + 1):
+        yield [data[:i], data[i:]]
+    yield [data[i:i + 1] for i in range(len(data))]
+
+
+# --- Framing ---------------------------------------------------------------
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r", b"\r\n"], ids=["lf", "cr", "crlf"])
+def test_line_endings_split_across_chunks(newline):
+    stream = b"data: uno" + newline + newline + b"data: dos" + newline + newline
+    for chunks in every_split(stream):
+        _, events = feed_all(chunks)
+        assert [e.data for e in events] == ["uno", "dos"], chunks
+
+
+def test_mixed_line_endings():
+    _, events = feed_all([b"data: a\r\ndata: b\rdata: c\n\r\n"])
+    assert [e.data for e in events] == ["a\nb\nc"]
+
+
+def test_cr_at_chunk_end_is_not_a_blank_line():
+    # The LF after a chunk-final CR belongs to the same line ending
+    _, events = feed_all([b"data: a\r", b"\ndata: b\r\n\r\n"])
+    assert [e.data for e in events] == ["a\nb"]
+
+
+def test_bom_is_stripped_once():
+    stream = "\ufeffdata: hola\n\n".encode("utf-8")
+    for chunks in every_split(stream):
+        _, events = feed_all(chunks)
+        assert [e.data for e in events] == ["hola"], chunks
+
+
+def test_bom_only_at_stream_start():
+    _, events = feed_all(["data: a\n\n\ufeffdata: b\n\n".encode("utf-8")])
+    # A later BOM is part of the field name, so the second line is not a data field
+    assert [e.data for e in events] == ["a"]
+
+
+def test_multiline_data():
+    stream = b"data: primera\ndata:segunda\ndata\ndata: \n\n"
+    for chunks in every_split(stream):
+        _, events = feed_all(chunks)
+        assert [e.data for e in events] == ["primera\nsegunda\n\n"], chunks
+
+
+def test_id_and_retry_fields():
+    stream = b"id: 1\nretry: 2500\ndata: a\n\nid: 2\nretry: pronto\nevent: delta\ndata: b\n\n"
+    decoder, events = feed_all([stream])
+    assert [(e.id, e.event, e.retry, e.data) for e in events] == [
+        ("1", "message", 2500, "a"),
+        ("2", "delta", 2500, "b"),
+    ]
+    assert decoder.last_event_id == "2"
+    assert decoder.retry == 2500
+
+
+def test_id_persists_and_null_id_is_ignored():
+    decoder, events = feed_all([b"id: 7\ndata: a\n\nid: 8\x00\ndata: b\n\nid\ndata: c\n\n"])
+    assert [e.id for e in events] == ["7", "7", ""]
+    assert decoder.last_event_id == ""
+
+
+def test_comments_and_events_without_data():
+    _, events = feed_all([b": ping\n\nevent: vacio\n\n:\ndata: x\n\n"])
+    assert [(e.event, e.data) for e in events] == [("message", "x")]
+
+
+def test_unterminated_event_is_dropped_on_close():
+    decoder, events = feed_all([b"data: a\n\nid: 3\ndata: b"])
+    assert [e.data for e in events] == ["a"]
+    assert decoder.last_event_id == "3"
+
+
+def test_utf8_split_inside_character():
+    stream = "data: año ☃ 𝄞\n\n".encode("utf-8")
+    for chunks in every_split(stream):
+        _, events = feed_all(chunks)
+        assert [e.data for e in events] == ["año ☃ 𝄞"], chunks
+
+
+def test_long_event_across_many_chunks():
+    text = "x" * 10000
+    stream = f"data: {text}\n\n".encode("ascii")
+    _, events = feed_all([stream[i:i + 7] for i in range(0, len(stream), 7)])
+    assert [e.data for e in events] == [text]
+
+
+# --- Content extraction ----------------------------------------------------
+
+def repr_event(text: str) -> str:
+    return '{"type": "content", "content": %r}' % text
+
+
+def json_event(text: str, ensure_ascii: bool = True) -> str:
+    return json.dumps({"type": "content", "content": text}, ensure_ascii=ensure_ascii)
+
+
+CONTENTS = [
+    "plain text",
+    "it's",
+    'a "quoted" word',
+    "both 'single' and \"double\"",
+    "line\nbreak\tand tab",
+    "back\\slash",
+    "ends with backslash\\",
+    "\\'",
+    "año, niñez y política",
+    "Ελληνικά и русский 中文",
+    "emoji 😀 and clef 𝄞",
+    "line\u2028separator",
+    "\x00\x07 control",
+]
+
+
+@pytest.mark.parametrize("text", CONTENTS)
+def test_repr_payloads(text):
+    assert decode_content(repr_event(text)) == text
+
+
+@pytest.mark.parametrize("text", CONTENTS)
+@pytest.mark.parametrize("ensure_ascii", [True, False], ids=["ascii", "utf8"])
+def test_json_payloads(text, ensure_ascii):
+    assert decode_content(json_event(text, ensure_ascii)) == text
+
+
+def test_repr_picks_quote_type():
+    # repr() switches to double quotes when the text has a single quote only
+    assert repr_event("it's").endswith('"it\'s"}')
+    assert decode_content('{"type": "content", "content": "it\'s"}') == "it's"
+    assert decode_content("{\"type\": \"content\", \"content\": 'say \"hi\"'}") == 'say "hi"'
+    assert decode_content("{\"type\": \"content\", \"content\": 'it\\'s \"x\"'}") == 'it\'s "x"'
+
+
+def test_json_escaped_slash():
+    assert decode_content('{"type": "content", "content": "a\\/b <\\/table>"}') == "a/b </table>"
+
+
+def test_json_surrogate_pairs():
+    payload = '{"type": "content", "content": "clef \\ud834\\udd1e, emoji \\ud83d\\ude00"}'
+    assert decode_content(payload) == "clef 𝄞, emoji 😀"
+
+
+def test_json_unicode_escapes_with_escaped_slash():
+    assert decode_content('{"content": "\\u00f1\\/\\ud83d\\ude00"}') == "ñ/😀"
+
+
+@pytest.mark.parametrize("payload, expected", [
+    ('{"type": "content", "content": "sin cerrar', "sin cerrar"),
+    ("{\"type\": \"content\", \"content\": 'corta\\'s", "corta's"),
+    ('{"type": "content", "content": "escape al final\\', "escape al final\\"),
+    ('{"type": "content", "content": "hex cortado \\u00', "hex cortado \\u00"),
+])
+def test_truncated_values(payload, expected):
+    assert decode_content(payload) == expected
+
+
+def test_content_not_first_key():
+    payload = '{"type": "content", "meta": {"k": "content", "l": [1, "}"]}, "content": "valor"}'
+    assert decode_content(payload) == "valor"
+
+
+def test_nested_content_key_is_not_top_level():
+    assert extract_field('{"meta": {"content": "interno"}}') is None
+
+
+@pytest.mark.parametrize("payload", [
+    "",
+    "[DONE]",
+    '{"type": "content", "content": ""}',
+    "{\"type\": \"content\", \"content\": ''}",
+    '{"type": "end"}',
+    "not an object",
+    '{"content": 3}',
+])
+def test_no_content(payload):
+    assert decode_content(payload) is None
+
+
+def test_fast_path_rejects_unescaped_quote():
+    # An unescaped closing quote inside the value means the fast path's slice is wrong
+    payload = '{"type": "content", "content": "a", "extra": "b"}'
+    assert decode_content(payload) == "a"
+
+
+def test_decoder_and_content_together():
+    texts = ["uno\n", "it's", 'dos "tres"', "año 😀"]
+    stream = b"".join(
+        b"id: %d\ndata: %s\n\n" % (i, payload.encode("utf-8"))
+        for i, text in enumerate(texts)
+        for payload in (repr_event(text) if i % 2 else json_event(text),)
+    ) + b"data: [DONE]\n\n"
+    for size in (1, 3, 64):
+        _, events = feed_all([stream[i:i + size] for i in range(0, len(stream), size)])
+        assert [c for c in (decode_content(e.data) for e in events) if c] == texts
@@ -0,0 +1,117 @@
+"""
+Tests for src.timeouts through the client
+Phase deadlines, heartbeat resets and connect retries against a misbehaving mock backend
+"""
+
+import socket
+import threading
+import time
+from dataclasses import replace
+
+import pytest
+
+from benchmarks.fakes import FakePlaceholder
+from benchmarks.mock_server import MockBackend, MockConfig, expected_answer
+from src.client import INTERRUPTED_MARKER, get_api_response_streaming
+from src.metrics import registry
+from src.timeouts import StreamPolicy
+
+# Deadlines scaled down to fractions of a second
+POLICY = StreamPolicy(total=3.0, connect=0.5, first_byte=0.5, idle=0.3, connect_retries=0, backoff=0.1, backoff_max=0.4)
+BASE = MockConfig(chunks=40, interval=0.005)
+
+# Seconds before the late_start backend starts listening
+LATE_START = 0.6
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def counters(url: str) -> tuple:
+    """Request outcomes and connect retries recorded so far for `url`"""
+    snapshot = registry.snapshot()["counters"]
+    outcomes = dict(snapshot.get("esma_requests_total", {}).get(url, {}))
+    retries = snapshot.get("esma_connect_retries_total", {}).get(url, {}).get("all", 0)
+    return outcomes, retries
+
+
+def ask(url: str, name: str, policy: StreamPolicy) -> tuple:
+    """The answer, its outcome label, connect retries and seconds taken"""
+    before, retries_before = counters(url)
+    start = time.perf_counter()
+    response = get_api_response_streaming("pregunta", f"timeouts-{name}", FakePlaceholder(), url, policy=policy)
+    seconds = time.perf_counter() - start
+    after, retries_after = counters(url)
+    labels = [label for label, count in after.items() if count > before.get(label, 0)]
+    assert len(labels) == 1, after
+    return response, labels[0], retries_after - retries_before, seconds
+
+
+def classify(response: str, expected: str) -> str:
+    if response == expected:
+        return "complete"
+    if response.endswith(INTERRUPTED_MARKER):
+        return "partial" if expected.startswith(response[:-len(INTERRUPTED_MARKER)]) else "corrupt"
+    return "error"
+
+
+@pytest.mark.parametrize("mock, settings, result, label, max_seconds", [
+    # Headers never come; fails on the first-byte deadline, not the total
+    ({"headers_delay": 5.0}, {}, "error", "timeout_first_byte", 1.0),
+    # Long silence before the answer, with `: ping` comments
+    ({"first_chunk_delay": 1.0, "heartbeat_interval": 0.1}, {}, "complete", "ok", 2.0),
+    # The same silence without comments
+    ({"first_chunk_delay": 1.0}, {}, "error", "timeout_first_byte", 1.0),
+    # Stalls halfway for longer than the idle deadline, but comments keep resetting it
+    ({"stall_after": 20, "stall": 1.0, "heartbeat_interval": 0.1}, {}, "complete", "ok", 2.0),
+    # Stalls halfway in silence
+    ({"stall_after": 20, "stall": 2.0}, {}, "partial", "interrupted", 1.0),
+    # As above with SSE event IDs; resumed after the idle deadline
+    ({"stall_after": 20, "stall": 2.0, "event_ids": True, "retry_ms": 10}, {}, "complete", "ok", 2.0),
+    # Slower than the total deadline
+    ({"interval": 0.2}, {"total": 1.0}, "partial", "interrupted", 1.5),
+], ids=[
+    "dead_backend", "thinking_heartbeat", "thinking_silent", "stall_heartbeat",
+    "stall_silent", "stall_resume", "total",
+])
+def test_phase_deadlines(request, mock, settings, result, label, max_seconds):
+    config = replace(BASE, **mock)
+    with MockBackend(config) as backend:
+        response, outcome, _, seconds = ask(backend.url, request.node.callspec.id, replace(POLICY, **settings))
+
+    assert classify(response, expected_answer(config)) == result
+    assert outcome == label
+    assert seconds <= max_seconds
+
+
+def test_connect_retries_until_backend_listens():
+    # Nothing listens on the port until the backend is created, so connecting is refused
+    port = free_port()
+    backends = []
+    timer = threading.Timer(LATE_START, lambda: backends.append(MockBackend(BASE, port=port).start()))
+    timer.start()
+    try:
+        response, outcome, retries, seconds = ask(
+            f"http://127.0.0.1:{port}", "late_start", replace(POLICY, connect_retries=8)
+        )
+    finally:
+        timer.join()
+        for backend in backends:
+            backend.stop()
+
+    assert response == expected_answer(BASE)
+    assert outcome == "ok"
+    assert retries >= 1
+    assert seconds <= 2.5
+
+
+def test_refused_without_retries_fails_at_once():
+    response, outcome, retries, seconds = ask(f"http://127.0.0.1:{free_port()}", "refused", POLICY)
+
+    assert classify(response, expected_answer(BASE)) == "error"
+    assert outcome == "connect"
+    assert retries == 0
+    assert seconds <= 0.5